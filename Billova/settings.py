@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'billova_app.middleware.SqlTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'Billova.urls'
@@ -137,6 +138,58 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Send the query count and the database, serializer and view time of every request as a Server-Timing header
+BILLOVA_SERVER_TIMING = DEBUG
+# Requests and queries slower than these thresholds in milliseconds are logged to logs/slow_requests.log
+BILLOVA_SLOW_REQUEST_MS = 500
+BILLOVA_SLOW_QUERY_MS = 100
+
+# Seconds the global user and the global categories are cached per process
+BILLOVA_GLOBAL_CACHE_TTL = 300
+# Seconds the category list of a user (own and global categories) is kept in the cache. Changes invalidate it right
+# away in the cache of the changing process, so with a per-process cache this bounds the staleness in other processes
+BILLOVA_CATEGORY_CACHE_TTL = 300
+
+# Currency the exchange rates are quoted against: a rate tells how much of a currency one unit of it is worth
+BILLOVA_BASE_CURRENCY = 'EUR'
+# Seconds the exchange rates are cached per process outside of requests, e.g. in management commands. Requests
+# compare the version of the cached rates with the database once, so they see new rates of any process at once.
+BILLOVA_EXCHANGE_RATE_CACHE_TTL = 3600
+
+# Number of expenses inserted per batch by the bulk import endpoint
+BILLOVA_IMPORT_BATCH_SIZE = 500
+
+# Number of worker threads processing OCR jobs
+BILLOVA_OCR_WORKERS = 4
+# Process OCR jobs in the request thread instead of the worker pool, e.g. for tests
+BILLOVA_OCR_EAGER = False
+# Maximum number of receipts accepted by the batch OCR endpoint
+BILLOVA_OCR_BATCH_MAX_IMAGES = 50
+# Number of worker threads analyzing the receipts of batch requests, apart from the job workers, and the seconds a
+# batch request waits for them
+BILLOVA_OCR_BATCH_WORKERS = 4
+BILLOVA_OCR_BATCH_TIMEOUT = 120
+# Receipts are downsampled to this longest edge in pixels and re-encoded with this JPEG quality before the upload
+BILLOVA_OCR_MAX_DIMENSION = 2048
+BILLOVA_OCR_JPEG_QUALITY = 85
+
+# Seconds a cached OCR extraction stays valid and maximum number of cached extractions
+BILLOVA_OCR_CACHE_TTL = 30 * 24 * 60 * 60
+BILLOVA_OCR_CACHE_MAX_ENTRIES = 10000
+
+# HTTP client of the OCR provider, timeouts and backoff in seconds
+BILLOVA_OCR_CLIENT = {
+    'URL': os.getenv('VERYFI_API_URL', 'https://api.veryfi.com/api/v8/partner/documents/'),
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 60,
+    'MAX_RETRIES': 3,
+    'BACKOFF': 0.5,
+    'BACKOFF_MAX': 8,
+    'POOL_SIZE': BILLOVA_OCR_WORKERS + BILLOVA_OCR_BATCH_WORKERS,
+    'BREAKER_FAILURE_THRESHOLD': 5,
+    'BREAKER_RESET_TIMEOUT': 30,
+}
+
 '''
 for task #10
 Login and Signup
@@ -181,9 +234,25 @@ LOGS_DIR = BASE_DIR / 'logs'
 if not LOGS_DIR.exists():
     LOGS_DIR.mkdir(parents=True)
 
+# Write the log records of the loggers below from a background thread, so requests do not wait for the log files
+BILLOVA_LOG_QUEUE = True
+# Records waiting to be written at most per process, further records are dropped until the queue has room again
+BILLOVA_LOG_QUEUE_SIZE = 10000
+# Keep one in N records up to INFO of these loggers and their children, e.g. the per object permission checks
+BILLOVA_LOG_SAMPLING = {
+    'billova_app.permissions': 100,
+}
+
+LOGGING_CONFIG = 'billova_app.log_queue.configure_logging'
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'billova_app.log_queue.SamplingFilter',
+            'rates': BILLOVA_LOG_SAMPLING,
+        },
+    },
     'formatters': {
         'verbose': {
             'format': '{levelname} {asctime} {module} {message}',
@@ -206,6 +275,13 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': LOGS_DIR / 'billova_app.log',
             'formatter': 'verbose',
+            'filters': ['sampling'],
+        },
+        'slow_requests_file': {
+            'level': 'WARNING',
+            'class': 'logging.FileHandler',
+            'filename': LOGS_DIR / 'slow_requests.log',
+            'formatter': 'verbose',
         },
         'database_file': {
             'level': LOG_LEVEL,
@@ -217,6 +293,7 @@ LOGGING = {
             'level': LOG_LEVEL,
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
+            'filters': ['sampling'],
         },
     },
     'loggers': {
@@ -230,6 +307,11 @@ LOGGING = {
             'level': LOG_LEVEL,
             'propagate': False,
         },
+        'billova_app.slow_requests': {
+            'handlers': ['slow_requests_file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
         'django.db.backends': {
             'handlers': ['database_file', 'console'],
             'level': LOG_LEVEL,
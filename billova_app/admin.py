@@ -1,9 +1,11 @@
 from django.contrib import admin
 
-from .models import Category, UserSettings, Expense
+from .models import Category, UserSettings, Expense, OcrJob, ExchangeRate
 
 # Register your models here.
 
 admin.site.register(Category)
 admin.site.register(UserSettings)
 admin.site.register(Expense)
+admin.site.register(OcrJob)
+admin.site.register(ExchangeRate)
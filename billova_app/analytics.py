@@ -0,0 +1,112 @@
+from decimal import Decimal
+
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+from rest_framework import serializers
+
+from billova_app.exchange import convert
+from billova_app.models import Expense
+
+# Number of issuers listed by default and at most, the others are summed up
+DEFAULT_TOP_ISSUERS = 10
+MAX_TOP_ISSUERS = 100
+
+
+class AnalyticsParamsSerializer(serializers.Serializer):
+    """
+    Validates the query parameters of the analytics endpoint besides the expense filters.
+    """
+    top = serializers.IntegerField(min_value=1, max_value=MAX_TOP_ISSUERS, default=DEFAULT_TOP_ISSUERS)
+
+
+def _new_group():
+    return {'total': Decimal('0.00'), 'count': 0, 'unconverted': {}}
+
+
+def _add_row(group, row, to_currency, day):
+    # Rows are grouped per currency by the database, so one conversion covers all expenses of a group
+    group['count'] += row['count']
+    converted = convert(row['total'], row['currency'], to_currency, day)
+    if converted is None:
+        group['unconverted'][row['currency']] = group['unconverted'].get(row['currency'], 0) + row['total']
+    else:
+        group['total'] += converted
+
+
+def _finish(group, **fields):
+    item = {**fields, 'total': group['total'], 'count': group['count']}
+    if group['unconverted']:
+        item['unconverted'] = group['unconverted']
+    return item
+
+
+def _by_total(item):
+    return -item['total'], -item['count']
+
+
+def get_totals(queryset, to_currency, day):
+    group = _new_group()
+    for row in queryset.values('currency').annotate(total=Sum('price'), count=Count('id')).order_by():
+        _add_row(group, row, to_currency, day)
+    return _finish(group)
+
+
+def get_category_breakdown(queryset, to_currency, day):
+    """
+    Spend per category, grouped through the `Expense.categories` through table. An expense with several categories
+    counts towards each of them.
+    """
+    rows = (
+        Expense.categories.through.objects.filter(expense__in=queryset)
+        .values('category_id', 'category__name', currency=F('expense__currency'))
+        .annotate(total=Sum('expense__price'), count=Count('expense_id'))
+        .order_by()
+    )
+    groups = {}
+    names = {}
+    for row in rows:
+        names[row['category_id']] = row['category__name']
+        _add_row(groups.setdefault(row['category_id'], _new_group()), row, to_currency, day)
+    items = [_finish(group, category=category_id, name=names[category_id]) for category_id, group in groups.items()]
+    return sorted(items, key=_by_total)
+
+
+def get_issuer_breakdown(queryset, to_currency, day, top):
+    """
+    Spend of the `top` issuers with the highest spend, and the sum of all other issuers.
+    """
+    rows = queryset.values('invoice_issuer', 'currency').annotate(total=Sum('price'), count=Count('id')).order_by()
+    groups = {}
+    for row in rows:
+        _add_row(groups.setdefault(row['invoice_issuer'], _new_group()), row, to_currency, day)
+    items = sorted((_finish(group, issuer=issuer) for issuer, group in groups.items()), key=_by_total)
+
+    others = _new_group()
+    for item in items[top:]:
+        others['total'] += item['total']
+        others['count'] += item['count']
+        for currency, total in item.get('unconverted', {}).items():
+            others['unconverted'][currency] = others['unconverted'].get(currency, 0) + total
+    return items[:top], _finish(others, issuers=max(len(items) - top, 0))
+
+
+def get_time_breakdown(queryset, to_currency, day, tzinfo):
+    """
+    Spend per ISO weekday (1 is Monday) and per hour of the day in the given time zone, both taken from a single
+    query grouped by weekday and hour.
+    """
+    rows = (
+        queryset
+        .annotate(weekday=ExtractIsoWeekDay('invoice_date_time', tzinfo=tzinfo),
+                  hour=ExtractHour('invoice_date_time', tzinfo=tzinfo))
+        .values('weekday', 'hour', 'currency')
+        .annotate(total=Sum('price'), count=Count('id'))
+        .order_by()
+    )
+    weekdays = {weekday: _new_group() for weekday in range(1, 8)}
+    hours = {hour: _new_group() for hour in range(24)}
+    for row in rows:
+        _add_row(weekdays[row['weekday']], row, to_currency, day)
+        _add_row(hours[row['hour']], row, to_currency, day)
+    return ([_finish(group, weekday=weekday) for weekday, group in weekdays.items()],
+            [_finish(group, hour=hour) for hour, group in hours.items()])
@@ -1,34 +1,67 @@
 import logging
+import zoneinfo
+from collections import defaultdict
+from decimal import Decimal
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.contrib.auth.models import User
-from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
-from django.db.models import Sum
-from django.db.models.functions import TruncMonth
+from django.db.models import Count, Max, Prefetch, Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from billova_app.models import Expense, Category, UserSettings
-from billova_app.ocr.receipt import Receipt
+from billova_app.models import Expense, Category, UserSettings, MonthlySpend, OcrJob
+from billova_app.analytics import AnalyticsParamsSerializer, get_category_breakdown, get_issuer_breakdown, \
+    get_time_breakdown, get_totals
+from billova_app.datatables import parse_table_request
+from billova_app.exchange import convert_monthly_totals
+from billova_app.exporters import EXPORT_WRITERS, CONTENT_TYPES
+from billova_app.filters import parse_expense_filters, filter_expenses
+from billova_app.importers import ExpenseImporter, ImportFormatError, ROW_READERS
+from billova_app.ocr.cache import get_ocr_cache
+from billova_app.ocr.jobs import enqueue_ocr_job, analyze_receipts, create_expense_from_receipt, OcrTimeoutError
+from billova_app.pagination import ExpenseCursorPagination
 from billova_app.permissions import IsOwner
-from billova_app.serializers import ExpenseSerializer, CategorySerializer, UserSettingsSerializer, ExpenseOCRSerializer
+from billova_app.search import get_search_terms, ExpenseSearchResults, filter_by_search
+from billova_app.serializers import ExpenseSerializer, CategorySerializer, UserSettingsSerializer, \
+    ExpenseOCRSerializer, ExpenseImportSerializer, OcrJobSerializer, ExpenseOCRBatchSerializer
+from billova_app.utils.category_catalogue import get_category_catalogue
+from billova_app.utils.global_resolver import get_global_user_id
+from billova_app.versions import conditional_on_data_version
 
 # Set up the logger
 logger = logging.getLogger(__name__)
 
 
+@method_decorator(conditional_on_data_version, name='list')
+@method_decorator(conditional_on_data_version, name='retrieve')
 class ExpenseViewSet(LoginRequiredMixin, viewsets.ModelViewSet):
     """
     This ViewSet automatically provides `list`, `create`, `retrieve`, `update`, and `destroy` actions.
+    Read requests support ETag / Last-Modified revalidation, see `billova_app.versions`.
     """
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwner]
 
+    @property
+    def paginator(self):
+        """
+        Use keyset pagination when the client opts in with `?pagination=cursor`, page numbers otherwise.
+        """
+        if not hasattr(self, '_paginator'):
+            if ExpenseCursorPagination.is_requested(self.request):
+                self._paginator = ExpenseCursorPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
     def perform_create(self, serializer):
         try:
             with transaction.atomic():  # Ensure database consistency
@@ -38,57 +71,250 @@ class ExpenseViewSet(LoginRequiredMixin, viewsets.ModelViewSet):
             logger.error(f"Failed to create expense: {e}")
             raise e
 
+    def perform_update(self, serializer):
+        with transaction.atomic():  # Keep the expense and the monthly spend rollup consistent
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
     def get_queryset(self):
         try:
-            queryset = self.queryset.filter(owner=self.request.user)
-            logger.info(f"Retrieved {queryset.count()} expenses for user {self.request.user}")
+            # Load owners and categories (including the owners of the categories) up front, so serializing a page
+            # costs a constant number of queries instead of one per expense
+            queryset = (
+                self.queryset.filter(owner=self.request.user)
+                .select_related('owner')
+                .prefetch_related(Prefetch('categories', queryset=Category.objects.select_related('owner')))
+            )
+            logger.debug(f"Retrieving expenses for user {self.request.user}")
             return queryset
         except Exception as e:
             logger.error(f"Failed to retrieve expenses for user {self.request.user}: {e}")
             raise e
 
+    def filter_queryset(self, queryset):
+        """
+        Applies the filters of the query parameters to the expense list, see `ExpenseFilterSerializer`.
+        Invalid filters are answered with 400.
+        """
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            queryset = filter_expenses(queryset, parse_expense_filters(self.request.query_params))
+        return queryset
+
+    @action(detail=False, methods=['post'], url_path='import', serializer_class=ExpenseImportSerializer)
+    def import_expenses(self, request):
+        """
+        Imports expenses from a CSV or NDJSON upload. The file is parsed as a stream and stored in batches, rows
+        which fail validation are listed in the returned report.
+        """
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            logger.warning(f"Invalid expense import: {serializer.errors}")
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = serializer.validated_data['file']
+        file_format = serializer.validated_data['file_format']
+        try:
+            logger.info(f"Starting {file_format} expense import for user {request.user}")
+            upload.seek(0)
+            rows = ROW_READERS[file_format](upload.file)
+            report = ExpenseImporter(request.user).run(rows)
+        except ImportFormatError as e:
+            logger.warning(f"Expense import failed for user {request.user}: {e}")
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Expense import failed for user {request.user}: {e}")
+            return Response({'detail': 'Expense import failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response_status = status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST
+        return Response(report, status=response_status)
+
+    @action(detail=False, methods=['get'])
+    @method_decorator(conditional_on_data_version)
+    def search(self, request):
+        """
+        Full-text search over the issuer, note and receipt text of the expenses of the user, e.g.
+        `?q=billa coffee filter`. Every word must match, as a prefix. The results are ranked by relevance and
+        paginated by page number.
+        """
+        query = request.query_params.get('q', '')
+        if not get_search_terms(query):
+            return Response({'q': 'Enter at least one search term.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Counted and sliced in SQL by the paginator. Ranked results have no stable sort key for a cursor, so they
+        # are always paginated by page number.
+        results = ExpenseSearchResults(request.user, query)
+        paginator = PageNumberPagination()
+        page_ids = paginator.paginate_queryset(results, request, view=self)
+        logger.info(f"Expense search of user {request.user} found {results.count()} expenses")
+        expenses = self.get_queryset().in_bulk(page_ids)
+        page = [expenses[expense_id] for expense_id in page_ids if expense_id in expenses]
+
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    @method_decorator(conditional_on_data_version)
+    def table(self, request):
+        """
+        Serves the expenses overview table in the server-side processing mode of DataTables
+        (`draw`, `start`, `length`, `order[i][...]`, `columns[i][data]`, `search[value]`): only the visible page is
+        loaded, and ordering and searching are done by the database. The filters of the expense list can be added.
+        """
+        table_request = parse_table_request(request.query_params)
+        filters = parse_expense_filters(request.query_params)
+
+        queryset = self.get_queryset()
+        records_total = queryset.count()
+        filtered = filter_by_search(filter_expenses(queryset, filters), table_request['search'], request.user.id)
+        records_filtered = filtered.count() if filters or get_search_terms(table_request['search']) else records_total
+
+        ordering = table_request['ordering'] or ['-invoice_date_time']
+        start = table_request['start']
+        page = filtered.order_by(*ordering, '-id')[start:start + table_request['length']]
+        serializer = self.get_serializer(page, many=True)
+
+        return Response({
+            'draw': table_request['draw'],
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'data': serializer.data,
+        })
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Streams the expenses of the user as CSV (default) or NDJSON (`?export_format=ndjson`), optionally filtered
+        like the expense list. The expenses are fetched in chunks, so memory use stays flat.
+        """
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_WRITERS:
+            return Response({'export_format': f"Must be one of: {', '.join(EXPORT_WRITERS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        filters = parse_expense_filters(request.query_params)
+        queryset = filter_expenses(Expense.objects.filter(owner=request.user), filters)
+        logger.info(f"Starting {export_format} expense export for user {request.user}")
+
+        response = StreamingHttpResponse(EXPORT_WRITERS[export_format](queryset),
+                                         content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="expenses.{export_format}"'
+        return response
+
     @action(detail=False, methods=['post'], url_path='ocr', serializer_class=ExpenseOCRSerializer)
     def ocr(self, request):
+        """
+        Queues the uploaded receipt for OCR processing and answers with 202 and the created job right away.
+        The job can be polled under its url, the expense is created once the job is done.
+        """
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             try:
-                logger.info("Starting OCR processing")
-                image = serializer.validated_data['image']
-                receipt = Receipt(image.file.read())
-                receipt.analyze()
-
                 with transaction.atomic():
-                    expense = Expense.objects.create(
-                        owner=request.user,
-                        invoice_date_time=receipt.invoice_date_time,
-                        price=receipt.price,
-                        currency=UserSettings.objects.get(owner=self.request.user).currency,
-                        invoice_issuer=receipt.invoice_issuer,
-                        invoice_as_text=receipt.invoice_as_text,
-                    )
-                    global_user = User.objects.get(username='global')
-                    category, created = Category.objects.get_or_create(name="Generated", owner=global_user)
-                    expense.categories.set([category])
-
-                logger.info(f"OCR processed successfully. Expense created: {expense}")
-                expense_serializer = ExpenseSerializer(expense, context={'request': request})
-                return Response(expense_serializer.data, status=status.HTTP_201_CREATED)
-
-            except ObjectDoesNotExist as e:
-                logger.error(f"User or Category object does not exist: {e}")
-                return Response({'detail': 'Required object does not exist'}, status=status.HTTP_400_BAD_REQUEST)
+                    job = OcrJob.objects.create(owner=request.user, image=serializer.validated_data['image'])
+                    enqueue_ocr_job(job)
+
+                job_serializer = OcrJobSerializer(job, context={'request': request})
+                return Response(job_serializer.data, status=status.HTTP_202_ACCEPTED,
+                                headers={'Location': job_serializer.data['url']})
 
             except Exception as e:
-                logger.error(f"OCR processing failed: {e}")
+                logger.error(f"Failed to queue OCR job: {e}")
                 return Response({'detail': 'OCR processing failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
             logger.warning(f"Invalid OCR data: {serializer.errors}")
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], url_path='ocr/batch', serializer_class=ExpenseOCRBatchSerializer)
+    def ocr_batch(self, request):
+        """
+        Analyzes several receipts concurrently and creates all resulting expenses in one transaction.
+        Answers with one result per image, in the order of the uploaded images. Receipts not analyzed within
+        `BILLOVA_OCR_BATCH_TIMEOUT` seconds fail, with 504 if no expense was created.
+        """
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            logger.warning(f"Invalid OCR batch data: {serializer.errors}")
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        images = serializer.validated_data['images']
+        try:
+            logger.info(f"Starting OCR processing of {len(images)} receipts")
+            receipts = analyze_receipts(images)
+
+            results = []
+            with transaction.atomic():
+                for image, receipt in zip(images, receipts):
+                    if isinstance(receipt, Exception):
+                        logger.warning(f"OCR processing of {image.name} failed: {receipt}")
+                        results.append({'image': image.name, 'status': 'failed', 'error': str(receipt)})
+                        continue
+
+                    expense = create_expense_from_receipt(request.user, receipt)
+                    results.append({'image': image.name, 'status': 'created',
+                                    'expense': ExpenseSerializer(expense, context={'request': request}).data})
 
+        except Exception as e:
+            logger.error(f"OCR batch processing failed: {e}")
+            return Response({'detail': 'OCR processing failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        created = sum(result['status'] == 'created' for result in results)
+        logger.info(f"OCR batch processed: {created} of {len(images)} expenses created")
+        if created:
+            response_status = status.HTTP_201_CREATED
+        elif any(isinstance(receipt, OcrTimeoutError) for receipt in receipts):
+            response_status = status.HTTP_504_GATEWAY_TIMEOUT
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'failed': len(images) - created, 'results': results},
+                        status=response_status)
+
+
+class OcrJobViewSet(LoginRequiredMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    This ViewSet provides the `list` and `retrieve` actions for the OCR jobs of the user.
+    """
+    queryset = OcrJob.objects.all()
+    serializer_class = OcrJobSerializer
+    permission_classes = [permissions.IsAuthenticated, IsOwner]
+
+    def get_queryset(self):
+        return (
+            self.queryset.filter(owner=self.request.user)
+            .select_related('owner', 'expense__owner')
+            .prefetch_related(Prefetch('expense__categories', queryset=Category.objects.select_related('owner')))
+        )
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """
+        Returns the hit and miss counters of the OCR result cache of this process.
+        """
+        return Response(get_ocr_cache().stats())
+
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        """
+        Returns the created expense of a finished job, 202 with the job while it is still processed.
+        """
+        job = self.get_object()
+        if job.status == OcrJob.STATUS_DONE and job.expense:
+            return Response(ExpenseSerializer(job.expense, context={'request': request}).data)
+        if job.status == OcrJob.STATUS_FAILED:
+            return Response({'detail': 'OCR processing failed', 'error': job.error},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+@method_decorator(conditional_on_data_version, name='list')
+@method_decorator(conditional_on_data_version, name='retrieve')
 class CategoryViewSet(LoginRequiredMixin, viewsets.ModelViewSet):
     """
     This ViewSet automatically provides `list`, `create`, `retrieve`, `update`, and `destroy` actions.
+    Read requests support ETag / Last-Modified revalidation, see `billova_app.versions`.
     """
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -102,11 +328,25 @@ class CategoryViewSet(LoginRequiredMixin, viewsets.ModelViewSet):
             logger.error(f"Failed to create category: {e}")
             raise e
 
+    def list(self, request, *args, **kwargs):
+        """
+        Lists the own and the global categories of the user from the cached catalogue, see
+        `get_category_catalogue`. The other actions read the database.
+        """
+        categories = get_category_catalogue(request.user)
+        page = self.paginate_queryset(categories)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(categories, many=True)
+        return Response(serializer.data)
+
     def get_queryset(self):
         try:
-            global_user = User.objects.get(username='global')
-            queryset = Category.objects.filter(owner__in=[self.request.user, global_user])
-            logger.info(f"Retrieved {queryset.count()} categories for user {self.request.user}")
+            queryset = Category.objects.filter(
+                owner_id__in=[self.request.user.id, get_global_user_id()]).select_related('owner')
+            logger.debug(f"Retrieving categories for user {self.request.user}")
             return queryset
         except Exception as e:
             logger.error(f"Failed to retrieve categories for user {self.request.user}: {e}")
@@ -133,39 +373,46 @@ class UserSettingsViewSet(LoginRequiredMixin, viewsets.ModelViewSet):
 class MonthlyExpensesViewSet(LoginRequiredMixin, viewsets.ViewSet):
     """
     A ViewSet for listing monthly expenses grouped by months.
+    The totals are converted into the currency of the user settings, see `billova_app.exchange`.
     """
     permission_classes = [permissions.IsAuthenticated, IsOwner]
 
+    @method_decorator(conditional_on_data_version)
     def list(self, request):
         user = request.user
         try:
             logger.info(f"Fetching monthly expenses for user {user}")
+            # Read the precomputed totals of the monthly spend rollup instead of aggregating all expenses. The rollup
+            # keeps a total per currency, months spent in a single currency need no further query.
             expenses = (
-                Expense.objects.filter(owner=user)
-                .annotate(month=TruncMonth('invoice_date_time'))
+                MonthlySpend.objects.filter(owner=user, category__isnull=True)
                 .values('month')
-                .annotate(total_spent=Sum('price'))
+                .annotate(total_spent=Sum('total'), currency_count=Count('currency'), currency=Max('currency'))
                 .order_by('-month')
             )
 
             paginator = PageNumberPagination()
             paginated_expenses = paginator.paginate_queryset(expenses, request)
 
-            categories_by_month = {}
-            for expense in Expense.objects.filter(owner=user):
-                month = expense.invoice_date_time.strftime('%Y-%m')
-                if month not in categories_by_month:
-                    categories_by_month[month] = set()
-                categories_by_month[month].update(expense.categories.values_list('name', flat=True))
-
-            response_data = [
-                {
-                    'month': expense['month'].strftime('%B %Y'),
-                    'total_spent': expense['total_spent'],
-                    'categories': list(categories_by_month[expense['month'].strftime('%Y-%m')]),
+            months = [expense['month'] for expense in paginated_expenses]
+            categories_by_month = self._get_categories_by_month(user, months)
+            currency = self._get_user_currency(user)
+            totals, unconverted = convert_monthly_totals(
+                self._get_totals_by_currency(user, paginated_expenses), currency)
+
+            response_data = []
+            for expense in paginated_expenses:
+                month = expense['month']
+                row = {
+                    'month': month.strftime('%B %Y'),
+                    'total_spent': totals.get(month, Decimal('0.00')),
+                    'currency': currency,
+                    'categories': sorted(categories_by_month[month]),
                 }
-                for expense in paginated_expenses
-            ]
+                if unconverted.get(month):
+                    # Amounts in currencies without an exchange rate are listed apart instead of being dropped
+                    row['unconverted'] = unconverted[month]
+                response_data.append(row)
 
             logger.info(f"Successfully fetched monthly expenses for user {user}")
             return paginator.get_paginated_response(response_data)
@@ -175,6 +422,90 @@ class MonthlyExpensesViewSet(LoginRequiredMixin, viewsets.ViewSet):
             return Response({'detail': 'Failed to fetch monthly expenses'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    def _get_user_currency(user):
+        currency = UserSettings.objects.filter(owner=user).values_list('currency', flat=True).first()
+        return currency or settings.BILLOVA_BASE_CURRENCY
+
+    @staticmethod
+    def _get_totals_by_currency(user, paginated_expenses):
+        """
+        Returns the (month, currency, total) rows of the months of the current page. Only months with expenses in
+        several currencies are queried.
+        """
+        rows = [(expense['month'], expense['currency'], expense['total_spent'])
+                for expense in paginated_expenses if expense['currency_count'] == 1]
+        mixed_months = [expense['month'] for expense in paginated_expenses if expense['currency_count'] > 1]
+        if mixed_months:
+            rows.extend(
+                MonthlySpend.objects.filter(owner=user, category__isnull=True, month__in=mixed_months)
+                .values_list('month', 'currency', 'total')
+            )
+        return rows
+
+    @staticmethod
+    def _get_categories_by_month(user, months):
+        """
+        Collect the category names per month from the monthly spend rollup, restricted to the months of the
+        current page.
+        """
+        categories_by_month = defaultdict(set)
+        if not months:
+            return categories_by_month
+
+        rows = (
+            MonthlySpend.objects
+            .filter(owner=user, category__isnull=False, month__in=months)
+            .values_list('month', 'category__name')
+            .distinct()
+        )
+        for month, category_name in rows:
+            categories_by_month[month].add(category_name)
+
+        return categories_by_month
+
+
+class AnalyticsViewSet(LoginRequiredMixin, viewsets.ViewSet):
+    """
+    Spend of the user by category, by issuer (the `top` issuers and the rest), by weekday and by hour, over the
+    expenses matching the expense filters (e.g. `?date_from=2024-01-01&date_to=2024-12-31&top=5`).
+
+    Every breakdown is one grouped query. The totals are converted into the currency of the user settings with the
+    exchange rates of the end of the period, weekdays and hours are in the time zone of the user settings.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsOwner]
+
+    @method_decorator(conditional_on_data_version)
+    def list(self, request):
+        filters = parse_expense_filters(request.query_params)
+        params = AnalyticsParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+
+        user_settings = UserSettings.objects.filter(owner=request.user).values('currency', 'timezone').first() or {}
+        currency = user_settings.get('currency') or settings.BILLOVA_BASE_CURRENCY
+        try:
+            tzinfo = zoneinfo.ZoneInfo(user_settings.get('timezone') or settings.TIME_ZONE)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            tzinfo = timezone.get_current_timezone()
+
+        # The rates of the end of the period, or of today for open periods
+        day = filters.get('date_to') or timezone.localdate()
+        queryset = filter_expenses(Expense.objects.filter(owner=request.user), filters)
+
+        top_issuers, other_issuers = get_issuer_breakdown(queryset, currency, day, params.validated_data['top'])
+        by_weekday, by_hour = get_time_breakdown(queryset, currency, day, tzinfo)
+        return Response({
+            'currency': currency,
+            'date_from': filters.get('date_from'),
+            'date_to': filters.get('date_to'),
+            'total': get_totals(queryset, currency, day),
+            'by_category': get_category_breakdown(queryset, currency, day),
+            'top_issuers': top_issuers,
+            'other_issuers': other_issuers,
+            'by_weekday': by_weekday,
+            'by_hour': by_hour,
+        })
+
 
 class FrontendLogView(APIView, LoginRequiredMixin):
     """
@@ -7,3 +7,6 @@ class BillovaAppConfig(AppConfig):
 
     def ready(self):
         import billova_app.signals  # Ensure signals are imported
+
+        from billova_app.middleware import instrument_serializers
+        instrument_serializers()
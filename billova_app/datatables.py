@@ -0,0 +1,79 @@
+import re
+
+from rest_framework import serializers
+
+# Columns the table can be ordered by, mapped to the model fields. Other columns (categories, actions) are shown
+# but not orderable.
+ORDERABLE_COLUMNS = {
+    'invoice_date_time': 'invoice_date_time',
+    'price': 'price',
+    'currency': 'currency',
+    'note': 'note',
+    'invoice_issuer': 'invoice_issuer',
+}
+
+# Upper limit of rows per table page, also used when the table asks for all rows (`length=-1`)
+MAX_TABLE_PAGE_LENGTH = 100
+
+_ORDER_PARAM = re.compile(r'^order\[(\d+)\]\[(column|dir)\]$')
+_COLUMN_PARAM = re.compile(r'^columns\[(\d+)\]\[data\]$')
+
+
+class TableRequestSerializer(serializers.Serializer):
+    """
+    Validates the paging and search parameters sent by DataTables in server-side processing mode.
+
+    Docs:
+        https://datatables.net/manual/server-side
+    """
+    draw = serializers.IntegerField(min_value=0, default=0)
+    start = serializers.IntegerField(min_value=0, default=0)
+    length = serializers.IntegerField(min_value=-1, default=10)
+    search = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate_length(self, value):
+        if value == -1 or value > MAX_TABLE_PAGE_LENGTH:
+            return MAX_TABLE_PAGE_LENGTH
+        return value
+
+
+def parse_table_request(query_params):
+    """
+    Reads the DataTables request from the query parameters.
+    Raises a `ValidationError` (answered with 400 by DRF) for invalid values.
+
+    Returns:
+        dict: draw, start, length and search, plus the ordering as a list of model field names prefixed with '-'
+        for descending columns.
+    """
+    data = {key: query_params[key] for key in ('draw', 'start', 'length') if key in query_params}
+    if 'search[value]' in query_params:
+        data['search'] = query_params['search[value]']
+
+    serializer = TableRequestSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    table_request = dict(serializer.validated_data)
+
+    columns = {}
+    orders = {}
+    for key, value in query_params.items():
+        if match := _COLUMN_PARAM.match(key):
+            columns[int(match.group(1))] = value
+        elif match := _ORDER_PARAM.match(key):
+            orders.setdefault(int(match.group(1)), {})[match.group(2)] = value
+
+    ordering = []
+    for _, order in sorted(orders.items()):
+        try:
+            column = columns[int(order.get('column', ''))]
+        except (KeyError, ValueError):
+            raise serializers.ValidationError({'order': 'Refers to an unknown column.'})
+        if column not in ORDERABLE_COLUMNS:
+            raise serializers.ValidationError({'order': f"Column '{column}' is not orderable."})
+        if order.get('dir', 'asc') not in ('asc', 'desc'):
+            raise serializers.ValidationError({'order': "Direction must be 'asc' or 'desc'."})
+        prefix = '-' if order.get('dir') == 'desc' else ''
+        ordering.append(prefix + ORDERABLE_COLUMNS[column])
+
+    table_request['ordering'] = ordering
+    return table_request
@@ -0,0 +1,243 @@
+import csv
+import logging
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import transaction
+
+from billova_app.models import DataVersion, ExchangeRate
+from billova_app.utils.global_resolver import get_global_user_id
+from billova_app.versions import bump_data_versions
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+# Rows written per INSERT when a rates file is loaded
+LOAD_BATCH_SIZE = 1000
+
+_lock = threading.Lock()
+_rates = None
+_version = None
+# Per thread: when the version of the cached rates was last compared with the database, reset by every request
+_checks = threading.local()
+
+
+def _reset_version_check(**kwargs):
+    _checks.checked_at = None
+
+
+request_started.connect(_reset_version_check, dispatch_uid='billova_app.exchange')
+
+
+def _get_rates_version():
+    # `store_exchange_rates` bumps the data version of the global user, in any process. The same version is part of
+    # the ETags, so a response carrying the new ETag is never computed with the old rates.
+    try:
+        owner_id = get_global_user_id()
+    except User.DoesNotExist:
+        return None
+    return DataVersion.objects.filter(owner_id=owner_id).values_list('version', flat=True).first()
+
+
+def _get_rates():
+    """
+    Returns the exchange rates as a dictionary mapping currencies to their (dates, rates) lists, sorted by date.
+
+    The table is loaded once per process and reloaded when its version changed, by `store_exchange_rates` in any
+    process. The version is read at most once per request, and outside of requests at most once per
+    `BILLOVA_EXCHANGE_RATE_CACHE_TTL` seconds.
+    """
+    global _rates, _version
+    checked_at = getattr(_checks, 'checked_at', None)
+    if (_rates is not None and checked_at is not None
+            and time.monotonic() - checked_at <= settings.BILLOVA_EXCHANGE_RATE_CACHE_TTL):
+        return _rates
+
+    version = _get_rates_version()
+    with _lock:
+        if _rates is None or version != _version:
+            rates = defaultdict(lambda: ([], []))
+            for currency, date, rate in ExchangeRate.objects.order_by('currency', 'date').values_list(
+                    'currency', 'date', 'rate'):
+                dates, values = rates[currency]
+                dates.append(date)
+                values.append(rate)
+            _rates = dict(rates)
+            _version = version
+            logger.debug(f"Exchange rates loaded for {len(_rates)} currencies, version {version}.")
+        _checks.checked_at = time.monotonic()
+        return _rates
+
+
+def invalidate_exchange_rates():
+    global _rates
+    with _lock:
+        _rates = None
+
+
+def get_rate(currency, day):
+    """
+    Returns the value of one unit of the base currency in the given currency on the given day: the last rate
+    published on or before the day, or the first one for days before it. Returns None if the currency has no rates.
+    """
+    if currency == settings.BILLOVA_BASE_CURRENCY:
+        return Decimal(1)
+
+    entry = _get_rates().get(currency)
+    if entry is None:
+        return None
+    dates, rates = entry
+    return rates[max(bisect_right(dates, day) - 1, 0)]
+
+
+def convert(amount, from_currency, to_currency, day):
+    """
+    Converts an amount between two currencies with the rates of the given day.
+    Returns None if a rate is missing.
+    """
+    if from_currency == to_currency:
+        return amount
+
+    from_rate = get_rate(from_currency, day)
+    to_rate = get_rate(to_currency, day)
+    if from_rate is None or to_rate is None:
+        return None
+    return (amount / from_rate * to_rate).quantize(CENT)
+
+
+def _last_day_of_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def convert_monthly_totals(rows, to_currency):
+    """
+    Converts monthly totals kept per currency into a single currency, one conversion per (month, currency) group
+    instead of one per expense. The rates at the end of each month are used.
+
+    Args:
+        rows: (month, currency, total) tuples, months being the first day of the month.
+        to_currency (str): The currency to convert into.
+
+    Returns:
+        tuple: A dictionary mapping months to the converted totals, and one mapping months to {currency: total}
+        of the amounts which could not be converted for lack of a rate.
+    """
+    totals = defaultdict(Decimal)
+    unconverted = defaultdict(dict)
+    for month, currency, total in rows:
+        converted = convert(total, currency, to_currency, _last_day_of_month(month))
+        if converted is None:
+            unconverted[month][currency] = total
+            logger.warning(f"No exchange rate to convert {currency} into {to_currency} for {month:%Y-%m}")
+            continue
+        totals[month] += converted
+    return totals, unconverted
+
+
+class RatesFileError(ValueError):
+    pass
+
+
+def _parse_rate(value, line_number):
+    try:
+        rate = Decimal(value)
+    except InvalidOperation:
+        raise RatesFileError(f"Line {line_number}: invalid rate '{value}'.")
+    if rate <= 0:
+        raise RatesFileError(f"Line {line_number}: rates must be positive.")
+    return rate
+
+
+def read_exchange_rates(file):
+    """
+    Reads exchange rates against `BILLOVA_BASE_CURRENCY` from a CSV text file and yields (currency, date, rate)
+    tuples. Two layouts are understood:
+
+    - one rate per line with the columns `date`, `currency` and `rate`
+    - one day per line with a `Date` column and a column per currency, like the historical reference rates file
+      of the ECB (eurofxref-hist.csv). Empty and `N/A` cells are skipped.
+
+    Raises `RatesFileError` for malformed lines.
+    """
+    reader = csv.reader(file)
+    header = [column.strip() for column in next(reader, [])]
+    columns = [column.lower() for column in header]
+    if 'date' not in columns:
+        raise RatesFileError("The rates file needs a 'date' column.")
+    date_index = columns.index('date')
+    long_format = 'currency' in columns and 'rate' in columns
+
+    for line_number, row in enumerate(reader, 2):
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            day = date.fromisoformat(row[date_index].strip())
+        except (IndexError, ValueError):
+            raise RatesFileError(f"Line {line_number}: invalid date.")
+
+        if long_format:
+            try:
+                currency, rate = row[columns.index('currency')].strip().upper(), row[columns.index('rate')].strip()
+            except IndexError:
+                raise RatesFileError(f"Line {line_number}: missing currency or rate.")
+            if len(currency) != 3:
+                raise RatesFileError(f"Line {line_number}: invalid currency '{currency}'.")
+            yield currency, day, _parse_rate(rate, line_number)
+            continue
+
+        for index, cell in enumerate(row):
+            cell = cell.strip()
+            if index == date_index or index >= len(header) or not header[index] or cell in ('', 'N/A'):
+                continue
+            yield header[index].upper(), day, _parse_rate(cell, line_number)
+
+
+def store_exchange_rates(rates, replace=False):
+    """
+    Stores (currency, date, rate) tuples, overwriting the rates of the same currency and day, and invalidates the
+    cached rates. With `replace` all rates are deleted first.
+
+    Returns:
+        int: The number of rates stored.
+    """
+    stored = 0
+    with transaction.atomic():
+        if replace:
+            ExchangeRate.objects.all().delete()
+
+        # Keyed by (currency, date), a single INSERT must not update the same row twice
+        batch = {}
+        for currency, day, rate in rates:
+            if currency == settings.BILLOVA_BASE_CURRENCY:
+                continue
+            batch[currency, day] = ExchangeRate(currency=currency, date=day, rate=rate)
+            if len(batch) >= LOAD_BATCH_SIZE:
+                stored += _upsert(batch.values())
+                batch = {}
+        stored += _upsert(batch.values())
+
+        # Converted totals change with the rates. The global user's version is part of the ETag of every user.
+        try:
+            bump_data_versions([get_global_user_id()])
+        except User.DoesNotExist:
+            pass
+
+    invalidate_exchange_rates()
+    logger.info(f"Stored {stored} exchange rates.")
+    return stored
+
+
+def _upsert(rates):
+    rates = list(rates)
+    if rates:
+        ExchangeRate.objects.bulk_create(rates, update_conflicts=True, unique_fields=['currency', 'date'],
+                                         update_fields=['rate'])
+    return len(rates)
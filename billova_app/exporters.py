@@ -0,0 +1,69 @@
+import csv
+import json
+import logging
+
+from django.db.models import Prefetch
+
+from billova_app.importers import CSV_CATEGORY_SEPARATOR
+from billova_app.models import Category
+
+logger = logging.getLogger(__name__)
+
+# Number of expenses fetched from the database at a time while streaming an export
+EXPORT_CHUNK_SIZE = 500
+
+# The columns match the ones read by the import, so an export can be imported again
+EXPORT_FIELDS = ['invoice_date_time', 'price', 'currency', 'note', 'invoice_issuer', 'invoice_as_text', 'categories']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class _Echo:
+    """
+    File-like object that returns what is written to it, so the csv writer can produce single lines for streaming.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _iter_rows(queryset):
+    """
+    Yields the expenses of the queryset as dictionaries, fetching them in chunks. The categories of each chunk are
+    loaded with one additional query.
+    """
+    queryset = queryset.order_by('invoice_date_time', 'id').prefetch_related(
+        Prefetch('categories', queryset=Category.objects.only('id', 'name'))
+    )
+    for expense in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {
+            'invoice_date_time': expense.invoice_date_time.isoformat(),
+            'price': str(expense.price),
+            'currency': expense.currency,
+            'note': expense.note,
+            'invoice_issuer': expense.invoice_issuer,
+            'invoice_as_text': expense.invoice_as_text,
+            'categories': [category.name for category in expense.categories.all()],
+        }
+
+
+def iter_csv_export(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in _iter_rows(queryset):
+        row['categories'] = CSV_CATEGORY_SEPARATOR.join(row['categories'])
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+
+def iter_ndjson_export(queryset):
+    for row in _iter_rows(queryset):
+        yield json.dumps(row) + '\n'
+
+
+EXPORT_WRITERS = {
+    'csv': iter_csv_export,
+    'ndjson': iter_ndjson_export,
+}
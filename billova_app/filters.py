@@ -0,0 +1,82 @@
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from rest_framework import serializers
+
+
+class ExpenseFilterSerializer(serializers.Serializer):
+    """
+    Validates the query parameters used to filter expenses. Dates are inclusive and interpreted in the
+    current time zone, prices are inclusive too. Categories and currencies can be given repeated
+    (`?category=1&category=2`) or comma separated (`?currency=EUR,USD`). The issuer has to match exactly,
+    the search action looks for words in the issuer instead.
+    """
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    category = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+    price_min = serializers.DecimalField(max_digits=14, decimal_places=2, required=False)
+    price_max = serializers.DecimalField(max_digits=14, decimal_places=2, required=False)
+    currency = serializers.ListField(child=serializers.CharField(min_length=3, max_length=3), required=False)
+    issuer = serializers.CharField(required=False)
+
+    def validate_currency(self, value):
+        return [currency.upper() for currency in value]
+
+    def validate(self, data):
+        if data.get('date_from') and data.get('date_to') and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError({'date_to': 'Must not be before date_from.'})
+        if 'price_min' in data and 'price_max' in data and data['price_min'] > data['price_max']:
+            raise serializers.ValidationError({'price_max': 'Must not be less than price_min.'})
+        return data
+
+
+# Filters accepting several values
+LIST_FILTERS = ('category', 'currency')
+
+
+def parse_expense_filters(query_params):
+    """
+    Validates the expense filters found in the given query parameters.
+    Raises a `ValidationError` (answered with 400 by DRF) for invalid values.
+    """
+    data = {key: query_params[key] for key in ExpenseFilterSerializer().fields
+            if key in query_params and key not in LIST_FILTERS}
+    for key in LIST_FILTERS:
+        values = [value for values in query_params.getlist(key) for value in values.split(',') if value]
+        if values:
+            data[key] = values
+
+    serializer = ExpenseFilterSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_expenses(queryset, filters):
+    """
+    Applies validated expense filters to a queryset of expenses. Date ranges are turned into ranges on
+    `invoice_date_time`, so the (owner, invoice_date_time, id) index can be used. Currency, issuer and price
+    filters are served by the (owner, currency, ...), (owner, invoice_issuer, ...) and (owner, price) indexes.
+    """
+    if 'date_from' in filters:
+        queryset = queryset.filter(invoice_date_time__gte=_start_of_day(filters['date_from']))
+    if 'date_to' in filters:
+        queryset = queryset.filter(invoice_date_time__lt=_start_of_day(filters['date_to'] + timedelta(days=1)))
+    if 'price_min' in filters:
+        queryset = queryset.filter(price__gte=filters['price_min'])
+    if 'price_max' in filters:
+        queryset = queryset.filter(price__lte=filters['price_max'])
+    if filters.get('currency'):
+        queryset = queryset.filter(currency__in=filters['currency'])
+    if 'issuer' in filters:
+        queryset = queryset.filter(invoice_issuer=filters['issuer'])
+    if filters.get('category'):
+        # A subquery avoids duplicated rows for expenses matching several of the categories
+        queryset = queryset.filter(
+            id__in=queryset.model.categories.through.objects.filter(category_id__in=filters['category'])
+            .values('expense_id')
+        )
+    return queryset
@@ -0,0 +1,181 @@
+import csv
+import io
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from billova_app.models import Expense, Category, UserSettings
+from billova_app.rollups import record_expenses
+from billova_app.serializers import ExpenseImportRowSerializer
+from billova_app.utils.global_resolver import get_global_user_id
+from billova_app.versions import bump_data_versions
+
+logger = logging.getLogger(__name__)
+
+# Separator of the category names in the `categories` column of a CSV import
+CSV_CATEGORY_SEPARATOR = ';'
+
+# Upper limit of row errors listed in the import report, further errors are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(Exception):
+    """
+    Raised when the uploaded file cannot be read as a whole, e.g. because of a wrong encoding.
+    """
+
+
+def iter_csv_rows(file):
+    """
+    Reads the rows of a CSV upload one at a time. The first line must contain the column names.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        row = {key: value for key, value in row.items() if key and value not in (None, '')}
+        if 'categories' in row:
+            row['categories'] = [name.strip() for name in row['categories'].split(CSV_CATEGORY_SEPARATOR)
+                                 if name.strip()]
+        yield row
+
+
+def iter_ndjson_rows(file):
+    """
+    Reads the rows of a newline delimited JSON upload one at a time, skipping blank lines.
+    Lines which are not valid JSON objects are yielded as exceptions, so they end up in the error report.
+    """
+    for line in io.TextIOWrapper(file, encoding='utf-8-sig'):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield e
+            continue
+        yield row if isinstance(row, dict) else ValueError("Row is not a JSON object.")
+
+
+ROW_READERS = {
+    'csv': iter_csv_rows,
+    'ndjson': iter_ndjson_rows,
+}
+
+
+class ExpenseImporter:
+    """
+    Imports expenses for a single user with `bulk_create`, one batch at a time, so the number of queries
+    depends on the number of batches rather than on the number of rows.
+    """
+
+    def __init__(self, owner, batch_size=None):
+        self.owner = owner
+        self.batch_size = batch_size or settings.BILLOVA_IMPORT_BATCH_SIZE
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+        self._default_currency = (
+                UserSettings.objects.filter(owner=owner).values_list('currency', flat=True).first() or 'EUR'
+        )
+        self._category_ids = self._load_category_ids()
+        self._batch = []
+
+    def _load_category_ids(self):
+        """
+        Resolves all category names usable by the owner in one query. Categories of the user win over global
+        categories with the same name.
+        """
+        category_ids = {}
+        categories = Category.objects.filter(owner_id__in=[self.owner.id, get_global_user_id()]).values_list(
+            'name', 'id', 'owner_id')
+        for name, category_id, owner_id in categories:
+            if owner_id == self.owner.id or name not in category_ids:
+                category_ids[name] = category_id
+        return category_ids
+
+    def run(self, rows):
+        """
+        Validates and stores the given rows.
+
+        Args:
+            rows (iterable): Dictionaries with the fields of `ExpenseImportRowSerializer`, or exceptions for rows
+                which could not be parsed.
+
+        Returns:
+            dict: The import report with the number of created and failed rows and the row errors.
+        """
+        try:
+            for row_number, row in enumerate(rows, start=1):
+                self._add_row(row_number, row)
+                if len(self._batch) >= self.batch_size:
+                    self._flush()
+        except UnicodeDecodeError as e:
+            raise ImportFormatError(f"The file is not UTF-8 encoded: {e}") from e
+        except csv.Error as e:
+            raise ImportFormatError(f"The file is not a valid CSV file: {e}") from e
+        self._flush()
+
+        logger.info(f"Imported {self.created} expenses for user {self.owner}, {self.failed} rows failed.")
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+    def _add_row(self, row_number, row):
+        if isinstance(row, Exception):
+            self._add_error(row_number, {'non_field_errors': [str(row)]})
+            return
+
+        serializer = ExpenseImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            self._add_error(row_number, serializer.errors)
+            return
+
+        data = serializer.validated_data
+        category_names = data.pop('categories', [])
+        unknown = [name for name in category_names if name not in self._category_ids]
+        if unknown:
+            self._add_error(row_number, {'categories': [f"Unknown category: {name}" for name in unknown]})
+            return
+
+        expense = Expense(
+            owner=self.owner,
+            invoice_date_time=data.get('invoice_date_time') or timezone.now(),
+            price=data['price'],
+            currency=data.get('currency') or self._default_currency,
+            note=data.get('note', ''),
+            invoice_issuer=data.get('invoice_issuer', ''),
+            invoice_as_text=data.get('invoice_as_text', ''),
+        )
+        self._batch.append((expense, {self._category_ids[name] for name in category_names}))
+
+    def _add_error(self, row_number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def _flush(self):
+        if not self._batch:
+            return
+
+        expenses = [expense for expense, _ in self._batch]
+        with transaction.atomic():
+            Expense.objects.bulk_create(expenses)
+
+            ThroughModel = Expense.categories.through
+            links = [
+                ThroughModel(expense_id=expense.pk, category_id=category_id)
+                for expense, category_ids in self._batch
+                for category_id in category_ids
+            ]
+            ThroughModel.objects.bulk_create(links, batch_size=self.batch_size)
+
+            # bulk_create bypasses the signals maintaining the monthly spend rollup and the data version
+            record_expenses(expenses, {expense.pk: category_ids for expense, category_ids in self._batch})
+            bump_data_versions([self.owner.id])
+
+        self.created += len(expenses)
+        self._batch = []
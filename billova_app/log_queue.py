@@ -0,0 +1,202 @@
+import atexit
+import itertools
+import logging
+import logging.config
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+# Records waiting for the listener at most, see `BILLOVA_LOG_QUEUE_SIZE`
+DEFAULT_QUEUE_SIZE = 10000
+
+# Queue and listener thread of the current process, created by its first record
+_lock = threading.Lock()
+_queue = None
+_listener = None
+_started = False
+_stopped = False
+_handlers = []
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in N records of high-volume loggers, e.g. `{'billova_app.permissions': 100}`. A rate applies to the
+    logger and its children, the most specific logger wins. Only records up to `max_level` are sampled, warnings
+    and errors always pass.
+    """
+
+    def __init__(self, rates=None, max_level='INFO'):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+        self._rates_by_logger = {}
+        self._counters = {}
+
+    def _get_rate(self, name):
+        rate = self._rates_by_logger.get(name)
+        if rate is None:
+            parts = name.split('.')
+            rate = next((self.rates['.'.join(parts[:i])] for i in range(len(parts), 0, -1)
+                         if '.'.join(parts[:i]) in self.rates), 1)
+            self._rates_by_logger[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        rate = self._get_rate(record.name)
+        if rate <= 1:
+            return True
+        # Handlers sharing the filter see the same decision for a record
+        if not hasattr(record, 'sampled'):
+            # next() on an itertools.count is atomic, so concurrent threads never draw the same number
+            counter = self._counters.setdefault(record.name, itertools.count())
+            record.sampled = next(counter) % rate == 0
+        return record.sampled
+
+
+def _write(targets, record):
+    for handler in targets:
+        if record.levelno >= handler.level:
+            handler.handle(record)
+
+
+class _RoutingQueueHandler(QueueHandler):
+    # Enqueues the record together with the handlers it is meant for, so one listener thread serves all loggers.
+    # While a bounded queue is full, records below WARNING are dropped and counted, so logging never blocks the
+    # request threads. Warnings and errors are written by the logging thread instead, they are never dropped.
+    def __init__(self, log_queue, targets):
+        super().__init__(log_queue)
+        self.targets = tuple(targets)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait((self.targets, record))
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                _write(self.targets, record)
+            else:
+                self.dropped += 1
+
+
+class _ProcessQueueHandler(_RoutingQueueHandler):
+    # Uses the queue of the current process, which starts the listener thread on the first record, so no thread is
+    # started before a pre-forking server forks its workers
+    def __init__(self, targets):
+        super().__init__(None, targets)
+
+    def enqueue(self, record):
+        self.queue = _get_process_queue()
+        if self.queue is not None:
+            super().enqueue(record)
+
+
+class _RoutingQueueListener(QueueListener):
+
+    def handle(self, item):
+        _write(*item)
+
+    def enqueue_sentinel(self):
+        # Waits for room in a full queue instead of failing, the listener thread is emptying it
+        self.queue.put(self._sentinel)
+
+
+def _get_process_queue():
+    # Returns None once the listener was stopped
+    global _queue, _listener
+    if _queue is None and not _stopped:
+        with _lock:
+            if _queue is None and not _stopped:
+                log_queue = queue.Queue(getattr(settings, 'BILLOVA_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+                _listener = _RoutingQueueListener(log_queue)
+                _listener.start()
+                _queue = log_queue
+    return _queue
+
+
+def _reset_after_fork():
+    # The listener thread of the parent does not exist in the child, which starts its own with its first record.
+    # Records still queued in the parent are written by the parent.
+    global _lock, _queue, _listener
+    _lock = threading.Lock()
+    _queue = None
+    _listener = None
+    for handler in _handlers:
+        handler.dropped = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def start_queue_logging(logger_names):
+    """
+    Moves the handlers of the given loggers to a background thread: the loggers get a handler putting the records
+    on a queue, and a `QueueListener` writes them to the original handlers, so request threads never wait for
+    disk or console I/O. Handler levels and filters still apply, in the listener thread.
+
+    Each process starts its listener thread with its first record, so workers forked by a server which configured
+    logging before, e.g. `gunicorn --preload`, get a listener of their own. The queue holds up to
+    `BILLOVA_LOG_QUEUE_SIZE` records, further records below WARNING are dropped until the listener caught up. A
+    `SamplingFilter` shared by all handlers of a logger moves to its queue handler.
+
+    The listener is stopped, and the queue drained, when the process exits.
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        targets = list(logger.handlers)
+        if not targets:
+            continue
+        for handler in targets:
+            logger.removeHandler(handler)
+        handler = _ProcessQueueHandler(targets)
+        # A sampling filter of all the handlers decides before the record is queued, so sampled out records never
+        # take room in the queue
+        for sampling in [f for f in targets[0].filters if isinstance(f, SamplingFilter)]:
+            if all(sampling in target.filters for target in targets):
+                for target in targets:
+                    target.removeFilter(sampling)
+                handler.addFilter(sampling)
+        _handlers.append(handler)
+        logger.addHandler(handler)
+
+    atexit.register(stop_queue_logging)
+
+
+def stop_queue_logging():
+    """
+    Writes the queued records and stops the listener thread of the process. Records logged afterwards are not
+    written anymore. The number of records dropped while the queue was full is logged to the original handlers.
+    """
+    global _queue, _listener, _stopped
+    with _lock:
+        _stopped = True
+        listener, _listener, _queue = _listener, None, None
+    if listener is not None:
+        listener.stop()
+
+    for handler in _handlers:
+        if handler.dropped:
+            record = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                       f"{handler.dropped} log records dropped, the log queue was full.", None, None)
+            handler.dropped = 0
+            _write(handler.targets, record)
+
+
+def configure_logging(logging_settings):
+    """
+    Applies `settings.LOGGING` like Django does, then moves the handlers of its loggers behind a queue if
+    `BILLOVA_LOG_QUEUE` is set. Used as `LOGGING_CONFIG`.
+    """
+    logging.config.dictConfig(logging_settings)
+    if getattr(settings, 'BILLOVA_LOG_QUEUE', False):
+        start_queue_logging(logging_settings.get('loggers', {}))
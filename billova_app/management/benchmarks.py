@@ -0,0 +1,11 @@
+import statistics
+
+
+def percentile(values, percent):
+    """
+    Returns the given percentile (1-99) of the measured values, or the value itself for a single measurement.
+    Shared by the benchmark commands.
+    """
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
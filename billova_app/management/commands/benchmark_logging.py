@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import queue
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from billova_app.log_queue import SamplingFilter, _RoutingQueueHandler, _RoutingQueueListener
+from billova_app.management.benchmarks import percentile
+
+# Setups compared by the benchmark: the synchronous handlers, the same handlers behind a queue, and the queue with
+# the sampling of `BILLOVA_LOG_SAMPLING`
+MODES = ('sync', 'queue', 'queue_sampled')
+
+
+class Command(BaseCommand):
+    help = ("Measures the time request threads spend logging with the file and console handlers of the settings, "
+            "written synchronously and through the log queue, and reports it per simulated request as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Number of simulated requests per thread.")
+        parser.add_argument('--threads', type=int, default=4, help="Number of threads logging concurrently.")
+        parser.add_argument('--permission-checks', type=int, default=10,
+                            help="Number of object permission checks logged per request.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['threads'] < 1:
+            raise CommandError("At least one request and one thread are needed.")
+
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for mode in MODES:
+                results[mode] = self._run_mode(mode, Path(directory), options)
+                self.stderr.write(f"{mode}: p50 {results[mode]['p50_us']} us, p95 {results[mode]['p95_us']} us, "
+                                  f"{results[mode]['drain_ms']} ms to drain")
+
+        report = {
+            'threads': options['threads'],
+            'requests_per_thread': options['requests'],
+            'records_per_request': options['permission_checks'] + 3,
+            'modes': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Logging benchmark report written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def _run_mode(self, mode, directory, options):
+        # Loggers named like the ones of the application below a logger of their own, with the handlers of the
+        # `billova_app` logger: its log file and the console, writing to nowhere here
+        root = logging.getLogger(f"benchmark_logging.{mode}")
+        root.propagate = False
+        root.setLevel(logging.DEBUG)
+        console = open(os.devnull, 'w')
+        handlers = [logging.FileHandler(directory / f"{mode}.log"), logging.StreamHandler(console)]
+        formatter = logging.Formatter(settings.LOGGING['formatters']['verbose']['format'], style='{')
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        listener = None
+        if mode == 'sync':
+            for handler in handlers:
+                root.addHandler(handler)
+        else:
+            log_queue = queue.SimpleQueue()
+            queue_handler = _RoutingQueueHandler(log_queue, handlers)
+            if mode == 'queue_sampled':
+                # Sampled before the record is queued, like `start_queue_logging` does
+                rates = getattr(settings, 'BILLOVA_LOG_SAMPLING', {})
+                queue_handler.addFilter(SamplingFilter({f"{root.name}.{name}": rate for name, rate in rates.items()}))
+            root.addHandler(queue_handler)
+            listener = _RoutingQueueListener(log_queue)
+            listener.start()
+
+        permissions_logger = logging.getLogger(f"{root.name}.billova_app.permissions")
+        views_logger = logging.getLogger(f"{root.name}.billova_app.api_views")
+        durations = [[] for _ in range(options['threads'])]
+
+        def simulate_requests(thread_durations):
+            for i in range(options['requests']):
+                start = time.perf_counter()
+                views_logger.debug(f"Retrieving expenses for user bench_{i}")
+                for j in range(options['permission_checks']):
+                    permissions_logger.info(f"Permission granted: User bench_{i} accessed 12.34 EUR - Expense {j}.")
+                views_logger.info(f"Fetching monthly expenses for user bench_{i}")
+                views_logger.info(f"Successfully fetched monthly expenses for user bench_{i}")
+                thread_durations.append((time.perf_counter() - start) * 1_000_000)
+
+        threads = [threading.Thread(target=simulate_requests, args=(thread_durations,))
+                   for thread_durations in durations]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logged = time.perf_counter() - start
+
+        # Time until the listener has written everything, the cost moved out of the request threads
+        drain_start = time.perf_counter()
+        if listener is not None:
+            listener.stop()
+        drain = time.perf_counter() - drain_start
+
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in handlers:
+            handler.close()
+        console.close()
+
+        values = [duration for thread_durations in durations for duration in thread_durations]
+        return {
+            'p50_us': round(percentile(values, 50), 1),
+            'p95_us': round(percentile(values, 95), 1),
+            'p99_us': round(percentile(values, 99), 1),
+            'mean_us': round(statistics.fmean(values), 1),
+            'max_us': round(max(values), 1),
+            'total_ms': round(logged * 1000, 1),
+            'drain_ms': round(drain * 1000, 1),
+            'lines_written': len((directory / f"{mode}.log").read_text().splitlines()),
+        }
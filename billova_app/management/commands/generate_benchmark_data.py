@@ -0,0 +1,134 @@
+import random
+import string
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from billova_app.models import Expense, Category, UserSettings
+from billova_app.rollups import rebuild_monthly_spend
+from billova_app.utils.category_catalogue import invalidate_category_catalogue
+from billova_app.utils.global_resolver import GLOBAL_USERNAME
+from billova_app.versions import bump_data_versions
+
+CURRENCIES = ['EUR', 'EUR', 'EUR', 'USD', 'GBP', 'RON']
+WORDS = ['milk', 'bread', 'coffee', 'total', 'vat', 'cash', 'card', 'change', 'thank', 'you', 'receipt', 'store',
+         'apples', 'cheese', 'ticket', 'fuel', 'parking', 'lunch', 'dinner', 'tip']
+
+
+class Command(BaseCommand):
+    help = ("Generates synthetic users, categories and expenses for benchmarks. "
+            "All generated users share a username prefix, so they can be removed again with --clear.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Number of users to generate.")
+        parser.add_argument('--expenses-per-user', type=int, default=1000, help="Number of expenses per user.")
+        parser.add_argument('--categories-per-user', type=int, default=20,
+                            help="Number of own categories per user, in addition to the global categories.")
+        parser.add_argument('--global-categories', type=int, default=10,
+                            help="Number of global categories, created if missing.")
+        parser.add_argument('--max-categories-per-expense', type=int, default=3,
+                            help="Every expense gets between 0 and this many categories.")
+        parser.add_argument('--months', type=int, default=24, help="Number of months the expenses are spread over.")
+        parser.add_argument('--ocr-ratio', type=float, default=0.3,
+                            help="Share of the expenses with an OCR text, between 0 and 1.")
+        parser.add_argument('--ocr-text-size', type=int, default=2000, help="Average length of an OCR text.")
+        parser.add_argument('--prefix', default='bench_', help="Username prefix of the generated users.")
+        parser.add_argument('--password', default='bench', help="Password of the generated users.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of rows written per INSERT.")
+        parser.add_argument('--seed', type=int, default=42, help="Seed of the random generator.")
+        parser.add_argument('--clear', action='store_true',
+                            help="Delete the users with the prefix and their data before generating.")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if not prefix:
+            raise CommandError("The username prefix must not be empty.")
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        if options['clear']:
+            deleted, _ = User.objects.filter(username__startswith=prefix).delete()
+            self.stdout.write(f"Deleted {deleted} rows of previously generated data.")
+
+        global_categories = self._create_global_categories(options['global_categories'])
+        password = make_password(options['password'])
+        start = timezone.now() - timedelta(days=options['months'] * 30)
+
+        first = User.objects.filter(username__startswith=prefix).count()
+        for number in range(first, first + options['users']):
+            with transaction.atomic():
+                user = User.objects.create(username=f"{prefix}{number:05d}", password=password)
+                own_categories = Category.objects.bulk_create(
+                    Category(name=f"Category {i}", owner=user) for i in range(options['categories_per_user']))
+                self._create_expenses(user, global_categories + own_categories, start, options)
+            self.stdout.write(f"Generated user {user.username} ({number - first + 1} of {options['users']})")
+
+        self.stdout.write("Rebuilding the monthly spend rollup...")
+        user_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        for i in range(0, len(user_ids), 100):
+            rebuild_monthly_spend(user_ids[i:i + 100], batch_size=self.batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['users']} users with {options['expenses_per_user']} expenses each."))
+
+    def _create_global_categories(self, count):
+        global_user, created = User.objects.get_or_create(username=GLOBAL_USERNAME)
+        existing = set(Category.objects.filter(owner=global_user).values_list('name', flat=True))
+        Category.objects.bulk_create(
+            Category(name=f"Global {i}", owner=global_user) for i in range(count) if f"Global {i}" not in existing)
+        bump_data_versions([global_user.id])
+        invalidate_category_catalogue(global_user.id)
+        return list(Category.objects.filter(owner=global_user))
+
+    def _create_expenses(self, user, categories, start, options):
+        """
+        Creates the expenses of a user and their category links one batch at a time.
+        The monthly spend rollup is rebuilt afterwards, as `bulk_create` bypasses the signals.
+        """
+        # The settings are created by a signal together with the user
+        UserSettings.objects.filter(owner=user).update(currency=self.rng.choice(CURRENCIES))
+        seconds = options['months'] * 30 * 24 * 60 * 60
+        max_categories = min(options['max_categories_per_expense'], len(categories))
+
+        remaining = options['expenses_per_user']
+        while remaining > 0:
+            size = min(remaining, self.batch_size)
+            remaining -= size
+
+            expenses = Expense.objects.bulk_create([
+                Expense(
+                    owner=user,
+                    invoice_date_time=start + timedelta(seconds=self.rng.randrange(seconds)),
+                    price=Decimal(self.rng.randrange(50, 50000)) / 100,
+                    currency=self.rng.choice(CURRENCIES),
+                    note=self.rng.choice(['', '', 'Weekly shopping', 'Business trip', 'Gift']),
+                    invoice_issuer=f"Shop {self.rng.randrange(200)}",
+                    invoice_as_text=self._ocr_text(options) if self.rng.random() < options['ocr_ratio'] else '',
+                )
+                for _ in range(size)
+            ], batch_size=self.batch_size)
+
+            ThroughModel = Expense.categories.through
+            ThroughModel.objects.bulk_create([
+                ThroughModel(expense_id=expense.pk, category_id=category.pk)
+                for expense in expenses
+                for category in self.rng.sample(categories, self.rng.randint(0, max_categories))
+            ], batch_size=self.batch_size)
+
+    def _ocr_text(self, options):
+        # Text sizes vary around the average like real receipts do
+        size = int(self.rng.uniform(0.5, 1.5) * options['ocr_text_size'])
+        words = []
+        length = 0
+        while length < size:
+            word = self.rng.choice(WORDS) if self.rng.random() < 0.8 else ''.join(
+                self.rng.choices(string.digits, k=self.rng.randint(1, 6)))
+            words.append(word)
+            length += len(word) + 1
+        return ' '.join(words)[:size]
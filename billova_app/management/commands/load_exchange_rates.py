@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from billova_app.exchange import RatesFileError, read_exchange_rates, store_exchange_rates
+
+
+class Command(BaseCommand):
+    help = ("Loads exchange rates against BILLOVA_BASE_CURRENCY from a local CSV file, either with the columns "
+            "date, currency and rate, or one column per currency like the ECB reference rates (eurofxref-hist.csv).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the rates file.")
+        parser.add_argument('--replace', action='store_true',
+                            help="Delete all stored rates before loading the file.")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as file:
+                stored = store_exchange_rates(read_exchange_rates(file), replace=options['replace'])
+        except OSError as e:
+            raise CommandError(f"Cannot read the rates file: {e}")
+        except RatesFileError as e:
+            raise CommandError(f"Invalid rates file: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {stored} exchange rates against {settings.BILLOVA_BASE_CURRENCY}."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from billova_app.models import OcrJob
+from billova_app.ocr.jobs import process_ocr_job
+
+
+class Command(BaseCommand):
+    help = "Processes pending OCR jobs in the foreground, e.g. jobs left over after a restart of the server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--include-running', action='store_true',
+                            help="Also retry jobs marked as running, whose worker was stopped before finishing.")
+
+    def handle(self, *args, **options):
+        if options['include_running']:
+            reset = OcrJob.objects.filter(status=OcrJob.STATUS_RUNNING).update(status=OcrJob.STATUS_PENDING)
+            self.stdout.write(f"Reset {reset} running jobs to pending.")
+
+        job_ids = list(OcrJob.objects.filter(status=OcrJob.STATUS_PENDING).order_by('created_at')
+                       .values_list('id', flat=True))
+        for job_id in job_ids:
+            job = process_ocr_job(job_id)
+            if job:
+                self.stdout.write(f"OCR job {job.id}: {job.status}")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {len(job_ids)} OCR jobs."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from billova_app.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of the expenses from the expense table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize', action='store_true',
+                            help="Merge the index segments after the rebuild, which makes searches faster.")
+
+    def handle(self, *args, **options):
+        if not rebuild_search_index(optimize=options['optimize']):
+            raise CommandError("The full-text search index is only available on SQLite.")
+        self.stdout.write(self.style.SUCCESS("Expense search index rebuilt."))
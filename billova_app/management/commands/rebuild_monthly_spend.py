@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from billova_app.rollups import rebuild_monthly_spend, REBUILD_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the monthly spend rollup from the expenses, a chunk of users at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help="Number of users rebuilt per transaction.")
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH_SIZE,
+                            help="Number of rollup rows written per INSERT.")
+        parser.add_argument('--user', action='append', dest='usernames', default=[],
+                            help="Only rebuild the rows of this user. Can be given several times.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        user_ids = list(users.values_list('id', flat=True))
+
+        chunk_size = max(options['chunk_size'], 1)
+        rows = 0
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            rows += rebuild_monthly_spend(chunk, batch_size=options['batch_size'])
+            self.stdout.write(f"Rebuilt users {start + 1}-{start + len(chunk)} of {len(user_ids)}")
+
+        self.stdout.write(self.style.SUCCESS(f"Monthly spend rebuilt: {rows} rows for {len(user_ids)} users."))
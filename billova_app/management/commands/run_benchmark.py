@@ -0,0 +1,151 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from billova_app.management.benchmarks import percentile
+
+# Endpoints exercised by the benchmark, as (name, URL name or path)
+ENDPOINTS = [
+    ('expenses', '/api/v1/expenses/'),
+    ('expenses_last_page', '/api/v1/expenses/?page=last'),
+    ('expenses_cursor', '/api/v1/expenses/?pagination=cursor'),
+    ('expenses_table', '/api/v1/expenses/table/?draw=1&start=0&length=10&columns[0][data]=invoice_date_time'
+                       '&order[0][column]=0&order[0][dir]=desc'),
+    ('monthly_expenses', '/api/v1/monthlyExpenses/'),
+    ('categories', '/api/v1/categories/'),
+    ('analytics', '/api/v1/analytics/'),
+    ('account_overview', 'account_overview'),
+    ('account_settings', 'account_settings'),
+]
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the executed queries, without the overhead of the debug cursor.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _get_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Requests the expense, category and settings endpoints as users generated by generate_benchmark_data "
+            "and reports latency percentiles, queries per request and peak memory per endpoint as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='bench_', help="Username prefix of the benchmark users.")
+        parser.add_argument('--users', type=int, default=5, help="Number of benchmark users taking turns.")
+        parser.add_argument('--requests', type=int, default=50, help="Number of measured requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=3, help="Number of unmeasured requests per endpoint.")
+        parser.add_argument('--endpoint', action='append', dest='endpoints', default=[],
+                            choices=[name for name, _ in ENDPOINTS],
+                            help="Only run this endpoint. Can be given several times.")
+        parser.add_argument('--label', default='', help="Free text stored with the results, e.g. the change tested.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(username__startswith=options['prefix']).order_by('id')[:options['users']])
+        if not users:
+            raise CommandError(f"No users with the prefix '{options['prefix']}', run generate_benchmark_data first.")
+        if options['requests'] < 1:
+            raise CommandError("At least one request per endpoint is needed.")
+
+        clients = []
+        for user in users:
+            # The test client talks to the application directly, without a server. Failing requests are reported
+            # with their status code instead of aborting the run.
+            client = Client(SERVER_NAME='localhost', raise_request_exception=False)
+            client.force_login(user)
+            clients.append(client)
+
+        endpoints = [(name, path) for name, path in ENDPOINTS
+                     if not options['endpoints'] or name in options['endpoints']]
+        results = {}
+        for name, path in endpoints:
+            url = path if path.startswith('/') else reverse(path)
+            results[name] = self._run_endpoint(clients, url, options['requests'], options['warmup'])
+            self.stderr.write(f"{name}: p50 {results[name]['p50_ms']} ms, p95 {results[name]['p95_ms']} ms, "
+                              f"{results[name]['queries_per_request']} queries")
+
+        report = {
+            'label': options['label'],
+            'revision': _get_revision(),
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'users': len(users),
+            'requests_per_endpoint': options['requests'],
+            'endpoints': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Benchmark report written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def _run_endpoint(self, clients, url, requests, warmup):
+        for i in range(warmup):
+            clients[i % len(clients)].get(url)
+
+        durations = []
+        queries = []
+        statuses = set()
+        for i in range(requests):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                response = clients[i % len(clients)].get(url)
+                durations.append((time.perf_counter() - start) * 1000)
+            queries.append(counter.count)
+            statuses.add(response.status_code)
+
+        # Memory is traced in a separate pass, as tracing slows down the requests measured above
+        tracemalloc.start()
+        try:
+            peak = 0
+            for client in clients:
+                tracemalloc.reset_peak()
+                client.get(url)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'url': url,
+            'status_codes': sorted(statuses),
+            'p50_ms': round(percentile(durations, 50), 2),
+            'p95_ms': round(percentile(durations, 95), 2),
+            'p99_ms': round(percentile(durations, 99), 2),
+            'mean_ms': round(statistics.fmean(durations), 2),
+            'max_ms': round(max(durations), 2),
+            'queries_per_request': round(statistics.fmean(queries), 2),
+            'max_queries': max(queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
@@ -0,0 +1,178 @@
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+slow_request_logger = logging.getLogger('billova_app.slow_requests')
+
+# Number of distinct statements listed for a slow request
+SLOW_REQUEST_TOP_QUERIES = 5
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+_SAVEPOINT = re.compile(r'"s\d+_x\d+"')
+
+# Timings of the request handled by the current thread or task, None outside of the middleware
+_current_timings = ContextVar('billova_request_timings', default=None)
+
+
+def normalize_sql(sql):
+    """
+    Replaces the literals and placeholder lists of a statement, so statements which only differ in their parameters
+    are logged and grouped as one, e.g. `WHERE id IN (%s, %s, %s)` becomes `WHERE id IN (...)`.
+    """
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _SAVEPOINT.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+class RequestTimings:
+    """
+    Collects the database and serializer timings of a single request, durations in seconds.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self._serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Execute wrapper, see https://docs.djangoproject.com/en/5.1/topics/db/instrumentation/
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.db_time += duration
+            self.queries.append((sql, duration))
+
+
+def _timed_serializer_data(data):
+    """
+    Wraps `BaseSerializer.data` so the time spent serializing is added to the timings of the current request.
+    Nested serializers are only counted once, as part of their parent.
+    """
+
+    def timed_data(serializer):
+        timings = _current_timings.get()
+        if timings is None:
+            return data.fget(serializer)
+
+        timings._serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            timings._serializer_depth -= 1
+            if not timings._serializer_depth:
+                timings.serializer_time += time.perf_counter() - start
+
+    return property(timed_data)
+
+
+def instrument_serializers():
+    """
+    Enables the serializer timings of `SqlTimingMiddleware`. Called once when the app is ready.
+    """
+    if not getattr(BaseSerializer.data, 'billova_timed', False):
+        BaseSerializer.data = _timed_serializer_data(BaseSerializer.data)
+        BaseSerializer.data.fget.billova_timed = True
+
+
+@contextmanager
+def _timed_queries(timings):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timings))
+        yield
+
+
+class SqlTimingMiddleware:
+    """
+    Measures the queries, the database time, the serializer time and the remaining view time of every request.
+
+    The timings are sent as a `Server-Timing` header if `BILLOVA_SERVER_TIMING` is enabled, so they show up in the
+    network tab of the browser devtools. Requests slower than `BILLOVA_SLOW_REQUEST_MS` and queries slower than
+    `BILLOVA_SLOW_QUERY_MS` are logged to the `billova_app.slow_requests` logger with their normalized SQL.
+
+    Streaming responses, e.g. the expense export, run most of their queries while the server sends the content,
+    after the headers. They get no `Server-Timing` header and are logged once their content was sent.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with _timed_queries(timings):
+                response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+
+        if response.streaming:
+            if not response.is_async:
+                response.streaming_content = self._timed_content(response.streaming_content, request, response,
+                                                                 timings, start)
+            return response
+
+        total_time = time.perf_counter() - start
+        if settings.BILLOVA_SERVER_TIMING:
+            response['Server-Timing'] = self._get_server_timing(timings, total_time)
+        self._log_slow_request(request, response, timings, total_time)
+        return response
+
+    def _timed_content(self, content, request, response, timings, start):
+        try:
+            with _timed_queries(timings):
+                yield from content
+        finally:
+            self._log_slow_request(request, response, timings, time.perf_counter() - start)
+
+    @staticmethod
+    def _get_server_timing(timings, total_time):
+        view_time = max(total_time - timings.db_time - timings.serializer_time, 0)
+        metrics = [
+            f'db;dur={timings.db_time * 1000:.1f};desc="{len(timings.queries)} queries"',
+            f'serializer;dur={timings.serializer_time * 1000:.1f}',
+            f'view;dur={view_time * 1000:.1f}',
+            f'total;dur={total_time * 1000:.1f}',
+        ]
+        return ', '.join(metrics)
+
+    @staticmethod
+    def _log_slow_request(request, response, timings, total_time):
+        slow_query_seconds = settings.BILLOVA_SLOW_QUERY_MS / 1000
+        for sql, duration in timings.queries:
+            if duration >= slow_query_seconds:
+                slow_request_logger.warning(
+                    f"Slow query ({duration * 1000:.1f} ms) in {request.method} {request.path}: {normalize_sql(sql)}")
+
+        if total_time < settings.BILLOVA_SLOW_REQUEST_MS / 1000:
+            return
+
+        # Group the statements, so N+1 patterns show up as one statement executed many times
+        statements = defaultdict(lambda: [0, 0.0])
+        for sql, duration in timings.queries:
+            statement = statements[normalize_sql(sql)]
+            statement[0] += 1
+            statement[1] += duration
+        top = sorted(statements.items(), key=lambda item: item[1][1], reverse=True)[:SLOW_REQUEST_TOP_QUERIES]
+        details = ''.join(f"\n  {count}x {duration * 1000:.1f} ms: {sql}" for sql, (count, duration) in top)
+
+        slow_request_logger.warning(
+            f"Slow request {request.method} {request.path} ({response.status_code}): {total_time * 1000:.1f} ms, "
+            f"{len(timings.queries)} queries in {timings.db_time * 1000:.1f} ms, "
+            f"serializer {timings.serializer_time * 1000:.1f} ms{details}")
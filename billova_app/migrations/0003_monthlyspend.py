@@ -0,0 +1,67 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_monthly_spend(apps, schema_editor):
+    """
+    Backfill the rollup from the existing expenses.
+    """
+    Expense = apps.get_model('billova_app', 'Expense')
+    MonthlySpend = apps.get_model('billova_app', 'MonthlySpend')
+
+    totals = (
+        Expense.objects.annotate(month=TruncMonth('invoice_date_time', output_field=DateField()))
+        .values('owner_id', 'month', 'currency')
+        .annotate(total=Sum('price'), expense_count=Count('id'))
+        .order_by()
+    )
+    category_totals = (
+        Expense.categories.through.objects
+        .annotate(month=TruncMonth('expense__invoice_date_time', output_field=DateField()))
+        .values('expense__owner_id', 'month', 'expense__currency', 'category_id')
+        .annotate(total=Sum('expense__price'), expense_count=Count('expense_id'))
+        .order_by()
+    )
+
+    rows = [
+        MonthlySpend(owner_id=row['owner_id'], month=row['month'], currency=row['currency'],
+                     total=row['total'], expense_count=row['expense_count'])
+        for row in totals
+    ]
+    rows.extend(
+        MonthlySpend(owner_id=row['expense__owner_id'], month=row['month'], currency=row['expense__currency'],
+                     category_id=row['category_id'], total=row['total'], expense_count=row['expense_count'])
+        for row in category_totals
+    )
+    MonthlySpend.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billova_app', '0002_expense_owner_date_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('currency', models.CharField(max_length=3)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('expense_count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='monthly_spends', to='billova_app.category')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_spends', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-month'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('category__isnull', False)), fields=('owner', 'month', 'currency', 'category'), name='monthly_spend_unique_category'), models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('owner', 'month', 'currency'), name='monthly_spend_unique_total')],
+            },
+        ),
+        migrations.RunPython(populate_monthly_spend, migrations.RunPython.noop),
+    ]
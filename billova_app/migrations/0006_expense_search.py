@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# External content FTS5 index over the searchable text of the expenses. The index only stores the tokens, the text
+# is read from billova_app_expense. Triggers keep it in sync, including for bulk_create and queryset updates.
+CREATE_SEARCH_INDEX = [
+    """
+    CREATE VIRTUAL TABLE billova_app_expense_fts USING fts5(
+        invoice_issuer, note, invoice_as_text,
+        content='billova_app_expense', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER billova_app_expense_fts_insert AFTER INSERT ON billova_app_expense BEGIN
+        INSERT INTO billova_app_expense_fts (rowid, invoice_issuer, note, invoice_as_text)
+        VALUES (new.id, new.invoice_issuer, new.note, new.invoice_as_text);
+    END
+    """,
+    """
+    CREATE TRIGGER billova_app_expense_fts_delete AFTER DELETE ON billova_app_expense BEGIN
+        INSERT INTO billova_app_expense_fts (billova_app_expense_fts, rowid, invoice_issuer, note, invoice_as_text)
+        VALUES ('delete', old.id, old.invoice_issuer, old.note, old.invoice_as_text);
+    END
+    """,
+    """
+    CREATE TRIGGER billova_app_expense_fts_update AFTER UPDATE OF invoice_issuer, note, invoice_as_text
+    ON billova_app_expense BEGIN
+        INSERT INTO billova_app_expense_fts (billova_app_expense_fts, rowid, invoice_issuer, note, invoice_as_text)
+        VALUES ('delete', old.id, old.invoice_issuer, old.note, old.invoice_as_text);
+        INSERT INTO billova_app_expense_fts (rowid, invoice_issuer, note, invoice_as_text)
+        VALUES (new.id, new.invoice_issuer, new.note, new.invoice_as_text);
+    END
+    """,
+    "INSERT INTO billova_app_expense_fts (billova_app_expense_fts) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_INDEX = [
+    "DROP TRIGGER IF EXISTS billova_app_expense_fts_insert",
+    "DROP TRIGGER IF EXISTS billova_app_expense_fts_delete",
+    "DROP TRIGGER IF EXISTS billova_app_expense_fts_update",
+    "DROP TABLE IF EXISTS billova_app_expense_fts",
+]
+
+
+def _execute(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite only, other databases fall back to a slower LIKE search
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billova_app', '0005_ocrcacheentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(_execute(CREATE_SEARCH_INDEX), _execute(DROP_SEARCH_INDEX)),
+    ]
@@ -0,0 +1,55 @@
+from importlib import import_module
+
+from django.db import migrations
+
+previous = import_module('billova_app.migrations.0006_expense_search')
+
+# Adds the owner to the FTS5 index, so a search only matches the expenses of one user inside the index instead of
+# matching the expenses of all users and filtering them afterwards. The owner is matched as a token of its own
+# column, the search terms only in the text columns.
+CREATE_SEARCH_INDEX = [
+    """
+    CREATE VIRTUAL TABLE billova_app_expense_fts USING fts5(
+        owner_id, invoice_issuer, note, invoice_as_text,
+        content='billova_app_expense', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER billova_app_expense_fts_insert AFTER INSERT ON billova_app_expense BEGIN
+        INSERT INTO billova_app_expense_fts (rowid, owner_id, invoice_issuer, note, invoice_as_text)
+        VALUES (new.id, new.owner_id, new.invoice_issuer, new.note, new.invoice_as_text);
+    END
+    """,
+    """
+    CREATE TRIGGER billova_app_expense_fts_delete AFTER DELETE ON billova_app_expense BEGIN
+        INSERT INTO billova_app_expense_fts
+            (billova_app_expense_fts, rowid, owner_id, invoice_issuer, note, invoice_as_text)
+        VALUES ('delete', old.id, old.owner_id, old.invoice_issuer, old.note, old.invoice_as_text);
+    END
+    """,
+    """
+    CREATE TRIGGER billova_app_expense_fts_update AFTER UPDATE OF owner_id, invoice_issuer, note, invoice_as_text
+    ON billova_app_expense BEGIN
+        INSERT INTO billova_app_expense_fts
+            (billova_app_expense_fts, rowid, owner_id, invoice_issuer, note, invoice_as_text)
+        VALUES ('delete', old.id, old.owner_id, old.invoice_issuer, old.note, old.invoice_as_text);
+        INSERT INTO billova_app_expense_fts (rowid, owner_id, invoice_issuer, note, invoice_as_text)
+        VALUES (new.id, new.owner_id, new.invoice_issuer, new.note, new.invoice_as_text);
+    END
+    """,
+    "INSERT INTO billova_app_expense_fts (billova_app_expense_fts) VALUES ('rebuild')",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billova_app', '0009_exchangerate'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            previous._execute(previous.DROP_SEARCH_INDEX + CREATE_SEARCH_INDEX),
+            previous._execute(previous.DROP_SEARCH_INDEX + previous.CREATE_SEARCH_INDEX),
+        ),
+    ]
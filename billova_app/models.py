@@ -27,6 +27,14 @@ class Expense(models.Model):
 
     class Meta:
         ordering = ['invoice_date_time']
+        indexes = [
+            # Serves the per-user listing and the keyset (cursor) pagination of the expenses API
+            models.Index(fields=['owner', 'invoice_date_time', 'id'], name='expense_owner_date_id_idx'),
+            # Serve the currency, issuer and price filters of the expenses API
+            models.Index(fields=['owner', 'currency', 'invoice_date_time'], name='expense_owner_currency_idx'),
+            models.Index(fields=['owner', 'invoice_issuer', 'invoice_date_time'], name='expense_owner_issuer_idx'),
+            models.Index(fields=['owner', 'price'], name='expense_owner_price_idx'),
+        ]
 
 class Category(models.Model):
     name = models.CharField(max_length=255)
@@ -36,6 +44,123 @@ class Category(models.Model):
         ordering = ['name']
 
 
+class MonthlySpend(models.Model):
+    """
+    Precomputed monthly spending of a user per month, currency and category.
+
+    Rows without a category hold the total of the month, so every expense is counted exactly once there. Rows with a
+    category hold the share of that category; an expense with several categories counts towards each of them.
+    The table is kept up to date by the signal handlers in `billova_app.signals` and can be rebuilt with the
+    `rebuild_monthly_spend` management command.
+    """
+    owner = models.ForeignKey('auth.User', related_name='monthly_spends', on_delete=models.CASCADE)
+    month = models.DateField()  # First day of the month
+    currency = models.CharField(max_length=3)
+    category = models.ForeignKey('Category', related_name='monthly_spends', null=True, blank=True,
+                                 on_delete=models.CASCADE)
+    total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    expense_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.total} {self.currency}"
+
+    class Meta:
+        ordering = ['-month']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'month', 'currency', 'category'],
+                                    condition=models.Q(category__isnull=False),
+                                    name='monthly_spend_unique_category'),
+            models.UniqueConstraint(fields=['owner', 'month', 'currency'],
+                                    condition=models.Q(category__isnull=True),
+                                    name='monthly_spend_unique_total'),
+        ]
+
+
+class ExchangeRate(models.Model):
+    """
+    Value of one unit of `BILLOVA_BASE_CURRENCY` in `currency` from `date` on, e.g. 1 EUR = 1.0823 USD.
+    Loaded from a rates file with the `load_exchange_rates` management command, see `billova_app.exchange`.
+    """
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=20, decimal_places=10)
+
+    def __str__(self):
+        return f"{self.date} {self.currency} {self.rate}"
+
+    class Meta:
+        ordering = ['currency', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='exchange_rate_unique_currency_date'),
+        ]
+
+
+class DataVersion(models.Model):
+    """
+    Version of the expenses and categories of a user, increased on every change of them.
+
+    Lets the API answer conditional requests (ETag / Last-Modified) without loading the data, see
+    `billova_app.versions`. Rows are created on the first change of a user's data.
+    """
+    owner = models.OneToOneField(User, related_name='data_version', on_delete=models.CASCADE, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.owner_id} v{self.version}"
+
+
+class OcrJob(models.Model):
+    """
+    A receipt uploaded for OCR processing. The job is processed by the worker pool in `billova_app.ocr.jobs`,
+    which creates the expense once the OCR provider answered.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    owner = models.ForeignKey('auth.User', related_name='ocr_jobs', on_delete=models.CASCADE)
+    image = models.FileField(upload_to='ocr_jobs/', blank=True)  # Removed once the job is finished
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error = models.TextField(blank=True)
+    expense = models.ForeignKey('Expense', related_name='ocr_jobs', null=True, blank=True,
+                                on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"OCR job {self.id} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class OcrCacheEntry(models.Model):
+    """
+    The extraction of a receipt image, keyed by the SHA-256 of the image bytes, so uploading the same image again
+    does not call the OCR provider. See `billova_app.ocr.cache`.
+    """
+    image_hash = models.CharField(max_length=64, unique=True)
+    invoice_date_time = models.DateTimeField()
+    price = models.DecimalField(max_digits=14, decimal_places=2)
+    invoice_issuer = models.TextField(blank=True)
+    invoice_as_text = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.image_hash[:12]} {self.price} - {self.invoice_issuer}"
+
+
 class UserSettings(models.Model):
     NUMERIC_FORMAT_CHOICES = [
         ('AT', 'Austrian'),
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+
+from billova_app.models import OcrCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+# Bytes read at a time while hashing a receipt image
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def hash_image(receipt) -> str:
+    """
+    Returns the SHA-256 hex digest of the receipt image, used as key of the cache.
+    The image is read in chunks from the binary file-like object, which is rewound afterwards.
+    """
+    digest = hashlib.sha256()
+    receipt.seek(0)
+    for chunk in iter(lambda: receipt.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    receipt.seek(0)
+    return digest.hexdigest()
+
+
+class OcrResultCache:
+    """
+    Persistent cache of OCR extractions keyed by the hash of the receipt image.
+
+    Entries older than `ttl` are treated as missing. When more than `max_entries` entries are stored, the least
+    recently used ones are evicted. Hits and misses are counted per process.
+    """
+
+    def __init__(self, ttl: timedelta, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, image_hash):
+        """
+        Returns the cached entry for the image hash, or None if there is no entry or it expired.
+        """
+        now = timezone.now()
+        try:
+            entry = OcrCacheEntry.objects.filter(image_hash=image_hash, created_at__gte=now - self.ttl).first()
+            if entry is not None:
+                OcrCacheEntry.objects.filter(id=entry.id).update(last_used_at=now, hits=F('hits') + 1)
+        except DatabaseError as e:
+            # The cache is best effort, a failing lookup must not fail the OCR processing
+            logger.warning(f"OCR cache lookup failed: {e}")
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if entry is not None:
+            logger.debug(f"OCR cache hit for image {image_hash}")
+        return entry
+
+    def set(self, image_hash, receipt):
+        """
+        Stores the extraction of an analyzed receipt and evicts expired and least recently used entries.
+        """
+        try:
+            OcrCacheEntry.objects.update_or_create(
+                image_hash=image_hash,
+                defaults={
+                    'invoice_date_time': receipt.invoice_date_time,
+                    'price': receipt.price,
+                    'invoice_issuer': receipt.invoice_issuer or '',
+                    'invoice_as_text': receipt.invoice_as_text or '',
+                    'created_at': timezone.now(),
+                    'last_used_at': timezone.now(),
+                },
+            )
+            self.evict()
+        except DatabaseError as e:
+            logger.warning(f"Storing the OCR result in the cache failed: {e}")
+
+    def evict(self):
+        expired = OcrCacheEntry.objects.filter(created_at__lt=timezone.now() - self.ttl).delete()[0]
+        surplus_ids = list(
+            OcrCacheEntry.objects.order_by('-last_used_at').values_list('id', flat=True)[self.max_entries:]
+        )
+        if surplus_ids:
+            OcrCacheEntry.objects.filter(id__in=surplus_ids).delete()
+        if expired or surplus_ids:
+            logger.info(f"Evicted {expired} expired and {len(surplus_ids)} least recently used OCR cache entries.")
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / lookups if lookups else None,
+            'entries': OcrCacheEntry.objects.count(),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    """
+    Returns the process-wide OCR result cache, configured by `BILLOVA_OCR_CACHE_TTL` (seconds) and
+    `BILLOVA_OCR_CACHE_MAX_ENTRIES`.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = OcrResultCache(ttl=timedelta(seconds=settings.BILLOVA_OCR_CACHE_TTL),
+                                    max_entries=settings.BILLOVA_OCR_CACHE_MAX_ENTRIES)
+        return _cache
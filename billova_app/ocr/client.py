@@ -0,0 +1,234 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+# Answers of the provider which are worth retrying: the document was not processed. A 500 may come after the
+# document was created, so it is not retried.
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+class OcrProviderError(Exception):
+    """
+    Raised when the OCR provider cannot process a document, after all retries were used up.
+    """
+
+
+class CircuitOpenError(OcrProviderError):
+    """
+    Raised without contacting the provider while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service for a while.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls fail fast. Once `reset_timeout`
+    seconds passed, a single trial call is let through (half open): a success closes the circuit again,
+    a failure opens it for another `reset_timeout` seconds.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                return True
+            # Open, or half open with the trial call still running
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Circuit breaker opened after {self._failures} failures.")
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+
+def _is_unsent(error):
+    """
+    Tells whether a failed request never reached the provider: the connection could not be opened or timed out
+    while connecting. Read timeouts, dropped connections and broken answers come after the upload, when the
+    provider may already have created the document.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+class VeryfiClient:
+    """
+    HTTP client for the Veryfi API, meant to be shared by all threads of the process.
+
+    Connections are pooled and kept alive by a `requests.Session`. Every call has connect and read timeouts,
+    failed connections and 429/502/503/504 answers are retried with jittered exponential backoff, and a circuit
+    breaker fails fast while the provider is down. Each upload creates a document at the provider, so failures
+    after the upload was sent, like read timeouts, are never retried: the receipt would be created twice.
+
+    Docs:
+        https://docs.veryfi.com/api/receipts-invoices/process-a-document/
+    """
+
+    def __init__(self, url, client_id=None, username=None, api_key=None, connect_timeout=5.0, read_timeout=60.0,
+                 max_retries=3, backoff=0.5, backoff_max=8.0, pool_size=10, breaker=None, sleep=time.sleep):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._sleep = sleep
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "CLIENT-ID": client_id or '',
+            "AUTHORIZATION": f"apikey {username}:{api_key}",
+        })
+        # Retries are handled here, so the breaker sees the final outcome of a call
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def process_document(self, file_name, file, content_type):
+        """
+        Uploads a document and returns the extracted data.
+
+        Args:
+            file_name (str): Name of the uploaded file.
+            file: File-like object with the document, rewound before each attempt.
+            content_type (str): MIME type of the document.
+
+        Returns:
+            dict: The JSON answer of the provider.
+        """
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("The OCR provider is unavailable, please try again later.")
+
+        # Every call records one outcome, whatever is raised: a half open breaker only lets the next trial call
+        # through once the outcome of the running one is known
+        reachable = False
+        try:
+            response = self._post(file_name, file, content_type)
+            if not response.ok:
+                # The provider is reachable, even if it rejected this document
+                reachable = True
+                raise OcrProviderError(f"The OCR provider rejected the document: {response.status_code}")
+            try:
+                data = response.json()
+            except ValueError as e:
+                raise OcrProviderError(f"The OCR provider sent an invalid answer: {e}") from e
+            reachable = True
+            return data
+        finally:
+            if reachable:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def _post(self, file_name, file, content_type):
+        """
+        Posts the document, retrying requests which never reached the provider and 429/502/503/504 answers.
+        Returns the first other answer, raises `OcrProviderError` for other failures or once the retries are used
+        up.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._sleep(self._get_backoff(attempt, error))
+
+            file.seek(0)
+            try:
+                response = self.session.post(self.url, files={"file": (file_name, file, content_type)},
+                                             timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning(f"OCR provider request failed (attempt {attempt + 1}): {e}")
+                if not _is_unsent(e):
+                    raise OcrProviderError(f"The OCR provider did not answer: {e}") from e
+                error = e
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES:
+                logger.warning(f"OCR provider answered {response.status_code} (attempt {attempt + 1})")
+                error = response
+                continue
+            return response
+
+        if isinstance(error, requests.Response):
+            raise OcrProviderError(f"The OCR provider answered {error.status_code}")
+        raise OcrProviderError(f"The OCR provider is not reachable: {error}") from error
+
+    def _get_backoff(self, attempt, error):
+        """
+        Returns the seconds to wait before the given retry: full jitter over an exponentially growing window,
+        or the Retry-After of a 429 answer if the provider sent one.
+        """
+        if isinstance(error, requests.Response) and error.status_code == 429:
+            try:
+                return min(float(error.headers.get('Retry-After')), self.backoff_max)
+            except (TypeError, ValueError):
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_veryfi_client():
+    """
+    Returns the process-wide Veryfi client, configured by `BILLOVA_OCR_CLIENT` and the VERYFI_* environment
+    variables.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            config = settings.BILLOVA_OCR_CLIENT
+            _client = VeryfiClient(
+                url=config['URL'],
+                client_id=os.getenv("VERYFI_CLIENT_ID"),
+                username=os.getenv("VERYFI_USERNAME"),
+                api_key=os.getenv("VERYFI_API_KEY"),
+                connect_timeout=config['CONNECT_TIMEOUT'],
+                read_timeout=config['READ_TIMEOUT'],
+                max_retries=config['MAX_RETRIES'],
+                backoff=config['BACKOFF'],
+                backoff_max=config['BACKOFF_MAX'],
+                pool_size=config['POOL_SIZE'],
+                breaker=CircuitBreaker(config['BREAKER_FAILURE_THRESHOLD'], config['BREAKER_RESET_TIMEOUT']),
+            )
+        return _client
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils import timezone
+
+from billova_app.models import Expense, Category, OcrJob, UserSettings
+from billova_app.ocr.receipt import Receipt
+from billova_app.utils.global_resolver import get_global_categories, get_global_user
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_batch_executor = None
+_executor_lock = threading.Lock()
+
+
+class OcrTimeoutError(Exception):
+    """
+    Returned for the images of a batch which were not analyzed within `BILLOVA_OCR_BATCH_TIMEOUT` seconds.
+    """
+
+
+def get_executor():
+    """
+    Returns the process-wide worker pool processing OCR jobs, created on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.BILLOVA_OCR_WORKERS, thread_name_prefix='ocr')
+        return _executor
+
+
+def get_batch_executor():
+    """
+    Returns the process-wide worker pool analyzing the images of batch requests, created on first use. It is kept
+    apart from the job pool, so a request never waits behind a backlog of queued jobs.
+    """
+    global _batch_executor
+    with _executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=settings.BILLOVA_OCR_BATCH_WORKERS,
+                                                 thread_name_prefix='ocr-batch')
+        return _batch_executor
+
+
+def create_expense_from_receipt(owner, receipt):
+    """
+    Creates the expense of an analyzed receipt in the "Generated" category of the global user.
+    """
+    with transaction.atomic():
+        expense = Expense.objects.create(
+            owner=owner,
+            invoice_date_time=receipt.invoice_date_time,
+            price=receipt.price,
+            currency=UserSettings.objects.get(owner=owner).currency,
+            invoice_issuer=receipt.invoice_issuer,
+            invoice_as_text=receipt.invoice_as_text,
+        )
+        category = get_global_categories().get("Generated")
+        if category is None:
+            category, created = Category.objects.get_or_create(name="Generated", owner=get_global_user())
+        expense.categories.set([category])
+
+    return expense
+
+
+def enqueue_ocr_job(job):
+    """
+    Hands the job to the worker pool once the current transaction is committed, so the worker can see it.
+    With `BILLOVA_OCR_EAGER` enabled, the job is processed right away in the calling thread instead.
+    """
+    if settings.BILLOVA_OCR_EAGER:
+        transaction.on_commit(lambda: process_ocr_job(job.id))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run_in_worker, process_ocr_job, job.id))
+    logger.info(f"OCR job {job.id} queued for user {job.owner_id}")
+
+
+def _run_in_worker(function, *args):
+    try:
+        return function(*args)
+    finally:
+        # Worker threads open their own database connections
+        close_old_connections()
+
+
+def analyze_receipts(images):
+    """
+    Analyzes several receipt images concurrently on the batch worker pool. Images not analyzed within
+    `BILLOVA_OCR_BATCH_TIMEOUT` seconds are given up, an `OcrTimeoutError` takes their place.
+
+    Args:
+        images (list): The receipt images as bytes or binary file-like objects.
+
+    Returns:
+        list: One analyzed `Receipt` or the raised exception per image, in the order of the images.
+    """
+    if settings.BILLOVA_OCR_EAGER:
+        return [_analyze_receipt(image) for image in images]
+
+    futures = [get_batch_executor().submit(_run_in_worker, _analyze_receipt, image) for image in images]
+    deadline = time.monotonic() + settings.BILLOVA_OCR_BATCH_TIMEOUT
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+        except FutureTimeoutError:
+            # Images still waiting for a worker are dropped, a running analysis finishes in the background
+            future.cancel()
+            results.append(OcrTimeoutError(
+                f"OCR processing timed out after {settings.BILLOVA_OCR_BATCH_TIMEOUT} seconds."))
+    return results
+
+
+def _analyze_receipt(image):
+    try:
+        receipt = Receipt(image)
+        receipt.analyze()
+        return receipt
+    except Exception as e:
+        return e
+
+
+def process_ocr_job(job_id):
+    """
+    Analyzes the receipt of a pending job and creates its expense.
+
+    Returns:
+        OcrJob: The finished job, or None if the job was already picked up by another worker.
+    """
+    # Claim the job, so a job is never processed twice
+    claimed = OcrJob.objects.filter(id=job_id, status=OcrJob.STATUS_PENDING).update(status=OcrJob.STATUS_RUNNING)
+    if not claimed:
+        logger.warning(f"OCR job {job_id} is not pending anymore, skipping it.")
+        return None
+
+    job = OcrJob.objects.select_related('owner').get(id=job_id)
+    try:
+        logger.info(f"Starting OCR processing of job {job.id}")
+        with job.image.open('rb') as image:
+            receipt = Receipt(image)
+            receipt.analyze()
+
+        with transaction.atomic():
+            job.expense = create_expense_from_receipt(job.owner, receipt)
+            job.status = OcrJob.STATUS_DONE
+            job.finished_at = timezone.now()
+            job.save(update_fields=['expense', 'status', 'finished_at'])
+
+        logger.info(f"OCR job {job.id} processed successfully. Expense created: {job.expense}")
+    except Exception as e:
+        logger.error(f"OCR processing of job {job.id} failed: {e}")
+        job.status = OcrJob.STATUS_FAILED
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+
+    if job.image:
+        job.image.delete(save=False)
+        job.save(update_fields=['image'])
+
+    return job
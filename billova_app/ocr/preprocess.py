@@ -0,0 +1,68 @@
+import logging
+import time
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Re-encoded images up to this size are kept in memory, larger ones are written to a temporary file
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+@contextmanager
+def _timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def preprocess_receipt(source, max_dimension=None, quality=None):
+    """
+    Prepares a receipt photo for the OCR upload: applies the EXIF orientation, converts it to grayscale,
+    downsamples it so its longer edge is at most `max_dimension` pixels and re-encodes it as JPEG.
+
+    The source is read lazily by Pillow. For JPEG sources the decoder already scales down while decoding,
+    so a full resolution copy of a large photo is never held in memory.
+
+    Args:
+        source: Binary file-like object with the image, e.g. an uploaded file.
+        max_dimension (int): Longest edge of the result in pixels, `BILLOVA_OCR_MAX_DIMENSION` by default.
+        quality (int): JPEG quality of the result, `BILLOVA_OCR_JPEG_QUALITY` by default.
+
+    Returns:
+        tuple: The re-encoded JPEG as a file-like object positioned at its start, and the duration of each stage
+            in milliseconds.
+    """
+    max_dimension = max_dimension or settings.BILLOVA_OCR_MAX_DIMENSION
+    quality = quality or settings.BILLOVA_OCR_JPEG_QUALITY
+    timings = {}
+
+    with _timed(timings, 'decode'):
+        image = Image.open(source)
+        original_size = image.size
+        image.draft('L', (max_dimension, max_dimension))
+        image.load()
+
+    with _timed(timings, 'orient'):
+        image = ImageOps.exif_transpose(image)
+
+    with _timed(timings, 'grayscale'):
+        image = image.convert('L')
+
+    with _timed(timings, 'resize'):
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    with _timed(timings, 'encode'):
+        output = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        image.save(output, 'JPEG', quality=quality, optimize=True)
+        encoded_size = output.tell()
+        output.seek(0)
+
+    logger.info("Receipt preprocessed from %sx%s to %sx%s (%d bytes) in %s ms",
+                original_size[0], original_size[1], image.size[0], image.size[1], encoded_size, timings)
+    return output, timings
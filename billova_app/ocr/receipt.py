@@ -1,13 +1,19 @@
-import os
+import logging
+import time
 from datetime import timezone
 from io import BytesIO
 
-import requests
 from dateutil import parser
 
-from django.contrib.auth.models import User
 from django.utils import timezone
 
+from billova_app.ocr.cache import get_ocr_cache, hash_image
+from billova_app.ocr.client import get_veryfi_client
+from billova_app.ocr.preprocess import preprocess_receipt
+from billova_app.utils.global_resolver import get_global_user
+
+logger = logging.getLogger(__name__)
+
 
 class Receipt:
     """
@@ -17,40 +23,49 @@ class Receipt:
         https://docs.veryfi.com/api/receipts-invoices/process-a-document/
     """
 
-    def __init__(self, receipt: bytes):
+    def __init__(self, receipt):
         """
-        :param receipt: The receipt image as bytes.
+        :param receipt: The receipt image, as bytes or as a binary file-like object which is read as a stream.
         """
-        self.__receipt: bytes = receipt
-        self.__client_id = os.getenv("VERYFI_CLIENT_ID")
-        self.__username = os.getenv("VERYFI_USERNAME")
-        self.__api_key = os.getenv("VERYFI_API_KEY")
+        self.__receipt = BytesIO(receipt) if isinstance(receipt, (bytes, bytearray)) else receipt
+        self.timings = {}
 
         self.invoice_date_time = timezone.now()
         self.price = None
         self.invoice_issuer = ''
         self.invoice_as_text = ''
-        self.categories = [{"name":"Generated", "owner": User.objects.get(username='global')}]
+        self.categories = [{"name":"Generated", "owner": get_global_user()}]
 
     def analyze(self):
-        url = "https://api.veryfi.com/api/v8/partner/documents/"
-
-        file_like = BytesIO(self.__receipt)
-
-        files = {
-            "file": ("receipt.jpg", file_like, "image/jpeg"),
-        }
-
-        # Headers for authentication
-        headers = {
-            "CLIENT-ID": self.__client_id,
-            "AUTHORIZATION": f"apikey {self.__username}:{self.__api_key}",
-        }
-        # if response.status_code == 201:
-        # Send the request
-        response = requests.post(url, headers=headers, files=files)
+        # The same image was analyzed before, e.g. when a receipt is uploaded again after a failed form submit
+        cache = get_ocr_cache()
+        image_hash = hash_image(self.__receipt)
+        cached = cache.get(image_hash)
+        if cached:
+            self.invoice_date_time = cached.invoice_date_time
+            self.price = cached.price
+            self.invoice_issuer = cached.invoice_issuer
+            self.invoice_as_text = cached.invoice_as_text
+            return None
+
+        # Smaller, grayscale uploads are faster to transfer and to process for the provider
+        try:
+            image, self.timings = preprocess_receipt(self.__receipt)
+        except OSError as e:
+            logger.warning("Receipt preprocessing failed, uploading the original image: %s", e)
+            self.__receipt.seek(0)
+            image = self.__receipt
+
+        # The shared client pools connections, applies timeouts and retries and fails fast while Veryfi is down
+        start = time.perf_counter()
+        try:
+            data = get_veryfi_client().process_document("receipt.jpg", image, "image/jpeg")
+        finally:
+            if image is not self.__receipt:
+                image.close()
+        self.timings['upload'] = round((time.perf_counter() - start) * 1000, 2)
+        logger.info("Receipt analyzed, stage timings in ms: %s", self.timings)
 
-        data = response.json()
         try:
             self.invoice_date_time = parser.parse(data.get("date"))
         except:
@@ -71,4 +86,5 @@ class Receipt:
         except:
             self.invoice_as_text = ''
 
+        cache.set(image_hash, self)
         return None
\ No newline at end of file
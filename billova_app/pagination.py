@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ExpenseCursorPagination(CursorPagination):
+    """
+    Keyset pagination for expenses.
+
+    Pages are fetched with a `WHERE invoice_date_time > <cursor>` condition instead of an OFFSET scan and no
+    `COUNT(*)` is executed, so every page costs the same no matter how deep the client walks. The ordering matches
+    the (owner, invoice_date_time, id) index on `Expense`.
+    """
+    ordering = ('invoice_date_time', 'id')
+
+    # Query parameter used to opt in to cursor pagination, e.g. `/api/v1/expenses/?pagination=cursor`
+    mode_query_param = 'pagination'
+    mode_query_value = 'cursor'
+
+    @classmethod
+    def is_requested(cls, request):
+        return request.query_params.get(cls.mode_query_param) == cls.mode_query_value
@@ -0,0 +1,186 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from billova_app.models import Expense, MonthlySpend
+from billova_app.versions import bump_data_versions
+
+logger = logging.getLogger(__name__)
+
+# Number of rows written per INSERT when the rollup is rebuilt
+REBUILD_BATCH_SIZE = 1000
+
+CENT = Decimal('0.01')
+
+
+def month_of(invoice_date_time):
+    """
+    Returns the first day of the month of the given invoice date, in the current time zone.
+    This matches what `TruncMonth` computes in the database.
+    """
+    # The attribute still holds the assigned value when a string was given instead of a datetime
+    invoice_date_time = Expense._meta.get_field('invoice_date_time').to_python(invoice_date_time)
+    if timezone.is_aware(invoice_date_time):
+        invoice_date_time = timezone.localtime(invoice_date_time)
+    return invoice_date_time.date().replace(day=1)
+
+
+def _apply(deltas):
+    """
+    Applies the given deltas to the rollup table.
+
+    Args:
+        deltas (dict): Maps (owner_id, month, currency, category_id) to a (total, expense_count) tuple.
+            A category id of None addresses the monthly total.
+    """
+    for (owner_id, month, currency, category_id), (amount, count) in deltas.items():
+        if not amount and not count:
+            continue
+
+        lookup = dict(owner_id=owner_id, month=month, currency=currency, category_id=category_id)
+        updated = MonthlySpend.objects.filter(**lookup).update(total=F('total') + amount,
+                                                               expense_count=F('expense_count') + count)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    MonthlySpend.objects.create(total=amount, expense_count=count, **lookup)
+            except IntegrityError:
+                # Created concurrently by another request in the meantime
+                MonthlySpend.objects.filter(**lookup).update(total=F('total') + amount,
+                                                             expense_count=F('expense_count') + count)
+
+        if count < 0:
+            MonthlySpend.objects.filter(expense_count__lte=0, **lookup).delete()
+
+
+def _add_expense_deltas(deltas, expense, category_ids, sign, include_total=True):
+    """
+    Adds the contribution of a single expense to the deltas, positive for sign=1, negative for sign=-1.
+    `expense` can be an `Expense` or a dictionary with the same attributes.
+    """
+    get = expense.get if isinstance(expense, dict) else lambda name: getattr(expense, name)
+    month = month_of(get('invoice_date_time'))
+    amount = Decimal(str(get('price'))).quantize(CENT) * sign
+
+    keys = [None] if include_total else []
+    keys.extend(category_ids)
+    for category_id in keys:
+        key = (get('owner_id'), month, get('currency'), category_id)
+        total, count = deltas[key]
+        deltas[key] = (total + amount, count + sign)
+
+
+def _new_deltas():
+    return defaultdict(lambda: (Decimal(0), 0))
+
+
+def record_expenses(expenses, category_ids_by_expense=None, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) a batch of expenses to or from the rollup.
+    Used by code paths that bypass the model signals, e.g. `bulk_create`.
+
+    Args:
+        expenses (list): `Expense` instances.
+        category_ids_by_expense (dict): Maps expense ids to the ids of their categories.
+        sign (int): 1 to add the expenses, -1 to remove them.
+    """
+    category_ids_by_expense = category_ids_by_expense or {}
+    deltas = _new_deltas()
+    for expense in expenses:
+        _add_expense_deltas(deltas, expense, category_ids_by_expense.get(expense.pk, ()), sign)
+
+    with transaction.atomic():
+        _apply(deltas)
+
+
+def record_expense_change(previous, expense, category_ids):
+    """
+    Moves the contribution of an updated expense from its previous state to its current one.
+
+    Args:
+        previous (dict): owner_id, invoice_date_time, currency and price before the update.
+        expense (Expense): The updated expense.
+        category_ids (list): Ids of the categories of the expense.
+    """
+    deltas = _new_deltas()
+    _add_expense_deltas(deltas, previous, category_ids, -1)
+    _add_expense_deltas(deltas, expense, category_ids, 1)
+
+    with transaction.atomic():
+        _apply(deltas)
+
+
+def record_category_links(expense_ids, category_ids_by_expense, sign):
+    """
+    Adds (sign=1) or removes (sign=-1) the category share of expenses after their categories changed.
+    The monthly totals are not affected by category changes.
+
+    Args:
+        expense_ids (iterable): Ids of the expenses whose categories changed.
+        category_ids_by_expense (dict): Maps expense ids to the added or removed category ids.
+        sign (int): 1 if the categories were added, -1 if they were removed.
+    """
+    expenses = Expense.objects.filter(pk__in=expense_ids).values('id', 'owner_id', 'invoice_date_time',
+                                                                 'currency', 'price')
+    deltas = _new_deltas()
+    for expense in expenses:
+        _add_expense_deltas(deltas, expense, category_ids_by_expense.get(expense['id'], ()), sign,
+                            include_total=False)
+
+    with transaction.atomic():
+        _apply(deltas)
+
+
+def rebuild_monthly_spend(owner_ids, batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recomputes the rollup rows of the given users from the `Expense` table with two grouped queries.
+
+    Args:
+        owner_ids (list): Ids of the users whose rows are rebuilt.
+        batch_size (int): Number of rows written per INSERT.
+
+    Returns:
+        int: The number of rollup rows written.
+    """
+    month = TruncMonth('invoice_date_time', output_field=DateField())
+    totals = (
+        Expense.objects.filter(owner_id__in=owner_ids)
+        .annotate(month=month)
+        .values('owner_id', 'month', 'currency')
+        .annotate(total=Sum('price'), expense_count=Count('id'))
+        .order_by()
+    )
+
+    category_month = TruncMonth('expense__invoice_date_time', output_field=DateField())
+    category_totals = (
+        Expense.categories.through.objects.filter(expense__owner_id__in=owner_ids)
+        .annotate(month=category_month)
+        .values('expense__owner_id', 'month', 'expense__currency', 'category_id')
+        .annotate(total=Sum('expense__price'), expense_count=Count('expense_id'))
+        .order_by()
+    )
+
+    rows = [
+        MonthlySpend(owner_id=row['owner_id'], month=row['month'], currency=row['currency'],
+                     total=row['total'], expense_count=row['expense_count'])
+        for row in totals
+    ]
+    rows.extend(
+        MonthlySpend(owner_id=row['expense__owner_id'], month=row['month'], currency=row['expense__currency'],
+                     category_id=row['category_id'], total=row['total'], expense_count=row['expense_count'])
+        for row in category_totals
+    )
+
+    with transaction.atomic():
+        MonthlySpend.objects.filter(owner_id__in=owner_ids).delete()
+        MonthlySpend.objects.bulk_create(rows, batch_size=batch_size)
+        # The monthly expenses of the users may have changed
+        bump_data_versions(owner_ids)
+
+    logger.debug("Rebuilt %d monthly spend rows for %d users.", len(rows), len(owner_ids))
+    return len(rows)
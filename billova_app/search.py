@@ -0,0 +1,134 @@
+import logging
+import re
+from functools import reduce
+from operator import and_, or_
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from billova_app.models import Expense
+
+logger = logging.getLogger(__name__)
+
+# FTS5 index over the owner and the searchable fields of the expenses, created by migrations 0006 and 0010
+SEARCH_TABLE = 'billova_app_expense_fts'
+SEARCH_FIELDS = ('invoice_issuer', 'note', 'invoice_as_text')
+
+# bm25 weights of the indexed columns: a match in the issuer counts more than one in the note or the receipt text.
+# The owner column only restricts the matches, it does not rank them.
+SEARCH_WEIGHTS = (0.0, 5.0, 2.0, 1.0)
+
+# Longest search query accepted, in terms
+MAX_SEARCH_TERMS = 10
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def get_search_terms(query):
+    """
+    Splits a user query into its words, dropping the FTS5 operators and punctuation.
+    """
+    return _TERM.findall(query or '')[:MAX_SEARCH_TERMS]
+
+
+def _build_match(terms, owner_id=None):
+    # Every term must match, as a prefix, e.g. "coff" finds "coffee", in one of the text columns. With an owner, only
+    # the expenses of the owner are matched.
+    match = '{%s} : (%s)' % (' '.join(SEARCH_FIELDS), ' AND '.join(f'"{term}"*' for term in terms))
+    if owner_id is not None:
+        match = f'owner_id : "{int(owner_id)}" AND {match}'
+    return match
+
+
+def filter_by_search(queryset, query, owner_id=None):
+    """
+    Restricts a queryset of expenses to the expenses matching all words of the query, leaving the ordering to the
+    caller. The FTS5 index is used on SQLite, a case-insensitive substring search on other databases.
+
+    With the id of the owner of the expenses, the FTS5 index only matches the expenses of the owner instead of
+    matching those of all users.
+    """
+    terms = get_search_terms(query)
+    if not terms:
+        return queryset
+
+    if connection.vendor != 'sqlite':
+        conditions = [reduce(or_, (Q(**{f'{field}__icontains': term}) for field in SEARCH_FIELDS)) for term in terms]
+        return queryset.filter(reduce(and_, conditions))
+
+    return queryset.filter(id__in=RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+                                         [_build_match(terms, owner_id)]))
+
+
+class ExpenseSearchResults:
+    """
+    The ids of the expenses of the owner matching all words of the query, the best match first, as a lazy sequence
+    for the paginators: the count and each slice run a query of their own, so only the ids of the requested page are
+    fetched, however many expenses match.
+
+    On SQLite the FTS5 index matches the expenses of the owner only, and ranks them with bm25. Other databases fall
+    back to a case-insensitive substring search, ordered by invoice date.
+    """
+
+    def __init__(self, owner, query):
+        self.owner = owner
+        self.terms = get_search_terms(query)
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            if not self.terms:
+                self._count = 0
+            elif connection.vendor != 'sqlite':
+                self._count = self._get_queryset().count()
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT COUNT(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+                                   [_build_match(self.terms, self.owner.id)])
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step not in (None, 1):
+            raise TypeError("Search results can only be sliced.")
+        start, stop, _ = item.indices(self.count())
+        if not self.terms or stop <= start:
+            return []
+
+        if connection.vendor != 'sqlite':
+            return list(self._get_queryset().values_list('id', flat=True)[start:stop])
+
+        weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT expense.id FROM {SEARCH_TABLE} "
+                f"INNER JOIN billova_app_expense expense ON expense.id = {SEARCH_TABLE}.rowid "
+                f"WHERE {SEARCH_TABLE} MATCH %s "
+                f"ORDER BY bm25({SEARCH_TABLE}, {weights}), expense.invoice_date_time DESC, expense.id DESC "
+                f"LIMIT %s OFFSET %s",
+                [_build_match(self.terms, self.owner.id), stop - start, start],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _get_queryset(self):
+        return filter_by_search(Expense.objects.filter(owner=self.owner), ' '.join(self.terms)).order_by(
+            '-invoice_date_time', '-id')
+
+
+def rebuild_search_index(optimize=False):
+    """
+    Rebuilds the FTS5 index from the expense table, e.g. after the expenses were changed with triggers disabled.
+    """
+    if connection.vendor != 'sqlite':
+        logger.warning("The full-text search index only exists on SQLite, nothing to rebuild.")
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+        if optimize:
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    return True
@@ -1,10 +1,11 @@
 import logging
 
-from django.contrib.auth.models import User
+from django.conf import settings
 from rest_framework import serializers, status
 from rest_framework.response import Response
 
-from billova_app.models import Expense, UserSettings, Category
+from billova_app.models import Expense, UserSettings, Category, OcrJob
+from billova_app.utils.global_resolver import get_global_categories
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +19,14 @@ class CategorySerializer(serializers.HyperlinkedModelSerializer):
 
     def create(self, validated_data):
         logger.info("Starting category creation.")
-        global_user = User.objects.get(username='global')
         user = validated_data.pop('owner', None)
 
         try:
             # Check if category exists for the global user
             logger.debug(f"Checking if category exists for the global user: {validated_data}")
-            existing_category = Category.objects.get(owner=global_user, **validated_data)
+            existing_category = get_global_categories().get(validated_data.get('name'))
+            if existing_category is None:
+                raise Category.DoesNotExist()
             logger.warning(f"Category already exists globally: {existing_category.name}")
             return Response({'detail': 'Category already exists.'}, status=status.HTTP_400_BAD_REQUEST)
         except Category.DoesNotExist:
@@ -54,32 +56,44 @@ class ExpenseSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['url', 'id', 'invoice_date_time', 'price', 'currency', 'note', 'categories', 'invoice_issuer',
                   'invoice_as_text', 'owner']
 
+    def _resolve_categories(self, owner, categories_data):
+        """
+        Resolves the submitted categories with a single query. Categories of the owner win over global categories
+        with the same name. Raises a `ValidationError` for unknown names.
+        """
+        names = {category_data.get('name') for category_data in categories_data}
+        categories = {category.name: category for category in Category.objects.filter(owner=owner, name__in=names)}
+
+        global_categories = get_global_categories()
+        unknown = sorted(name for name in names - categories.keys() if name not in global_categories)
+        if unknown:
+            raise serializers.ValidationError(
+                {'categories': [f"Category '{name}' does not exist." for name in unknown]})
+        for name in names - categories.keys():
+            categories[name] = global_categories[name]
+        return list(categories.values())
+
     def create(self, validated_data):
         logger.info("Starting expense creation.")
         categories_data = validated_data.pop('categories')
         try:
-            expense = Expense.objects.create(**validated_data)
-            logger.info(f"Expense created with ID: {expense.id}")
+            owner = validated_data['owner']
+            categories = self._resolve_categories(owner, categories_data)
 
             # Set currency from UserSettings
-            user_settings = UserSettings.objects.filter(owner=expense.owner).first()
-            if user_settings:
-                expense.currency = user_settings.currency
-                logger.info(f"Currency set to {expense.currency} for user {expense.owner.username}.")
+            currency = UserSettings.objects.filter(owner=owner).values_list('currency', flat=True).first()
+            if currency:
+                validated_data['currency'] = currency
+                logger.info(f"Currency set to {currency} for user {owner.username}.")
             else:
-                logger.warning(f"No UserSettings found for user {expense.owner.username}. Currency not set.")
+                logger.warning(f"No UserSettings found for user {owner.username}. Currency not set.")
 
-            expense.save()
+            expense = Expense.objects.create(**validated_data)
+            logger.info(f"Expense created with ID: {expense.id}")
 
             # Handle categories
-            global_user = User.objects.get(username='global')
-            for category_data in categories_data:
-                try:
-                    category = Category.objects.get(owner=expense.owner, **category_data)
-                except Category.DoesNotExist:
-                    category = Category.objects.get(owner=global_user, **category_data)
-                expense.categories.add(category)
-                logger.info(f"Category '{category.name}' added to expense ID: {expense.id}.")
+            expense.categories.add(*categories)
+            logger.info(f"Categories {[category.name for category in categories]} added to expense ID: {expense.id}.")
 
             return expense
         except Exception as e:
@@ -91,6 +105,8 @@ class ExpenseSerializer(serializers.HyperlinkedModelSerializer):
         categories_data = validated_data.pop('categories', [])
 
         try:
+            categories = self._resolve_categories(instance.owner, categories_data)
+
             # Update expense fields
             instance.invoice_date_time = validated_data.get('invoice_date_time', instance.invoice_date_time)
             instance.price = validated_data.get('price', instance.price)
@@ -101,16 +117,15 @@ class ExpenseSerializer(serializers.HyperlinkedModelSerializer):
             instance.save()
             logger.info(f"Expense ID: {instance.id} updated successfully.")
 
-            # Update categories
-            instance.categories.clear()
-            global_user = User.objects.get(username='global')
-            for category_data in categories_data:
-                try:
-                    category = Category.objects.get(owner=instance.owner, **category_data)
-                except Category.DoesNotExist:
-                    category = Category.objects.get(owner=global_user, **category_data)
-                instance.categories.add(category)
-                logger.info(f"Category '{category.name}' added to expense ID: {instance.id}.")
+            # Update categories, only touching the links which changed
+            current_ids = {category.id for category in instance.categories.all()}
+            new_ids = {category.id for category in categories}
+            if current_ids - new_ids:
+                instance.categories.remove(*(current_ids - new_ids))
+            if new_ids - current_ids:
+                instance.categories.add(*(new_ids - current_ids))
+            logger.info(f"Categories of expense ID: {instance.id} updated, "
+                        f"{len(new_ids - current_ids)} added, {len(current_ids - new_ids)} removed.")
 
             return instance
         except Exception as e:
@@ -126,6 +141,49 @@ class ExpenseOCRSerializer(serializers.Serializer):
         return data
 
 
+class ExpenseOCRBatchSerializer(serializers.Serializer):
+    images = serializers.ListField(child=serializers.ImageField(), allow_empty=False,
+                                   max_length=settings.BILLOVA_OCR_BATCH_MAX_IMAGES)
+
+
+class OcrJobSerializer(serializers.HyperlinkedModelSerializer):
+    expense = ExpenseSerializer(read_only=True)
+
+    class Meta:
+        model = OcrJob
+        fields = ['url', 'id', 'status', 'error', 'expense', 'created_at', 'finished_at']
+
+
+class ExpenseImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    file_format = serializers.ChoiceField(choices=['csv', 'ndjson'], required=False)
+
+    def validate(self, data):
+        # Fall back to the file extension if the format is not given explicitly
+        if 'file_format' not in data:
+            name = data['file'].name.lower()
+            if name.endswith('.csv'):
+                data['file_format'] = 'csv'
+            elif name.endswith(('.ndjson', '.jsonl')):
+                data['file_format'] = 'ndjson'
+            else:
+                raise serializers.ValidationError({'file_format': 'Cannot detect the file format, please provide it.'})
+        return data
+
+
+class ExpenseImportRowSerializer(serializers.Serializer):
+    """
+    Validates a single row of an expense import. Categories are given by name.
+    """
+    invoice_date_time = serializers.DateTimeField(required=False)
+    price = serializers.DecimalField(max_digits=14, decimal_places=2)
+    currency = serializers.CharField(max_length=3, required=False, allow_blank=True)
+    note = serializers.CharField(required=False, allow_blank=True)
+    invoice_issuer = serializers.CharField(required=False, allow_blank=True)
+    invoice_as_text = serializers.CharField(required=False, allow_blank=True)
+    categories = serializers.ListField(child=serializers.CharField(max_length=255), required=False)
+
+
 class UserSettingsSerializer(serializers.HyperlinkedModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
 
@@ -1,13 +1,33 @@
 import logging
+from collections import defaultdict
+from functools import partial
 
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 
-from .models import UserSettings
+from .models import UserSettings, Expense, Category
+from .rollups import record_expenses, record_expense_change, record_category_links
+from .utils.category_catalogue import invalidate_category_catalogue
+from .utils.global_resolver import GLOBAL_USERNAME, is_global_user_id, invalidate_global_user, \
+    invalidate_global_categories
+from .versions import bump_data_versions
 
 logger = logging.getLogger(__name__)
 
+# Fields of an expense which determine its contribution to the monthly spend rollup
+ROLLUP_FIELDS = ('owner_id', 'invoice_date_time', 'currency', 'price')
+
+
+def _is_user_cascade(origin):
+    """
+    Tells whether a delete signal is sent for an object deleted together with its user, by `user.delete()` or by
+    the delete of a user queryset. The rows depending on the user are deleted by the same cascade.
+    """
+    return isinstance(origin, User) or (isinstance(origin, QuerySet) and origin.model is User)
+
 
 @receiver(post_save, sender=User)
 def create_user_settings(sender, instance, created, **kwargs):
@@ -17,3 +37,123 @@ def create_user_settings(sender, instance, created, **kwargs):
             logger.info(f"UserSettings created for new user: {instance.username}")
         except Exception as e:
             logger.error(f"Error creating UserSettings for user {instance.username}: {e}")
+
+
+@receiver(post_save, sender=UserSettings)
+def bump_data_version_on_settings_change(sender, instance, created, raw=False, **kwargs):
+    # The monthly expenses are converted into the currency of the settings
+    if not created and not raw:
+        bump_data_versions([instance.owner_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_global_user(sender, instance, **kwargs):
+    if instance.username == GLOBAL_USERNAME or is_global_user_id(instance.id):
+        invalidate_global_user()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cached_global_categories(sender, instance, **kwargs):
+    if is_global_user_id(instance.owner_id):
+        invalidate_global_categories()
+        logger.debug(f"Global categories changed: {instance.name}")
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cached_category_catalogue(sender, instance, **kwargs):
+    # After the commit, so a concurrent request cannot cache the old categories again
+    transaction.on_commit(partial(invalidate_category_catalogue, instance.owner_id))
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Category)
+def bump_data_version_on_change(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or _is_user_cascade(origin):
+        # The version row is deleted together with the user
+        return
+    bump_data_versions([instance.owner_id])
+
+
+@receiver(m2m_changed, sender=Expense.categories.through)
+def bump_data_version_on_categories_change(sender, instance, action, **kwargs):
+    # Expenses only link categories of their owner or global ones, and a change of the global user's version
+    # invalidates the responses of every user, so the owner of the changed side is enough for both directions.
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_data_versions([instance.owner_id])
+
+
+@receiver(pre_save, sender=Expense)
+def remember_expense_state(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored state of an expense before it is updated, so its old contribution
+    can be removed from the monthly spend rollup.
+    """
+    instance._monthly_spend_previous = None
+    if instance.pk and not raw:
+        instance._monthly_spend_previous = Expense.objects.filter(pk=instance.pk).values(*ROLLUP_FIELDS).first()
+
+
+@receiver(post_save, sender=Expense)
+def update_monthly_spend_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous = instance.__dict__.pop('_monthly_spend_previous', None)
+    if previous is None:
+        # A new expense has no categories yet, they are added through the m2m signal
+        record_expenses([instance])
+        return
+
+    if all(previous[field] == getattr(instance, field) for field in ROLLUP_FIELDS):
+        return
+
+    category_ids = list(instance.categories.values_list('id', flat=True))
+    record_expense_change(previous, instance, category_ids)
+    logger.debug(f"Monthly spend updated for changed expense ID: {instance.id}")
+
+
+@receiver(pre_delete, sender=Expense)
+def update_monthly_spend_on_delete(sender, instance, origin=None, **kwargs):
+    if _is_user_cascade(origin):
+        # The rollup rows are deleted together with the user
+        return
+
+    category_ids = list(instance.categories.values_list('id', flat=True))
+    record_expenses([instance], {instance.pk: category_ids}, sign=-1)
+
+
+@receiver(m2m_changed, sender=Expense.categories.through)
+def update_monthly_spend_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep the category share of the monthly spend rollup in sync with `Expense.categories`,
+    for changes made from either side of the relation.
+    """
+    if action in ('pre_remove', 'pre_clear'):
+        # Only links which actually exist are removed, so look them up before they are gone
+        links = sender.objects.filter(**{'category_id' if reverse else 'expense_id': instance.pk})
+        if action == 'pre_remove':
+            links = links.filter(**{'expense_id__in' if reverse else 'category_id__in': pk_set})
+        instance._monthly_spend_removed_links = list(links.values_list('expense_id', 'category_id'))
+        return
+
+    if action in ('post_remove', 'post_clear'):
+        links = instance.__dict__.pop('_monthly_spend_removed_links', [])
+        sign = -1
+    elif action == 'post_add':
+        links = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+        sign = 1
+    else:
+        return
+
+    if not links:
+        return
+
+    category_ids_by_expense = defaultdict(list)
+    for expense_id, category_id in links:
+        category_ids_by_expense[expense_id].append(category_id)
+    record_category_links(category_ids_by_expense.keys(), category_ids_by_expense, sign)
@@ -76,7 +76,6 @@ const logger = new Logger(log_level);
 
 const SELECTORS = {
     expenseTable: '#expensesTable',
-    expenseTableBody: '.uiExpensesTblBody',
     saveExpenseButton: '#saveExpenseEntryButton',
     editExpenseButton: '.edit-expense-btn',
     deleteExpenseButton: '.delete-expense-btn',
@@ -108,9 +107,13 @@ const SELECTORS = {
 
 const DATA = {
     bootstrapFormValidated: 'was-validated', // used by bootstrap to style invalid forms
-    vanillaDataTableInstance: undefined,
+    dataTableInstance: undefined,
+    // Expenses of the table page currently shown, by id. Used to prefill the edit form.
+    tableExpenses: new Map(),
+    expensesTableUrl: '/api/v1/expenses/table/',
     allCategoriesList: undefined,
-    sessionStorageKey: "expenses"
+    ocrJobPollIntervalMs: 1000,
+    ocrJobMaxPollAttempts: 120
 };
 
 document.addEventListener('DOMContentLoaded', function () {
@@ -140,11 +143,12 @@ function fetchAndUpdateCategoriesList(form, callback = undefined) {
         return;
     }
 
+    // The browser keeps the response and revalidates it with its ETag, unchanged categories are answered with 304
     fetch('/api/v1/categories/', {
         method: 'GET',
+        cache: 'no-cache',
         headers: {
             'Accept': 'application/json',
-            'Cache-Control': 'max-age=3600' // Cache for 1 hour
         }
     })
         .then(response => {
@@ -307,9 +311,7 @@ function saveExpense(e) {
                 logger.debug("Expense created successfully:", data);
 
                 Utils.closeModal(SELECTORS.createExpenseModal);
-                addExpenseToTable(data);
-                addExpenseToSessionStorage(data);
-                Utils.toggleElementVisibility(SELECTORS.noExpensesCard, false);
+                reloadExpensesTable();
 
                 Utils.showNotificationMessage(
                     `Expense added successfully: ${data.price} ${data.currency}`,
@@ -396,11 +398,12 @@ function saveOCRExpense(e) {
                 }
                 return response.json();
             })
+            // the receipt is processed in the background, wait until the expense was created
+            .then(job => waitForOcrJob(job.url))
             .then(data => {
                 logger.info('OCR Expense created successfully:', data);
 
-                addExpenseToTable(data);
-                Utils.toggleElementVisibility(SELECTORS.noExpensesCard, false);
+                reloadExpensesTable();
                 Utils.showNotificationMessage('Expense added successfully.', "success");
 
                 // Reset the input field
@@ -433,6 +436,37 @@ function saveOCRExpense(e) {
     }
 }
 
+/**
+ * Poll an OCR job until it is finished.
+ * Resolves with the created expense, rejects if the job failed or did not finish in time.
+ * @param jobUrl the url of the OCR job returned by the OCR endpoint
+ */
+async function waitForOcrJob(jobUrl) {
+    for (let attempt = 0; attempt < DATA.ocrJobMaxPollAttempts; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, DATA.ocrJobPollIntervalMs));
+
+        const response = await fetch(jobUrl, {
+            method: 'GET',
+            headers: {
+                'Accept': 'application/json',
+            }
+        });
+        if (!response.ok) {
+            throw new Error(`Failed to fetch OCR job: ${response.statusText}`);
+        }
+
+        const job = await response.json();
+        if (job.status === 'done') {
+            return job.expense;
+        }
+        if (job.status === 'failed') {
+            throw new Error(`OCR job failed: ${job.error}`);
+        }
+    }
+
+    throw new Error('OCR job did not finish in time.');
+}
+
 function toggleSaveOCRExpenseButtonState(disable = false) {
     const button = document.querySelector(SELECTORS.saveOCRExpenseButton);
     if (button) {
@@ -462,15 +496,9 @@ function onEditExpenseModalShown(e, formSelector) {
 
     const triggerButton = e.relatedTarget;
     const editedExpenseId = parseInt(triggerButton.dataset.expenseId);
-    const expenses = getExpensesFromSessionStorage();
     const errorMessage = "We cannot access the necessary information for your expense";
 
-    if (!expenses) {
-        Utils.showNotificationMessage(errorMessage, "error");
-        return;
-    }
-
-    const editedExpense = getExpenseById(editedExpenseId, expenses);
+    const editedExpense = DATA.tableExpenses.get(editedExpenseId);
     if (!editedExpense) {
         Utils.showNotificationMessage(errorMessage, "error");
         return;
@@ -570,13 +598,7 @@ function deleteExpense(e) {
 
             Utils.closeModal(SELECTORS.deleteExpenseEntryModal);
             Utils.showNotificationMessage('Expense deleted successfully', "success");
-
-            setTimeout(function () {
-                // we need to reload the page after delete. Reason is that the library is buggy, when
-                // there is some filter applied, and we try to use the library to remove the selected row, then
-                // an error is thrown
-                location.reload();
-            }, 1000);
+            reloadExpensesTable();
 
         })
         .catch(error => {
@@ -585,49 +607,99 @@ function deleteExpense(e) {
         });
 }
 
+/**
+ * Initialize the expense table in server-side processing mode.
+ * The table only requests the rows of the visible page, ordering and searching are done by the database.
+ */
 function populateExpensesTable() {
-    fetchAllExpenses()
-        .then(expenses => {
-            reinitializeVanillaDataTable();
-            addExpensesListToTable(expenses); // Pass all fetched expenses
-            saveExpensesInSessionStorage(expenses);
+    const tableElement = document.querySelector(SELECTORS.expenseTable);
+    if (!tableElement || typeof DataTable === 'undefined') {
+        logger.error('Expense table element or DataTable library not found.');
+        return;
+    }
+
+    DATA.dataTableInstance = new DataTable(tableElement, {
+        serverSide: true,
+        processing: true,
+        searchDelay: 400,
+        pageLength: 10,
+        lengthMenu: [5, 10, 15, 20],
+        order: [[0, 'desc']],
+        ajax: fetchExpensesTablePage,
+        columns: [
+            {data: 'invoice_date_time', render: data => Utils.stringToFormattedDate(data)},
+            {data: 'price'},
+            {data: 'currency', render: DataTable.render.text()},
+            {data: 'note', render: DataTable.render.text()},
+            {data: 'invoice_issuer', render: DataTable.render.text()},
+            {
+                data: 'categories',
+                orderable: false,
+                render: categories => DataTable.util.escapeHtml(categories.map(category => category.name).join(', '))
+            },
+            {
+                data: null,
+                orderable: false,
+                className: 'text-center',
+                render: (data, type, expense) => buildExpenseActions(expense)
+            },
+        ],
+    });
+}
+
+/**
+ * Fetch the page of the expense table requested by DataTables.
+ * The parameters of the server-side processing protocol (draw, start, length, order, columns, search)
+ * are passed on to the API.
+ */
+function fetchExpensesTablePage(data, callback) {
+    const params = new URLSearchParams({
+        draw: data.draw,
+        start: data.start,
+        length: data.length,
+        'search[value]': data.search.value,
+    });
+    data.columns.forEach((column, index) => {
+        params.append(`columns[${index}][data]`, column.data || '');
+    });
+    data.order.forEach((order, index) => {
+        params.append(`order[${index}][column]`, order.column);
+        params.append(`order[${index}][dir]`, order.dir);
+    });
+
+    fetch(`${DATA.expensesTableUrl}?${params}`, {
+        method: 'GET',
+        headers: {
+            'Accept': 'application/json',
+        }
+    })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok ' + response.statusText);
+            }
+            return response.json();
+        })
+        .then(page => {
+            DATA.tableExpenses = new Map(page.data.map(expense => [expense.id, expense]));
+            Utils.toggleElementVisibility(SELECTORS.noExpensesCard, page.recordsTotal === 0);
+            callback(page);
         })
         .catch(error => {
             logger.error(error.message);
             Utils.showNotificationMessage(
                 'We were unable to load your expense list. Please try again later.',
                 "error");
+            callback({draw: data.draw, recordsTotal: 0, recordsFiltered: 0, data: []});
         });
 }
 
 /**
- * Fetch all expenses asynchronous.
- * We are using django pagination, this means we always get 10 results for each request.
- * In the expense table, we want to load all the data at once and initialize the table
- * with the received data.
+ * Reload the current page of the expense table, e.g. after an expense was created, updated or deleted.
  */
-async function fetchAllExpenses(url = '/api/v1/expenses/') {
-    const expenses = [];
-
-    // Iterate over all the available result pages and create a new request for each of them
-    while (url) {
-        const response = await fetch(url, {
-            method: 'GET',
-            headers: {
-                'Accept': 'application/json',
-            }
-        });
-        if (!response.ok) {
-            Utils.toggleElementVisibility(SELECTORS.noExpensesCard, true);
-            throw new Error('Network response was not ok ' + response.statusText);
-        }
-
-        const data = await response.json();
-        expenses.push(...data.results); // Add current page results
-        url = data.next; // Get the next page URL
+function reloadExpensesTable() {
+    if (DATA.dataTableInstance) {
+        DATA.dataTableInstance.ajax.reload(null, false);
     }
-
-    return expenses;
 }
 
 function updateExpense(expenseId, editExpenseForm) {
@@ -668,10 +740,7 @@ function updateExpense(expenseId, editExpenseForm) {
 
             Utils.closeModal(SELECTORS.editExpenseEntryModal);
             Utils.showNotificationMessage('Expense updated successfully', "success");
-
-            setTimeout(function () {
-                location.reload();
-            }, 1000);
+            reloadExpensesTable();
 
         })
         .catch(error => {
@@ -682,62 +751,7 @@ function updateExpense(expenseId, editExpenseForm) {
         });
 }
 
-function addExpensesListToTable(expenses) {
-    try {
-        logger.debug("Initializing the addition of expenses to the table.");
-
-        const expensesTable = document.querySelector(SELECTORS.expenseTable);
-        if (!expensesTable) {
-            logger.error("Expenses table not found.");
-            Utils.toggleElementVisibility(SELECTORS.noExpensesCard, true);
-            Utils.showNotificationMessage("Error loading the table.", "error");
-            throw new Error("No expenses table found.");
-        }
-
-        if (!expenses || !Array.isArray(expenses)) {
-            logger.warn("No valid expenses list provided.");
-            Utils.toggleElementVisibility(SELECTORS.noExpensesCard, true);
-            throw new Error("List of expenses is not provided or invalid.");
-        }
-
-        if (!expenses.length) {
-            logger.warn("No expenses to display.");
-            Utils.toggleElementVisibility(SELECTORS.noExpensesCard, true);
-            return;
-        }
-
-        logger.debug(`Adding ${expenses.length} expenses to the table.`);
-        expenses.forEach(expense => {
-            try {
-                addExpenseToTable(expense);
-            } catch (expenseError) {
-                logger.error(`Error adding expense with ID: ${expense.id}`, expenseError);
-            }
-        });
-
-        logger.debug("All expenses have been added to the table successfully.");
-
-    } catch (error) {
-        logger.error("Error in addExpensesListToTable:", error);
-        Utils.showNotificationMessage(
-            "An unexpected error occurred while displaying expenses. Please try again later.",
-            "error"
-        );
-    }
-}
-
-function addExpenseToTable(expense, table = document.querySelector(SELECTORS.expenseTable)) {
-    const tableBody = table.querySelector(SELECTORS.expenseTableBody);
-    if (!tableBody) {
-        throw new Error('Table body not found');
-    }
-
-    // Prepare the data to be inserted into the DataTable
-    let categories = '';
-    if (expense.categories && expense.categories.length) {
-        categories = expense.categories.map(category => category.name).join(', ');
-    }
-
+function buildExpenseActions(expense) {
     const editButton = new ButtonBuilder()
         .class('btn btn-sm btn-secondary me-2 edit-expense-btn')
         .with('data-bs-toggle', 'modal')
@@ -757,85 +771,7 @@ function addExpenseToTable(expense, table = document.querySelector(SELECTORS.exp
         .append(editButton)
         .append(deleteButton);
 
-    const newData = [{
-        "Date": Utils.stringToFormattedDate(expense.invoice_date_time),
-        "Spent": expense.price,
-        "Currency": expense.currency,
-        "Note": expense.note,
-        "Issuer": expense.invoice_issuer,
-        "Category": categories,
-        "Actions": actionsContainer.build().outerHTML
-    }];
-
-    if (DATA.vanillaDataTableInstance) {
-        DATA.vanillaDataTableInstance.insert(newData);
-    }
-}
-
-function reinitializeVanillaDataTable() {
-    const tableElement = document.querySelector(SELECTORS.expenseTable);
-    if (!tableElement) {
-        logger.error('Expense table element not found.');
-        return;
-    }
-
-    if (DATA.vanillaDataTableInstance) {
-        DATA.vanillaDataTableInstance.refresh();
-    } else {
-        DATA.vanillaDataTableInstance = Utils.initializeVanillaDataTable(SELECTORS.expenseTable);
-        if (!DATA.vanillaDataTableInstance) {
-            logger.error('Failed to initialize Vanilla DataTable.');
-        }
-    }
-}
-
-/**
- * Store expenses in session storage.
- * When the user edits an expense, we will access the data stored in session storage
- * to be able to prefill the input fields.
- */
-function saveExpensesInSessionStorage(expenses) {
-    if (!window.sessionStorage) {
-        return logger.warn("Session storage not supported in your browser.");
-    }
-    window.sessionStorage.setItem(DATA.sessionStorageKey, JSON.stringify(expenses));
-}
-
-/**
- * Update the existing object in session storage or create a new one if it does not exist.
- */
-function addExpenseToSessionStorage(expense) {
-    if (!window.sessionStorage) {
-        return logger.warn("Session storage not supported in your browser.");
-    }
-
-    let currentExpenses = window.sessionStorage.getItem(DATA.sessionStorageKey);
-
-    if (!currentExpenses) {
-        currentExpenses = [];
-    } else {
-        currentExpenses = JSON.parse(currentExpenses);
-    }
-
-    currentExpenses.push(expense);
-
-    window.sessionStorage.setItem(DATA.sessionStorageKey, JSON.stringify(currentExpenses));
-}
-
-function getExpensesFromSessionStorage() {
-    const storedExpenses = window.sessionStorage.getItem(DATA.sessionStorageKey);
-
-    if (!storedExpenses) {
-        return [];
-    }
-
-    return JSON.parse(storedExpenses);
-}
-
-function getExpenseById(expenseId, expenses) {
-    const expense = expenses.find(exp => exp.id === expenseId);
-
-    return expense || null;
+    return actionsContainer.build().outerHTML;
 }
 
 function getCategoriesArrayFromSelectList(form) {
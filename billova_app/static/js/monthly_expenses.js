@@ -80,6 +80,17 @@ function loadMonthlyExpenses(page) {
         });
 }
 
+/**
+ * Format the total of a month, which the API converted into the currency of the user settings.
+ * Amounts in currencies without an exchange rate are shown next to it.
+ */
+function formatMonthlyTotal(expense) {
+    const unconverted = Object.entries(expense.unconverted || {})
+        .map(([currency, total]) => `${total} ${currency}`);
+    const total = `${expense.total_spent} ${expense.currency}`;
+    return unconverted.length ? `${total} + ${unconverted.join(' + ')}` : total;
+}
+
 function renderMonthlyExpenses(expenses) {
     const container = document.querySelector(SELECTORS.monthlyExpensesContainer);
     if (!container) {
@@ -129,7 +140,7 @@ function renderMonthlyExpenses(expenses) {
 
         const totalSpendContent = new ElementBuilder('p')
             .class('mb-0')
-            .text(`$${expense.total_spent}`);
+            .text(formatMonthlyTotal(expense));
 
         const accordionBody = new ElementBuilder('div')
             .class('accordion-body mt-5')
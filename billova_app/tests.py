@@ -1,3 +1,1520 @@
-from django.test import TestCase
+import hashlib
+import io
+import logging
+import os
+import queue
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import BufferingHandler
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.backends.sqlite3.base import SQLiteCursorWrapper
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.pagination import PageNumberPagination
+
+from billova_app.exchange import RatesFileError, get_rate, invalidate_exchange_rates, read_exchange_rates, \
+    store_exchange_rates
+from billova_app.exporters import EXPORT_CHUNK_SIZE
+from billova_app.middleware import normalize_sql
+from billova_app import log_queue as log_queue_module
+from billova_app.log_queue import SamplingFilter, _RoutingQueueHandler, _RoutingQueueListener, start_queue_logging, \
+    stop_queue_logging
+from billova_app.models import Expense, Category, DataVersion, MonthlySpend, OcrCacheEntry, OcrJob, UserSettings
+from billova_app.ocr.cache import OcrResultCache, hash_image
+from billova_app.ocr.client import CircuitBreaker, CircuitOpenError, OcrProviderError, VeryfiClient
+from billova_app.ocr.jobs import create_expense_from_receipt, get_batch_executor, get_executor
+from billova_app.ocr.preprocess import preprocess_receipt
+from billova_app.ocr.receipt import Receipt
+from billova_app.pagination import ExpenseCursorPagination
+from billova_app.rollups import rebuild_monthly_spend
+from billova_app.utils.global_resolver import get_global_categories, get_global_user, get_global_user_id, \
+    invalidate_global_categories, invalidate_global_user
+
+# Size of the fixture of the main test user
+EXPENSE_COUNT = 5000
+CATEGORY_COUNT = 30
+GLOBAL_CATEGORY_COUNT = 10
+MONTH_COUNT = 24
+
+
+class RowCounter:
+    """
+    Counts the rows fetched from the database per SQL statement while active.
+    """
+
+    def __init__(self):
+        self.rows = Counter()
+
+    @contextmanager
+    def capture(self):
+        original_execute = SQLiteCursorWrapper.execute
+        original_fetchone = SQLiteCursorWrapper.fetchone
+        original_fetchmany = SQLiteCursorWrapper.fetchmany
+        original_fetchall = SQLiteCursorWrapper.fetchall
+        counter = self
+
+        def execute(cursor, query, params=None):
+            cursor.budget_sql = query
+            return original_execute(cursor, query, params)
+
+        def count(cursor, rows):
+            counter.rows[getattr(cursor, 'budget_sql', '?')] += rows
+
+        def fetchone(cursor):
+            row = original_fetchone(cursor)
+            count(cursor, 0 if row is None else 1)
+            return row
+
+        def fetchmany(cursor, size=None):
+            rows = original_fetchmany(cursor) if size is None else original_fetchmany(cursor, size)
+            count(cursor, len(rows))
+            return rows
+
+        def fetchall(cursor):
+            rows = original_fetchall(cursor)
+            count(cursor, len(rows))
+            return rows
+
+        with mock.patch.object(SQLiteCursorWrapper, 'execute', execute), \
+                mock.patch.object(SQLiteCursorWrapper, 'fetchone', fetchone), \
+                mock.patch.object(SQLiteCursorWrapper, 'fetchmany', fetchmany), \
+                mock.patch.object(SQLiteCursorWrapper, 'fetchall', fetchall):
+            yield self
+
+    @property
+    def total(self):
+        return sum(self.rows.values())
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Base class for tests asserting how many queries an endpoint runs and how many rows it fetches.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, max_queries, max_rows):
+        """
+        Fails if the block runs more than `max_queries` queries or fetches more than `max_rows` rows.
+        The failure message lists the executed queries, or the queries fetching the most rows.
+        """
+        counter = RowCounter()
+        with CaptureQueriesContext(connection) as queries, counter.capture():
+            yield
+
+        if len(queries) > max_queries:
+            statements = '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(queries.captured_queries, 1))
+            self.fail(f"{len(queries)} queries executed, the budget is {max_queries}:\n{statements}")
+        if counter.total > max_rows:
+            statements = '\n'.join(f"{rows} rows: {sql}" for sql, rows in counter.rows.most_common())
+            self.fail(f"{counter.total} rows fetched, the budget is {max_rows}:\n{statements}")
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(42)
+        cls.global_user = User.objects.create(username='global')
+        cls.user = User.objects.create_user(username='budget', password='budget')
+        cls.other_user = User.objects.create_user(username='other', password='other')
+
+        global_categories = Category.objects.bulk_create(
+            Category(name=f"Global {i}", owner=cls.global_user) for i in range(GLOBAL_CATEGORY_COUNT))
+        own_categories = Category.objects.bulk_create(
+            Category(name=f"Own {i}", owner=cls.user) for i in range(CATEGORY_COUNT - GLOBAL_CATEGORY_COUNT))
+        cls.categories = global_categories + own_categories
+
+        start = timezone.make_aware(datetime(2023, 1, 1))
+        expenses = Expense.objects.bulk_create(
+            Expense(
+                owner=cls.user,
+                invoice_date_time=start + timedelta(days=rng.randrange(MONTH_COUNT * 30), minutes=i),
+                price=Decimal(rng.randrange(100, 50000)) / 100,
+                currency=rng.choice(['EUR', 'EUR', 'EUR', 'USD']),
+                note=f"Expense {i}",
+                invoice_issuer=f"Shop {i % 50}",
+                invoice_as_text='',
+            )
+            for i in range(EXPENSE_COUNT)
+        )
+        Expense.objects.bulk_create(
+            Expense(owner=cls.other_user, invoice_date_time=start, price=Decimal('1.00'), currency='EUR')
+            for _ in range(100)
+        )
+
+        ThroughModel = Expense.categories.through
+        ThroughModel.objects.bulk_create(
+            ThroughModel(expense_id=expense.pk, category_id=category.pk)
+            for expense in expenses
+            for category in rng.sample(cls.categories, rng.randint(1, 3))
+        )
+        rebuild_monthly_spend([cls.user.id, cls.other_user.id])
+
+        cls.expense = expenses[0]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        cache.clear()
+        # The id of the global user and the exchange rates are cached per process, budgets are about the steady state
+        get_global_user_id()
+        get_rate('USD', date.today())
+
+
+class ExpenseApiQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_list(self):
+        # The number of queries must not depend on the page size, only the number of rows may grow
+        for page_size, max_rows in ((10, 50), (100, 420)):
+            with self.subTest(page_size=page_size), \
+                    mock.patch.object(PageNumberPagination, 'page_size', page_size), \
+                    self.assertQueryBudget(max_queries=6, max_rows=max_rows):
+                response = self.client.get('/api/v1/expenses/?page=3')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_list_filtered(self):
+        query = 'date_from=2023-03-01&date_to=2023-03-31&currency=eur&price_min=10&category=1,2,3&pagination=cursor'
+        with self.assertQueryBudget(max_queries=5, max_rows=50):
+            response = self.client.get(f'/api/v1/expenses/?{query}')
+        self.assertEqual(response.status_code, 200)
+        for expense in response.json()['results']:
+            self.assertTrue(expense['invoice_date_time'].startswith('2023-03'))
+            self.assertEqual(expense['currency'], 'EUR')
+
+    def test_list_invalid_filter(self):
+        response = self.client.get('/api/v1/expenses/?price_min=20&price_max=10')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('price_max', response.json())
+
+    def test_list_cursor(self):
+        for page_size, max_rows in ((10, 50), (100, 420)):
+            with self.subTest(page_size=page_size), \
+                    mock.patch.object(ExpenseCursorPagination, 'page_size', page_size), \
+                    self.assertQueryBudget(max_queries=5, max_rows=max_rows):
+                response = self.client.get('/api/v1/expenses/?pagination=cursor')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_search(self):
+        with self.assertQueryBudget(max_queries=7, max_rows=10):
+            response = self.client.get('/api/v1/expenses/search/?q=expense 4999')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_search_many_matches(self):
+        # Every expense matches, but only the ids of the requested page are fetched
+        with self.assertQueryBudget(max_queries=7, max_rows=50):
+            response = self.client.get('/api/v1/expenses/search/?q=shop&page=3')
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual(page['count'], EXPENSE_COUNT)
+        self.assertEqual(len(page['results']), 10)
+        self.assertTrue(all(expense['invoice_issuer'].startswith('Shop') for expense in page['results']))
+
+    def test_search_other_owner(self):
+        self.client.force_login(self.other_user)
+        response = self.client.get('/api/v1/expenses/search/?q=shop')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 0)
+
+        # The owner is indexed as well, but search terms only match the text of the expenses
+        response = self.client.get(f'/api/v1/expenses/search/?q={self.other_user.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_table(self):
+        url = ('/api/v1/expenses/table/?draw=3&start=20&length=10&columns[0][data]=invoice_date_time'
+               '&columns[1][data]=price&order[0][column]=1&order[0][dir]=desc&search[value]=shop 7')
+        with self.assertQueryBudget(max_queries=7, max_rows=50):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual(page['draw'], 3)
+        self.assertEqual(page['recordsTotal'], EXPENSE_COUNT)
+        # Terms match as prefixes, "7" finds the issuer "Shop 7" as well as the notes "Expense 7", "Expense 70", ...
+        matching = [i for i in range(EXPENSE_COUNT) if i % 50 == 7 or str(i).startswith('7')]
+        self.assertEqual(page['recordsFiltered'], len(matching))
+        self.assertEqual(len(page['data']), 10)
+        prices = [Decimal(expense['price']) for expense in page['data']]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+
+    def test_table_search_owner(self):
+        # The full-text match is restricted to the expenses of the user inside the index
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/expenses/table/?search[value]=shop')
+        self.assertEqual(response.json()['recordsFiltered'], EXPENSE_COUNT)
+        matches = [query['sql'] for query in queries.captured_queries if 'MATCH' in query['sql']]
+        self.assertTrue(matches)
+        self.assertTrue(all(f'owner_id : "{self.user.id}"' in sql for sql in matches))
+
+    def test_table_invalid_order(self):
+        response = self.client.get('/api/v1/expenses/table/?columns[0][data]=categories&order[0][column]=0')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('order', response.json())
+
+    def test_retrieve(self):
+        with self.assertQueryBudget(max_queries=5, max_rows=10):
+            response = self.client.get(f'/api/v1/expenses/{self.expense.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_create(self):
+        data = {
+            'invoice_date_time': '2024-05-01T12:00:00Z',
+            'price': '12.50',
+            'currency': 'EUR',
+            'note': '',
+            'categories': [{'name': 'Global 1'}, {'name': 'Own 1'}],
+            'invoice_issuer': 'Shop',
+            'invoice_as_text': '',
+        }
+        with self.assertQueryBudget(max_queries=25, max_rows=30):
+            response = self.client.post('/api/v1/expenses/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_update(self):
+        data = {
+            'invoice_date_time': '2024-05-01T12:00:00Z',
+            'price': '12.50',
+            'currency': 'EUR',
+            'note': '',
+            'categories': [{'name': 'Global 2'}, {'name': 'Own 2'}],
+            'invoice_issuer': 'Shop',
+            'invoice_as_text': '',
+        }
+        with self.assertQueryBudget(max_queries=45, max_rows=40):
+            response = self.client.put(f'/api/v1/expenses/{self.expense.id}/', data,
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_destroy(self):
+        with self.assertQueryBudget(max_queries=20, max_rows=20):
+            response = self.client.delete(f'/api/v1/expenses/{self.expense.id}/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_export(self):
+        # Streaming the whole history fetches every expense and category link once
+        with self.assertQueryBudget(max_queries=3 + 2 * -(-EXPENSE_COUNT // EXPORT_CHUNK_SIZE), max_rows=EXPENSE_COUNT * 4):
+            response = self.client.get('/api/v1/expenses/export/?export_format=ndjson')
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), EXPENSE_COUNT)
+
+
+class CategoryApiQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_list(self):
+        # The first request loads the whole catalogue of the user, the following ones are served from the cache
+        with self.assertQueryBudget(max_queries=6, max_rows=CATEGORY_COUNT + 5):
+            response = self.client.get('/api/v1/categories/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], CATEGORY_COUNT)
+
+        with self.assertQueryBudget(max_queries=3, max_rows=3):
+            response = self.client.get('/api/v1/categories/?page=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_list_invalidated(self):
+        self.client.get('/api/v1/categories/')
+        for count, owner in enumerate((self.user, self.global_user), CATEGORY_COUNT + 1):
+            with self.subTest(owner=owner.username):
+                with self.captureOnCommitCallbacks(execute=True):
+                    Category.objects.create(name=f"New {owner.username}", owner=owner)
+                self.assertEqual(self.client.get('/api/v1/categories/').json()['count'], count)
+
+
+class MonthlyExpensesApiQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_list(self):
+        # Every month of the page lists the names of all its categories. The fixture spends two currencies every
+        # month, so the totals per currency and the currency of the user are loaded for the conversion.
+        for page_size, max_rows in ((10, 10 * (CATEGORY_COUNT + 2) + 20),
+                                    (100, MONTH_COUNT * (CATEGORY_COUNT + 2) + 40)):
+            with self.subTest(page_size=page_size), \
+                    mock.patch.object(PageNumberPagination, 'page_size', page_size), \
+                    self.assertQueryBudget(max_queries=9, max_rows=max_rows):
+                response = self.client.get('/api/v1/monthlyExpenses/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), min(page_size, MONTH_COUNT))
+
+
+class ExchangeRateTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        invalidate_exchange_rates()
+
+    def test_read_ecb_file(self):
+        file = io.StringIO("Date,USD,JPY,XYZ,\n2024-01-03,1.0919,155.45,N/A,\n2024-01-02,1.0956,155.73,,\n")
+        rates = list(read_exchange_rates(file))
+        self.assertIn(('USD', date(2024, 1, 3), Decimal('1.0919')), rates)
+        self.assertEqual(len(rates), 4)
+
+    def test_read_invalid_file(self):
+        with self.assertRaises(RatesFileError):
+            list(read_exchange_rates(io.StringIO("date,currency,rate\n2024-01-03,USD,-1\n")))
+
+    def test_monthly_totals_converted(self):
+        store_exchange_rates([('USD', date(2020, 1, 1), Decimal('2'))])
+        response = self.client.get('/api/v1/monthlyExpenses/')
+        self.assertEqual(response.status_code, 200)
+
+        month = response.json()['results'][0]
+        totals = dict(MonthlySpend.objects.filter(owner=self.user, category__isnull=True, month=date(2024, 12, 1))
+                      .values_list('currency', 'total'))
+        self.assertEqual(month['currency'], 'EUR')
+        expected = totals['EUR'] + (totals['USD'] / 2).quantize(Decimal('0.01'))
+        self.assertEqual(Decimal(str(month['total_spent'])), expected)
+        self.assertNotIn('unconverted', month)
+
+    def test_rates_stored_by_other_process(self):
+        store_exchange_rates([('USD', date(2020, 1, 1), Decimal('2'))])
+        first = self.client.get('/api/v1/monthlyExpenses/')
+
+        # Another process only invalidates its own cache, the new version tells this one to reload the rates
+        with mock.patch('billova_app.exchange.invalidate_exchange_rates'):
+            store_exchange_rates([('USD', date(2020, 1, 1), Decimal('4'))])
+        second = self.client.get('/api/v1/monthlyExpenses/')
+
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        totals = dict(MonthlySpend.objects.filter(owner=self.user, category__isnull=True, month=date(2024, 12, 1))
+                      .values_list('currency', 'total'))
+        expected = totals['EUR'] + (totals['USD'] / 4).quantize(Decimal('0.01'))
+        self.assertEqual(Decimal(str(second.json()['results'][0]['total_spent'])), expected)
+
+    def test_monthly_totals_without_rate(self):
+        month = self.client.get('/api/v1/monthlyExpenses/').json()['results'][0]
+        self.assertIn('USD', month['unconverted'])
+
+
+class AnalyticsApiQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_list(self):
+        # One grouped query per breakdown: the rows are bounded by the groups times the two currencies of the
+        # fixture, not by the number of expenses
+        max_rows = 2 * (1 + CATEGORY_COUNT + 50 + 7 * 24) + 10
+        with self.assertQueryBudget(max_queries=9, max_rows=max_rows):
+            response = self.client.get('/api/v1/analytics/', {'top': 5})
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(data['total']['count'], EXPENSE_COUNT)
+        self.assertEqual(len(data['top_issuers']), 5)
+        self.assertEqual(data['other_issuers']['issuers'], 45)
+        self.assertEqual(sum(issuer['count'] for issuer in data['top_issuers']) + data['other_issuers']['count'],
+                         EXPENSE_COUNT)
+        self.assertEqual(sum(weekday['count'] for weekday in data['by_weekday']), EXPENSE_COUNT)
+        self.assertEqual(sum(hour['count'] for hour in data['by_hour']), EXPENSE_COUNT)
+        self.assertEqual(len(data['by_category']), CATEGORY_COUNT)
+
+    def test_list_period(self):
+        response = self.client.get('/api/v1/analytics/', {'date_from': '2024-01-01', 'date_to': '2024-01-31'})
+        self.assertEqual(response.status_code, 200)
+        expected = Expense.objects.filter(owner=self.user, invoice_date_time__date__range=(date(2024, 1, 1),
+                                                                                        date(2024, 1, 31))).count()
+        self.assertEqual(response.json()['total']['count'], expected)
+
+    def test_list_invalid_top(self):
+        response = self.client.get('/api/v1/analytics/', {'top': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class AccountViewQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_account_overview(self):
+        with self.assertQueryBudget(max_queries=5, max_rows=25):
+            response = self.client.get(reverse('account_overview'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_account_settings(self):
+        with self.assertQueryBudget(max_queries=3, max_rows=5):
+            response = self.client.get(reverse('account_settings'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_account_settings_choices_memoized(self):
+        # The localized currency names are computed when the models are loaded, not per request
+        with mock.patch('billova_app.utils.settings_utils.get_currency_name') as get_currency_name:
+            for language in ('en', 'de', 'en'):
+                UserSettings.objects.filter(owner=self.user).update(language=language)
+                response = self.client.get(reverse('account_settings'))
+                self.assertEqual(response.status_code, 200)
+        get_currency_name.assert_not_called()
+        self.assertIn(('EUR', 'Euro'), response.context['currency_choices'])
+
+    def test_account_settings_language_name(self):
+        # Older settings store the name of the language, it is mapped to its code before the cached lookup
+        expected = [('English', 'en', 'US Dollar'), ('German', 'de', 'US-Dollar'), ('Klingon', 'en', 'US Dollar')]
+        with mock.patch('billova_app.utils.settings_utils.get_currency_name') as get_currency_name:
+            for stored, code, dollar in expected:
+                with self.subTest(language=stored):
+                    UserSettings.objects.filter(owner=self.user).update(language=stored)
+                    response = self.client.get(reverse('account_settings'))
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.context['current_settings']['language'], code)
+                    self.assertIn(('USD', dollar), response.context['currency_choices'])
+        get_currency_name.assert_not_called()
+
+    def test_expenses_overview(self):
+        with self.assertQueryBudget(max_queries=3, max_rows=5):
+            response = self.client.get(reverse('expensesOverview'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTests(QueryBudgetTestCase):
+
+    def test_not_modified(self):
+        for url in ('/api/v1/expenses/', f'/api/v1/expenses/{self.expense.id}/', '/api/v1/categories/',
+                    '/api/v1/monthlyExpenses/', '/api/v1/expenses/table/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('no-cache', response['Cache-Control'])
+                self.assertTrue(response.has_header('Last-Modified'))
+
+                # Only the session, the user and the data versions are loaded
+                with self.assertQueryBudget(max_queries=3, max_rows=3):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes(self):
+        etag = self.client.get('/api/v1/categories/')['ETag']
+        self.client.patch(f'/api/v1/expenses/{self.expense.id}/', {'note': 'Changed'}, content_type='application/json')
+        changed_etag = self.client.get('/api/v1/categories/', HTTP_IF_NONE_MATCH=etag)['ETag']
+        self.assertNotEqual(changed_etag, etag)
+
+        # Global categories are part of the responses of every user
+        Category.objects.create(name='Global new', owner=self.global_user)
+        response = self.client.get('/api/v1/categories/', HTTP_IF_NONE_MATCH=changed_etag)
+        self.assertEqual(response.status_code, 200)
+
+        # Changes of other users do not invalidate the responses
+        etag = response['ETag']
+        Category.objects.create(name='Other', owner=self.other_user)
+        response = self.client.get('/api/v1/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class MonthlySpendRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='rollup', password='rollup')
+        cls.food = Category.objects.create(name='Food', owner=cls.user)
+        cls.travel = Category.objects.create(name='Travel', owner=cls.user)
+
+    def _spend(self):
+        return {
+            (spend.month, spend.currency, spend.category_id): (spend.total, spend.expense_count)
+            for spend in MonthlySpend.objects.filter(owner=self.user)
+        }
+
+    def _create_expense(self, price, day=date(2024, 1, 15), currency='EUR'):
+        return Expense.objects.create(owner=self.user, price=Decimal(price), currency=currency,
+                                      invoice_date_time=timezone.make_aware(datetime.combine(day, datetime.min.time())))
+
+    def test_expense_changes(self):
+        january, february = date(2024, 1, 1), date(2024, 2, 1)
+        expense = self._create_expense('10.00')
+        self._create_expense('2.50', currency='USD')
+        self.assertEqual(self._spend(), {
+            (january, 'EUR', None): (Decimal('10.00'), 1),
+            (january, 'USD', None): (Decimal('2.50'), 1),
+        })
+
+        expense.categories.add(self.food, self.travel)
+        self.assertEqual(self._spend()[january, 'EUR', self.food.id], (Decimal('10.00'), 1))
+        self.assertEqual(self._spend()[january, 'EUR', self.travel.id], (Decimal('10.00'), 1))
+
+        expense.price = Decimal('15.00')
+        expense.save()
+        self.assertEqual(self._spend()[january, 'EUR', None], (Decimal('15.00'), 1))
+        self.assertEqual(self._spend()[january, 'EUR', self.food.id], (Decimal('15.00'), 1))
+
+        expense.invoice_date_time = timezone.make_aware(datetime(2024, 2, 10, 12))
+        expense.save()
+        spend = self._spend()
+        self.assertNotIn((january, 'EUR', None), spend)
+        self.assertNotIn((january, 'EUR', self.food.id), spend)
+        self.assertEqual(spend[february, 'EUR', None], (Decimal('15.00'), 1))
+        self.assertEqual(spend[february, 'EUR', self.travel.id], (Decimal('15.00'), 1))
+
+        expense.delete()
+        self.assertEqual(self._spend(), {(january, 'USD', None): (Decimal('2.50'), 1)})
+
+    def test_category_links(self):
+        january = date(2024, 1, 1)
+        first, second = self._create_expense('10.00'), self._create_expense('4.00')
+        first.categories.add(self.food, self.travel)
+        # From the other side of the relation
+        self.food.expenses.add(second)
+        self.assertEqual(self._spend()[january, 'EUR', self.food.id], (Decimal('14.00'), 2))
+
+        first.categories.remove(self.food)
+        self.assertEqual(self._spend()[january, 'EUR', self.food.id], (Decimal('4.00'), 1))
+        # Removing a link which does not exist changes nothing
+        first.categories.remove(self.food)
+        self.assertEqual(self._spend()[january, 'EUR', self.food.id], (Decimal('4.00'), 1))
+
+        first.categories.clear()
+        self.food.expenses.clear()
+        self.assertEqual(self._spend(), {(january, 'EUR', None): (Decimal('14.00'), 2)})
+
+    def test_user_queryset_delete(self):
+        # Deleting users cascades to their rollup rows, the expenses are not subtracted one by one
+        query_counts = []
+        for expense_count in (2, 20):
+            user = User.objects.create_user(username=f"cascade {expense_count}")
+            category = Category.objects.create(name='Cascade', owner=user)
+            for _ in range(expense_count):
+                Expense.objects.create(owner=user, price=Decimal('1.00')).categories.add(category)
+            with CaptureQueriesContext(connection) as queries:
+                User.objects.filter(id=user.id).delete()
+            query_counts.append(len(queries))
+            self.assertFalse(MonthlySpend.objects.filter(owner_id=user.id).exists())
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class SqlTimingMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(username='global')
+        cls.user = User.objects.create_user(username='timing', password='timing')
+        Expense.objects.bulk_create(Expense(owner=cls.user, price=Decimal('1.00')) for _ in range(3))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE name = 'O''Brien' AND id IN (%s, %s, %s)\n  AND price > 12.5"),
+            "SELECT * FROM t WHERE name = ? AND id IN (...) AND price > ?")
+        self.assertEqual(normalize_sql('SAVEPOINT "s140_x12"'), normalize_sql('SAVEPOINT "s7_x3"'))
+
+    @override_settings(BILLOVA_SERVER_TIMING=True)
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/expenses/')
+        metrics = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(metrics, ['db', 'serializer', 'view', 'total'])
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+
+    @override_settings(BILLOVA_SERVER_TIMING=False)
+    def test_server_timing_disabled(self):
+        self.assertFalse(self.client.get('/api/v1/expenses/').has_header('Server-Timing'))
+
+    @override_settings(BILLOVA_SLOW_REQUEST_MS=0, BILLOVA_SLOW_QUERY_MS=60000)
+    def test_slow_request_logged(self):
+        # Only the slowest statements are listed, all of them here so the order of their durations does not matter
+        with mock.patch('billova_app.middleware.SLOW_REQUEST_TOP_QUERIES', 100), \
+                self.assertLogs('billova_app.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/v1/expenses/')
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Slow request GET /api/v1/expenses/ (200)', logs.output[0])
+        # Statements are listed normalized, with their number of executions
+        self.assertIn('1x', logs.output[0])
+        self.assertIn('WHERE "billova_app_expense"."owner_id" = %s ORDER BY', logs.output[0])
+
+    @override_settings(BILLOVA_SLOW_REQUEST_MS=60000, BILLOVA_SLOW_QUERY_MS=0)
+    def test_slow_query_logged(self):
+        with self.assertLogs('billova_app.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/v1/expenses/')
+        self.assertTrue(all('Slow query' in line for line in logs.output))
+        self.assertTrue(any('FROM "billova_app_expense"' in line for line in logs.output))
+
+    @override_settings(BILLOVA_SERVER_TIMING=True, BILLOVA_SLOW_REQUEST_MS=0)
+    def test_streaming_response(self):
+        with self.assertLogs('billova_app.slow_requests', 'WARNING') as logs:
+            response = self.client.get('/api/v1/expenses/export/')
+            self.assertEqual(logs.output, [])
+            content = b''.join(response.streaming_content)
+        self.assertEqual(len(content.splitlines()), 4)
+        self.assertFalse(response.has_header('Server-Timing'))
+        # Logged once the content was sent, including the queries of the export
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('ORDER BY "billova_app_expense"."invoice_date_time" ASC', logs.output[0])
+
+
+class GlobalResolverTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.global_user = User.objects.create(username='global')
+        cls.food = Category.objects.create(name='Food', owner=cls.global_user)
+        cls.user = User.objects.create_user(username='resolver')
+
+    def setUp(self):
+        invalidate_global_user()
+
+    def test_cached(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(get_global_user(), self.global_user)
+            self.assertEqual(list(get_global_categories()), ['Food'])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_global_user_id(), self.global_user.id)
+            self.assertEqual(list(get_global_categories()), ['Food'])
+
+    def test_category_changes_invalidate(self):
+        get_global_categories()
+        Category.objects.create(name='Travel', owner=self.global_user)
+        self.assertEqual(set(get_global_categories()), {'Food', 'Travel'})
+
+        self.food.name = 'Groceries'
+        self.food.save()
+        self.assertEqual(set(get_global_categories()), {'Groceries', 'Travel'})
+
+        self.food.delete()
+        self.assertEqual(set(get_global_categories()), {'Travel'})
+
+        # Categories of other users keep the cache
+        Category.objects.create(name='Own', owner=self.user)
+        with self.assertNumQueries(0):
+            get_global_categories()
+
+    def test_user_changes_invalidate(self):
+        get_global_categories()
+        self.global_user.first_name = 'Shared'
+        self.global_user.save()
+        with self.assertNumQueries(2):
+            self.assertEqual(get_global_user().first_name, 'Shared')
+            get_global_categories()
+
+        self.global_user.delete()
+        with self.assertRaises(User.DoesNotExist):
+            get_global_user()
+
+    @override_settings(BILLOVA_GLOBAL_CACHE_TTL=60)
+    def test_expires(self):
+        with mock.patch('billova_app.utils.global_resolver.time') as clock:
+            clock.monotonic.return_value = 1000
+            get_global_categories()
+            clock.monotonic.return_value = 1060
+            with self.assertNumQueries(0):
+                get_global_categories()
+            clock.monotonic.return_value = 1061
+            with self.assertNumQueries(2):
+                get_global_categories()
+
+
+class ExpenseCategoriesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.global_user = User.objects.create(username='global')
+        cls.travel = Category.objects.create(name='Travel', owner=cls.global_user)
+        cls.user = User.objects.create_user(username='categories', password='categories')
+        cls.food = Category.objects.create(name='Food', owner=cls.user)
+        cls.rent = Category.objects.create(name='Rent', owner=cls.user)
+        Category.objects.create(name='Secret', owner=User.objects.create_user(username='categories other'))
+
+    def setUp(self):
+        invalidate_global_user()
+        self.client.force_login(self.user)
+
+    def _save(self, names, expense=None):
+        data = {'invoice_date_time': '2024-01-15T10:00:00Z', 'price': '10.00', 'currency': 'EUR', 'note': '',
+                'invoice_issuer': 'Shop', 'invoice_as_text': '', 'categories': [{'name': name} for name in names]}
+        if expense is None:
+            return self.client.post('/api/v1/expenses/', data, content_type='application/json')
+        return self.client.put(f'/api/v1/expenses/{expense.id}/', data, content_type='application/json')
+
+    def _links(self, expense):
+        return dict(Expense.categories.through.objects.filter(expense=expense).values_list('category_id', 'id'))
+
+    def test_create(self):
+        response = self._save(['Food', 'Travel'])
+        self.assertEqual(response.status_code, 201)
+        expense = Expense.objects.get(id=response.json()['id'])
+        self.assertEqual(set(expense.categories.all()), {self.food, self.travel})
+
+    def test_update_diffs_links(self):
+        expense = Expense.objects.get(id=self._save(['Food', 'Travel']).json()['id'])
+        links = self._links(expense)
+
+        response = self._save(['Travel', 'Rent'], expense)
+        self.assertEqual(response.status_code, 200)
+        new_links = self._links(expense)
+        self.assertEqual(set(new_links), {self.travel.id, self.rent.id})
+        # The unchanged link is kept, not deleted and added again
+        self.assertEqual(new_links[self.travel.id], links[self.travel.id])
+
+        self.assertEqual(self._save([], expense).status_code, 200)
+        self.assertEqual(self._links(expense), {})
+
+    def test_own_category_wins(self):
+        own_travel = Category.objects.create(name='Travel', owner=self.user)
+        expense = Expense.objects.get(id=self._save(['Travel']).json()['id'])
+        self.assertEqual(list(expense.categories.all()), [own_travel])
+
+    def test_unknown_category(self):
+        expense = Expense.objects.get(id=self._save(['Food']).json()['id'])
+        # Categories of other users are unknown too
+        for names in (['Food', 'Nope'], ['Secret']):
+            with self.subTest(names=names):
+                response = self._save(names, expense)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['categories'],
+                                 [f"Category '{name}' does not exist." for name in names if name != 'Food'])
+                self.assertEqual(set(self._links(expense)), {self.food.id})
+
+        response = self._save(['Nope'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Expense.objects.filter(owner=self.user).count(), 1)
+
+
+class ExpenseImportTests(TestCase):
+    url = '/api/v1/expenses/import/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.global_user = User.objects.create(username='global')
+        cls.user = User.objects.create_user(username='importer', password='importer')
+        cls.food = Category.objects.create(name='Food', owner=cls.user)
+        cls.travel = Category.objects.create(name='Travel', owner=cls.global_user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _import(self, name, content, **data):
+        return self.client.post(self.url, {'file': SimpleUploadedFile(name, content), **data})
+
+    def test_import_csv(self):
+        response = self._import('expenses.csv', (
+            "invoice_date_time,price,currency,invoice_issuer,categories\n"
+            "2024-01-15T10:00:00Z,12.50,EUR,Bakery,Food;Travel\n"
+            "2024-01-16T10:00:00Z,3.20,,Kiosk,\n"
+        ).encode())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 2, 'failed': 0, 'errors': []})
+
+        bakery = Expense.objects.get(owner=self.user, invoice_issuer='Bakery')
+        self.assertEqual(bakery.price, Decimal('12.50'))
+        self.assertEqual(set(bakery.categories.all()), {self.food, self.travel})
+        # The currency of the user settings is the default
+        self.assertEqual(Expense.objects.get(owner=self.user, invoice_issuer='Kiosk').currency, 'EUR')
+
+    def test_import_ndjson(self):
+        response = self._import('expenses.ndjson', (
+            '{"price": "7.00", "invoice_issuer": "Cafe", "categories": ["Food"]}\n'
+            '\n'
+            '{"price": \n'
+            '[1, 2]\n'
+        ).encode())
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual((report['created'], report['failed']), (1, 2))
+        self.assertEqual([error['row'] for error in report['errors']], [2, 3])
+        self.assertEqual(list(Expense.objects.get(owner=self.user).categories.all()), [self.food])
+
+    def test_row_errors(self):
+        response = self._import('expenses.csv', b"price,invoice_issuer\nabc,Shop\n,Shop\n", file_format='csv')
+        self.assertEqual(response.status_code, 400)
+        report = response.json()
+        self.assertEqual((report['created'], report['failed']), (0, 2))
+        self.assertEqual([(error['row'], list(error['errors'])) for error in report['errors']],
+                         [(1, ['price']), (2, ['price'])])
+        self.assertFalse(Expense.objects.filter(owner=self.user).exists())
+
+    def test_unknown_category(self):
+        response = self._import('expenses.csv', b"price,categories\n1.00,Food\n2.00,Food;Rent\n")
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual(report['errors'], [{'row': 2, 'errors': {'categories': ['Unknown category: Rent']}}])
+        self.assertEqual(Expense.objects.filter(owner=self.user).count(), 1)
+
+    def test_bad_encoding(self):
+        response = self._import('expenses.csv', "price,note\n1.00,Caf\xe9\n".encode('latin-1'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('UTF-8', response.json()['detail'])
+        self.assertFalse(Expense.objects.filter(owner=self.user).exists())
+
+    def test_unknown_format(self):
+        response = self._import('expenses.txt', b"price\n1.00\n")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file_format', response.json())
+
+    @override_settings(BILLOVA_IMPORT_BATCH_SIZE=2)
+    def test_batches(self):
+        content = "price,invoice_date_time\n" + "".join(f"{i}.00,2024-03-0{i}T12:00:00Z\n" for i in range(1, 6))
+        with CaptureQueriesContext(connection) as queries:
+            response = self._import('expenses.csv', content.encode())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 5)
+        # Five rows in batches of two
+        inserts = [query for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "billova_app_expense" ')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Expense.objects.filter(owner=self.user).count(), 5)
+
+    def test_rollup_and_version_updated(self):
+        version = DataVersion.objects.get(owner=self.user).version
+        self._import('expenses.csv', (
+            "invoice_date_time,price,currency,categories\n"
+            "2024-01-15T10:00:00Z,10.00,EUR,Food\n"
+            "2024-01-20T10:00:00Z,5.00,EUR,\n"
+            "2024-02-15T10:00:00Z,2.00,USD,Food\n"
+        ).encode())
+        spend = {
+            (spend.month, spend.currency, spend.category_id): (spend.total, spend.expense_count)
+            for spend in MonthlySpend.objects.filter(owner=self.user)
+        }
+        self.assertEqual(spend, {
+            (date(2024, 1, 1), 'EUR', None): (Decimal('15.00'), 2),
+            (date(2024, 1, 1), 'EUR', self.food.id): (Decimal('10.00'), 1),
+            (date(2024, 2, 1), 'USD', None): (Decimal('2.00'), 1),
+            (date(2024, 2, 1), 'USD', self.food.id): (Decimal('2.00'), 1),
+        })
+        # bulk_create bypasses the signals, the importer bumps the version once per batch
+        self.assertEqual(DataVersion.objects.get(owner=self.user).version, version + 1)
+
+
+def make_image(size=(40, 60), color=(200, 120, 40), image_format='PNG', exif=None):
+    output = io.BytesIO()
+    image = Image.new('RGB', size, color)
+    image.save(output, image_format, **({'exif': exif} if exif else {}))
+    return output.getvalue()
+
+
+# Extraction returned by the mocked OCR provider
+VERYFI_RESPONSE = {
+    'date': '2024-03-01 12:30:00',
+    'total': 12.5,
+    'vendor': {'name': 'Bakery'},
+    'ocr_text': 'BAKERY 12.50',
+}
+
+
+class OcrTestCase(TestCase):
+    """
+    Base class of the OCR tests: processes jobs in the request thread, stores uploads in a temporary directory and
+    replaces the OCR provider by a mock, `self.ocr_client`.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.global_user = User.objects.create(username='global')
+        cls.generated = Category.objects.create(name='Generated', owner=cls.global_user)
+        cls.user = User.objects.create_user(username='ocr', password='ocr')
+        cls.other_user = User.objects.create_user(username='ocr other', password='ocr other')
+
+    def setUp(self):
+        # Categories cached by a previous test may have been rolled back
+        invalidate_global_categories()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(BILLOVA_OCR_EAGER=True, MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        client_patcher = mock.patch('billova_app.ocr.receipt.get_veryfi_client')
+        self.ocr_client = client_patcher.start().return_value
+        self.addCleanup(client_patcher.stop)
+        self.ocr_client.process_document.return_value = VERYFI_RESPONSE
+        self.client.force_login(self.user)
+
+    def upload(self, name='receipt.png', content=None):
+        return SimpleUploadedFile(name, content or make_image(), content_type='image/png')
+
+
+class OcrJobTests(OcrTestCase):
+
+    def _post_receipt(self, content=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/v1/expenses/ocr/', {'image': self.upload(content=content)})
+
+    def test_upload_accepted(self):
+        response = self._post_receipt()
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        # The job is answered before it is processed
+        self.assertEqual(data['status'], OcrJob.STATUS_PENDING)
+        self.assertTrue(response['Location'].endswith(f"/api/v1/ocrJobs/{data['id']}/"))
+
+        job = OcrJob.objects.get(id=data['id'])
+        self.assertEqual(job.status, OcrJob.STATUS_DONE)
+        self.assertEqual((job.expense.owner, job.expense.price, job.expense.invoice_issuer),
+                         (self.user, Decimal('12.50'), 'Bakery'))
+        self.assertEqual([category.name for category in job.expense.categories.all()], ['Generated'])
+        # The uploaded image is removed once the job is finished
+        self.assertFalse(job.image)
+
+    def test_status_and_result(self):
+        job_id = self._post_receipt().json()['id']
+        response = self.client.get(f'/api/v1/ocrJobs/{job_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], OcrJob.STATUS_DONE)
+
+        response = self.client.get(f'/api/v1/ocrJobs/{job_id}/result/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['invoice_issuer'], 'Bakery')
+
+    def test_pending_result(self):
+        # Without running the on commit callbacks the job is never processed
+        job_id = self.client.post('/api/v1/expenses/ocr/', {'image': self.upload()}).json()['id']
+        response = self.client.get(f'/api/v1/ocrJobs/{job_id}/result/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], OcrJob.STATUS_PENDING)
+
+    def test_failed_job(self):
+        self.ocr_client.process_document.return_value = {'vendor': {'name': 'Bakery'}}
+        job_id = self._post_receipt().json()['id']
+
+        job = OcrJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.error), (OcrJob.STATUS_FAILED, 'Price not found in receipt.'))
+        self.assertIsNone(job.expense)
+        response = self.client.get(f'/api/v1/ocrJobs/{job_id}/result/')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['error'], 'Price not found in receipt.')
+        self.assertFalse(Expense.objects.filter(owner=self.user).exists())
+
+    def test_job_of_other_user(self):
+        job_id = self._post_receipt().json()['id']
+        self.client.force_login(self.other_user)
+        self.assertEqual(self.client.get(f'/api/v1/ocrJobs/{job_id}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/ocrJobs/').json()['count'], 0)
+
+    def test_invalid_upload(self):
+        response = self.client.post('/api/v1/expenses/ocr/', {'image': self.upload(content=b'not an image')})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OcrJob.objects.exists())
+
+
+class OcrBatchTests(OcrTestCase):
+    url = '/api/v1/expenses/ocr/batch/'
+
+    def _post_receipts(self, count):
+        # Different images, so the OCR cache does not answer for the provider
+        images = [self.upload(f"receipt{i}.png", make_image(color=(i * 40, 0, 0))) for i in range(count)]
+        return self.client.post(self.url, {'images': images})
+
+    def test_results_per_image(self):
+        self.ocr_client.process_document.side_effect = [VERYFI_RESPONSE, {**VERYFI_RESPONSE, 'total': 3}]
+        response = self._post_receipts(2)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (2, 0))
+        self.assertEqual([(result['image'], result['status'], result['expense']['price'])
+                          for result in data['results']],
+                         [('receipt0.png', 'created', '12.50'), ('receipt1.png', 'created', '3.00')])
+        self.assertEqual(Expense.objects.filter(owner=self.user).count(), 2)
+
+    def test_partial_failure(self):
+        self.ocr_client.process_document.side_effect = [VERYFI_RESPONSE, {'vendor': {'name': 'Kiosk'}},
+                                                        VERYFI_RESPONSE]
+        response = self._post_receipts(3)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (2, 1))
+        self.assertEqual([result['status'] for result in data['results']], ['created', 'failed', 'created'])
+        self.assertEqual(data['results'][1]['error'], 'Price not found in receipt.')
+        self.assertEqual(Expense.objects.filter(owner=self.user).count(), 2)
+
+    def test_all_failed(self):
+        self.ocr_client.process_document.side_effect = OcrProviderError("The OCR provider answered 503")
+        response = self._post_receipts(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['failed'], 2)
+
+    def test_single_transaction(self):
+        # A failure while storing the expenses rolls back the ones created before
+        calls = []
+
+        def create_expense(owner, receipt):
+            calls.append(receipt)
+            if len(calls) == 2:
+                raise DatabaseError("disk full")
+            return create_expense_from_receipt(owner, receipt)
+
+        with mock.patch('billova_app.api_views.create_expense_from_receipt', side_effect=create_expense):
+            response = self._post_receipts(2)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(Expense.objects.filter(owner=self.user).exists())
+
+    def _analyze_in_pool(self, blocked_image_count):
+        # Analyzes the images in the worker pool without the provider: the first images are left waiting until the
+        # test ends, the others give a receipt
+        release = threading.Event()
+        started = []
+
+        def analyze(image):
+            started.append(image)
+            if len(started) <= blocked_image_count:
+                release.wait(5)
+                return OcrProviderError("released")
+            return SimpleNamespace(invoice_date_time=timezone.now(), price=Decimal('12.50'), invoice_issuer='Shop',
+                                   invoice_as_text='')
+
+        patcher = mock.patch('billova_app.ocr.jobs._analyze_receipt', side_effect=analyze)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # A batch pool of the size set by the test
+        executor_patcher = mock.patch('billova_app.ocr.jobs._batch_executor', None)
+        executor_patcher.start()
+        self.addCleanup(executor_patcher.stop)
+        self.addCleanup(lambda: get_batch_executor().shutdown(cancel_futures=True))
+        self.addCleanup(release.set)
+        return release
+
+    @override_settings(BILLOVA_OCR_EAGER=False, BILLOVA_OCR_BATCH_WORKERS=2)
+    def test_not_blocked_by_jobs(self):
+        # A backlog of queued jobs occupies every job worker, the batch has workers of its own
+        release = self._analyze_in_pool(0)
+        for _ in range(settings.BILLOVA_OCR_WORKERS * 2):
+            get_executor().submit(release.wait, 5)
+        start = time.monotonic()
+        response = self._post_receipts(2)
+        self.assertLess(time.monotonic() - start, 2.5)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2)
+
+    @override_settings(BILLOVA_OCR_EAGER=False, BILLOVA_OCR_BATCH_WORKERS=1, BILLOVA_OCR_BATCH_TIMEOUT=0.2)
+    def test_timeout(self):
+        self._analyze_in_pool(1)
+        response = self._post_receipts(2)
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual([result['error'] for result in response.json()['results']],
+                         ["OCR processing timed out after 0.2 seconds."] * 2)
+        self.assertFalse(Expense.objects.filter(owner=self.user).exists())
+
+    def test_invalid_upload(self):
+        response = self.client.post(self.url, {'images': [self.upload(content=b'not an image')]})
+        self.assertEqual(response.status_code, 400)
+        self.ocr_client.process_document.assert_not_called()
+
+
+class OcrCacheTests(OcrTestCase):
+
+    def _extraction(self, price='12.50'):
+        return SimpleNamespace(invoice_date_time=timezone.now(), price=Decimal(price), invoice_issuer='Bakery',
+                               invoice_as_text='')
+
+    def test_hash_image(self):
+        image = io.BytesIO(make_image())
+        image.seek(5)
+        self.assertEqual(hash_image(image), hashlib.sha256(image.getvalue()).hexdigest())
+        # The image is rewound for the upload
+        self.assertEqual(image.tell(), 0)
+
+    def test_hit_and_miss(self):
+        cache = OcrResultCache(ttl=timedelta(days=1), max_entries=10)
+        self.assertIsNone(cache.get('a' * 64))
+        cache.set('a' * 64, self._extraction())
+        self.assertEqual(cache.get('a' * 64).price, Decimal('12.50'))
+        self.assertIsNone(cache.get('b' * 64))
+
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3, 'entries': 1})
+        self.assertEqual(OcrCacheEntry.objects.get(image_hash='a' * 64).hits, 1)
+
+    def test_expired(self):
+        cache = OcrResultCache(ttl=timedelta(hours=1), max_entries=10)
+        cache.set('a' * 64, self._extraction())
+        OcrCacheEntry.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertIsNone(cache.get('a' * 64))
+
+        # Expired entries are removed when the next extraction is stored
+        cache.set('b' * 64, self._extraction())
+        self.assertEqual(list(OcrCacheEntry.objects.values_list('image_hash', flat=True)), ['b' * 64])
+
+    def test_least_recently_used_evicted(self):
+        cache = OcrResultCache(ttl=timedelta(days=1), max_entries=2)
+        cache.set('a' * 64, self._extraction())
+        cache.set('b' * 64, self._extraction())
+        OcrCacheEntry.objects.update(last_used_at=timezone.now() - timedelta(minutes=1))
+        cache.get('a' * 64)
+
+        cache.set('c' * 64, self._extraction())
+        self.assertEqual(set(OcrCacheEntry.objects.values_list('image_hash', flat=True)), {'a' * 64, 'c' * 64})
+
+    def test_same_image_analyzed_once(self):
+        image = make_image()
+        for _ in range(2):
+            receipt = Receipt(image)
+            receipt.analyze()
+            self.assertEqual(receipt.invoice_issuer, 'Bakery')
+        self.ocr_client.process_document.assert_called_once()
+
+        Receipt(make_image(color=(0, 0, 0))).analyze()
+        self.assertEqual(self.ocr_client.process_document.call_count, 2)
+
+
+class ReceiptPreprocessTests(OcrTestCase):
+    STAGES = {'decode', 'orient', 'grayscale', 'resize', 'encode'}
+
+    def _preprocess(self, content, **kwargs):
+        output, timings = preprocess_receipt(io.BytesIO(content), **kwargs)
+        with output:
+            return Image.open(io.BytesIO(output.read())), timings
+
+    def test_grayscale_jpeg(self):
+        image, timings = self._preprocess(make_image())
+        self.assertEqual((image.format, image.mode, image.size), ('JPEG', 'L', (40, 60)))
+        self.assertEqual(set(timings), self.STAGES)
+
+    def test_exif_orientation(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated by 90 degrees
+        self.assertEqual(self._preprocess(make_image(image_format='JPEG', exif=exif))[0].size, (60, 40))
+
+    def test_downsampled(self):
+        for image_format in ('PNG', 'JPEG'):
+            with self.subTest(image_format=image_format):
+                image = self._preprocess(make_image((3000, 1500), image_format=image_format), max_dimension=500)[0]
+                self.assertEqual(image.size, (500, 250))
+
+    @override_settings(BILLOVA_OCR_MAX_DIMENSION=100)
+    def test_downsampled_to_setting(self):
+        self.assertEqual(self._preprocess(make_image((400, 200)))[0].size, (100, 50))
+        # Small images are not enlarged
+        self.assertEqual(self._preprocess(make_image((40, 60)))[0].size, (40, 60))
+
+    def _uploaded_content(self, content):
+        uploaded = []
+        self.ocr_client.process_document.side_effect = \
+            lambda name, file, content_type: uploaded.append(file.read()) or VERYFI_RESPONSE
+        receipt = Receipt(content)
+        receipt.analyze()
+        return receipt, uploaded[0]
+
+    def test_receipt_uploads_preprocessed_image(self):
+        content = make_image((3000, 2000), image_format='PNG')
+        receipt, uploaded = self._uploaded_content(content)
+        self.assertEqual(Image.open(io.BytesIO(uploaded)).format, 'JPEG')
+        self.assertLess(len(uploaded), len(content))
+        self.assertEqual(set(receipt.timings), self.STAGES | {'upload'})
+
+    def test_undecodable_image_uploaded_unchanged(self):
+        content = b'%PDF-1.4 not an image'
+        receipt, uploaded = self._uploaded_content(content)
+        self.assertEqual(uploaded, content)
+        self.assertEqual(set(receipt.timings), {'upload'})
+        self.assertEqual(receipt.price, 12.5)
+
+
+class StubOcrHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests of the OCR client with the scripted answers of the server, one per request:
+    (status, headers, body, delay in seconds). `body` None sends a broken chunked body.
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        status_code, headers, body, delay = self.server.answers.pop(0)
+        self.server.requests += 1
+        time.sleep(delay)
+        try:
+            self._answer(status_code, headers, body)
+        except ConnectionError:
+            # The client gave up waiting
+            pass
+
+    def _answer(self, status_code, headers, body):
+        self.send_response(status_code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if body is None:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(b'zz\r\nbroken')
+            return
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class VeryfiClientTests(SimpleTestCase):
+    OK = (200, {'Content-Type': 'application/json'}, b'{"total": 12.5}', 0)
+    UNAVAILABLE = (503, {}, b'', 0)
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubOcrHandler)
+        self.server.answers = []
+        self.server.requests = 0
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.now = 0.0
+        self.sleeps = []
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: self.now)
+        self.ocr_client = VeryfiClient(f"http://127.0.0.1:{self.server.server_port}/", read_timeout=0.2,
+                                       max_retries=2, breaker=self.breaker, sleep=self.sleeps.append)
+        self.addCleanup(self.ocr_client.session.close)
+
+    def _process(self):
+        return self.ocr_client.process_document('receipt.jpg', io.BytesIO(b'image'), 'image/jpeg')
+
+    def test_retry_on_server_error(self):
+        self.server.answers = [self.UNAVAILABLE, (502, {}, b'', 0), self.OK]
+        self.assertEqual(self._process(), {'total': 12.5})
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_internal_server_error_not_retried(self):
+        # The provider may have created the document before failing
+        self.server.answers = [(500, {}, b'', 0), self.OK]
+        with self.assertRaisesMessage(OcrProviderError, 'rejected the document: 500'):
+            self._process()
+        self.assertEqual(self.server.requests, 1)
+
+    def test_retry_on_refused_connection(self):
+        # A port nothing listens on, the upload never reaches a provider
+        with socket.socket() as unused:
+            unused.bind(('127.0.0.1', 0))
+            port = unused.getsockname()[1]
+        self.ocr_client.url = f"http://127.0.0.1:{port}/"
+        with self.assertRaisesMessage(OcrProviderError, 'not reachable'):
+            self._process()
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_retry_after_on_too_many_requests(self):
+        self.server.answers = [(429, {'Retry-After': '3'}, b'', 0), self.OK]
+        self.assertEqual(self._process(), {'total': 12.5})
+        self.assertEqual(self.sleeps, [3.0])
+
+    def test_retries_used_up(self):
+        self.server.answers = [self.UNAVAILABLE] * 3
+        with self.assertRaisesMessage(OcrProviderError, 'answered 503'):
+            self._process()
+        self.assertEqual(self.server.requests, 3)
+
+    def test_rejected_document_not_retried(self):
+        self.server.answers = [(400, {}, b'{}', 0)]
+        with self.assertRaisesMessage(OcrProviderError, 'rejected'):
+            self._process()
+        self.assertEqual(self.server.requests, 1)
+        # The provider is reachable
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_read_timeout_not_retried(self):
+        # The upload was sent, a retry could create and bill the same receipt twice
+        self.server.answers = [(200, {}, b'{}', 0.5), self.OK]
+        with self.assertRaisesMessage(OcrProviderError, 'did not answer'):
+            self._process()
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_breaker_opens_and_recovers(self):
+        self.server.answers = [self.UNAVAILABLE] * 6
+        for _ in range(2):
+            with self.assertRaises(OcrProviderError):
+                self._process()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        # Fails fast without contacting the provider
+        with self.assertRaises(CircuitOpenError):
+            self._process()
+        self.assertEqual(self.server.requests, 6)
+
+        # After the reset timeout a single trial call is let through and closes the circuit
+        self.now += 30
+        self.server.answers = [self.OK]
+        self.assertEqual(self._process(), {'total': 12.5})
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+
+        # Broken responses and invalid JSON end a trial call like any other failure
+        for answers in ([(200, {}, None, 0)], [(200, {}, b'not json', 0)]):
+            with self.subTest(answers=answers[0]):
+                self.server.answers = answers
+                with self.assertRaises(OcrProviderError):
+                    self._process()
+                self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+                self.now += 30
+
+        self.server.answers = [self.OK]
+        self.assertEqual(self._process(), {'total': 12.5})
+
+    def test_unexpected_error_recorded(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        with mock.patch.object(self.ocr_client.session, 'post', side_effect=RuntimeError('boom')), \
+                self.assertRaises(RuntimeError):
+            self._process()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+
+class LogQueueTests(SimpleTestCase):
+
+    def _record(self, name, level=logging.INFO):
+        return logging.LogRecord(name, level, __file__, 0, "message", None, None)
+
+    def test_sampling(self):
+        sampling = SamplingFilter({'billova_app.permissions': 10})
+        kept = [sampling.filter(self._record('billova_app.permissions.child')) for _ in range(100)]
+        self.assertEqual(kept.count(True), 10)
+        self.assertTrue(all(sampling.filter(self._record('billova_app.permissions', logging.WARNING))
+                            for _ in range(10)))
+        self.assertTrue(all(sampling.filter(self._record('billova_app.api_views')) for _ in range(10)))
+
+    def test_sampling_shared_by_handlers(self):
+        # Every handler of a record sees the same decision
+        sampling = SamplingFilter({'billova_app': 2})
+        for _ in range(10):
+            record = self._record('billova_app')
+            self.assertEqual(sampling.filter(record), sampling.filter(record))
+
+    def test_queue_routes_to_handlers(self):
+        log_queue = queue.SimpleQueue()
+        info_handler = BufferingHandler(100)
+        warning_handler = BufferingHandler(100)
+        warning_handler.setLevel(logging.WARNING)
+        listener = _RoutingQueueListener(log_queue)
+        listener.start()
+        try:
+            handler = _RoutingQueueHandler(log_queue, [info_handler, warning_handler])
+            handler.handle(self._record('billova_app'))
+            handler.handle(self._record('billova_app', logging.ERROR))
+        finally:
+            listener.stop()
+        self.assertEqual(len(info_handler.buffer), 2)
+        self.assertEqual([record.levelno for record in warning_handler.buffer], [logging.ERROR])
+
+    def test_queue_bounded(self):
+        # Without a listener nothing is taken off the queue, records beyond its size are dropped instead of blocking
+        log_queue = queue.Queue(2)
+        handler = _RoutingQueueHandler(log_queue, [BufferingHandler(100)])
+        for _ in range(5):
+            handler.handle(self._record('billova_app'))
+        self.assertEqual(log_queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+
+        # The listener stops after writing the queued records, even if the queue is full
+        listener = _RoutingQueueListener(log_queue)
+        listener.start()
+        listener.stop()
+        self.assertEqual(len(handler.targets[0].buffer), 2)
+
+    def test_queue_full_keeps_errors(self):
+        log_queue = queue.Queue(1)
+        target = BufferingHandler(100)
+        handler = _RoutingQueueHandler(log_queue, [target])
+        handler.handle(self._record('billova_app'))
+        handler.handle(self._record('billova_app.permissions'))
+        handler.handle(self._record('billova_app', logging.ERROR))
+
+        # The INFO record is dropped, the ERROR record is written right away instead of waiting for room
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual([record.levelno for record in target.buffer], [logging.ERROR])
+        self.assertEqual(log_queue.qsize(), 1)
+
+
+class QueueLoggingTests(SimpleTestCase):
+    """
+    Tests of the queue logging of the process, starting from a process which did not configure it.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.multiple(log_queue_module, _queue=None, _listener=None, _started=False, _stopped=False,
+                                      _handlers=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(stop_queue_logging)
+
+        self.logger = logging.getLogger(f'billova_app_tests.{self.id()}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.target = BufferingHandler(100)
+        self.logger.addHandler(self.target)
+        self.addCleanup(lambda: self.logger.handlers.clear())
+
+    def test_listener_started_by_first_record(self):
+        with mock.patch('atexit.register'):
+            start_queue_logging([self.logger.name])
+        # Nothing runs until the process logs, a pre-forking server forks its workers without a listener thread
+        self.assertIsNone(log_queue_module._listener)
+
+        self.logger.info("first")
+        self.assertIsNotNone(log_queue_module._listener)
+        stop_queue_logging()
+        self.assertEqual([record.getMessage() for record in self.target.buffer], ["first"])
+
+        # Records logged after the listener stopped are dropped, no listener is started again
+        self.logger.info("late")
+        self.assertIsNone(log_queue_module._listener)
+        self.assertEqual(len(self.target.buffer), 1)
+
+    @override_settings(BILLOVA_LOG_QUEUE_SIZE=1)
+    def test_dropped_records_reported(self):
+        with mock.patch('atexit.register'):
+            start_queue_logging([self.logger.name])
+        # The listener is kept from taking records off the queue, so only the first one fits
+        with mock.patch.object(_RoutingQueueListener, 'start'):
+            for i in range(3):
+                self.logger.info(f"record {i}")
+        log_queue_module._listener = None
+        stop_queue_logging()
+        self.assertEqual([record.getMessage() for record in self.target.buffer],
+                         ["2 log records dropped, the log queue was full."])
+
+    def test_sampling_before_queue(self):
+        sampling = SamplingFilter({self.logger.name: 10})
+        other_target = BufferingHandler(100)
+        self.logger.addHandler(other_target)
+        for target in (self.target, other_target):
+            target.addFilter(sampling)
+        with mock.patch('atexit.register'):
+            start_queue_logging([self.logger.name])
+
+        # Sampled out records are never queued, the listener is kept from taking records off the queue
+        with mock.patch.object(_RoutingQueueListener, 'start'):
+            for i in range(100):
+                self.logger.info(f"record {i}")
+        self.assertEqual(log_queue_module._queue.qsize(), 10)
+        self.assertEqual(self.target.filters, [])
+        log_queue_module._listener = None
+
+    @skipUnless(hasattr(os, 'fork'), "The platform cannot fork.")
+    def test_forked_worker(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'worker.log')
+        self.logger.removeHandler(self.target)
+        self.logger.addHandler(logging.FileHandler(path))
+        self.addCleanup(lambda: [handler.close() for handler in self.logger.handlers])
+
+        # Like `gunicorn --preload`: the parent configures logging and logs before forking
+        with mock.patch('atexit.register'):
+            start_queue_logging([self.logger.name])
+        self.logger.info("parent")
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self.logger.info("worker")
+                stop_queue_logging()
+                status = 0
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        stop_queue_logging()
+
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        with open(path) as file:
+            self.assertEqual(sorted(file.read().split()), ["parent", "worker"])
@@ -18,6 +18,8 @@ router.register(r'expenses', api_views.ExpenseViewSet, basename='expense')
 router.register(r'categories', api_views.CategoryViewSet, basename='category')
 router.register(r'usersettings', api_views.UserSettingsViewSet, basename='usersettings')
 router.register(r'monthlyExpenses', api_views.MonthlyExpensesViewSet, basename='monthlyExpenses')
+router.register(r'ocrJobs', api_views.OcrJobViewSet, basename='ocrjob')
+router.register(r'analytics', api_views.AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
 
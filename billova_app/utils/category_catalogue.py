@@ -0,0 +1,59 @@
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from billova_app.models import Category
+from billova_app.utils.global_resolver import get_global_user_id
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'billova:categories'
+# Increased whenever a global category changes, which invalidates the catalogues of all users at once
+GLOBAL_GENERATION_KEY = f'{CACHE_KEY_PREFIX}:global-generation'
+
+
+def _get_cache_key(user_id):
+    return f'{CACHE_KEY_PREFIX}:{user_id}'
+
+
+def get_category_catalogue(user):
+    """
+    Returns the categories of the user and the global categories, ordered by name, with their owners loaded.
+
+    The list is kept in Django's cache per user, a hit costs a single cache lookup and no query. Entries are
+    invalidated by the signals in `billova_app.signals` and expire after `BILLOVA_CATEGORY_CACHE_TTL` seconds.
+    """
+    cache_key = _get_cache_key(user.id)
+    cached = cache.get_many([cache_key, GLOBAL_GENERATION_KEY])
+    generation = cached.get(GLOBAL_GENERATION_KEY, 0)
+    entry = cached.get(cache_key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+
+    categories = list(
+        Category.objects.filter(owner_id__in=[user.id, get_global_user_id()]).select_related('owner'))
+    cache.set(cache_key, (generation, categories), settings.BILLOVA_CATEGORY_CACHE_TTL)
+    logger.debug(f"Category catalogue of user {user} loaded: {len(categories)} categories")
+    return categories
+
+
+def invalidate_category_catalogue(owner_id):
+    """
+    Drops the cached catalogue of the given user, or of all users if the global user is given.
+    """
+    try:
+        is_global = owner_id == get_global_user_id()
+    except User.DoesNotExist:
+        is_global = False
+    if not is_global:
+        cache.delete(_get_cache_key(owner_id))
+        return
+
+    try:
+        cache.incr(GLOBAL_GENERATION_KEY)
+    except ValueError:
+        # The generation expired or was never set. Start from a value no stored entry can carry.
+        cache.add(GLOBAL_GENERATION_KEY, time.time_ns(), timeout=None)
@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from billova_app.models import Category
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_USERNAME = 'global'
+
+_lock = threading.Lock()
+_global_user = None
+_global_categories = None
+_loaded_at = 0.0
+
+
+def _is_expired():
+    return time.monotonic() - _loaded_at > settings.BILLOVA_GLOBAL_CACHE_TTL
+
+
+def get_global_user():
+    """
+    Returns the "global" user owning the categories shared by all users.
+
+    The user is loaded once per process and kept until it changes (see the signals in `billova_app.signals`)
+    or `BILLOVA_GLOBAL_CACHE_TTL` seconds passed, which bounds the staleness in other processes.
+    Raises `User.DoesNotExist` if there is no global user.
+    """
+    global _global_user, _global_categories, _loaded_at
+    with _lock:
+        if _global_user is None or _is_expired():
+            _global_user = User.objects.get(username=GLOBAL_USERNAME)
+            _global_categories = None
+            _loaded_at = time.monotonic()
+            logger.debug(f"Global user loaded: {_global_user.id}")
+        return _global_user
+
+
+def get_global_user_id():
+    return get_global_user().id
+
+
+def get_global_categories():
+    """
+    Returns the categories of the global user as a dictionary mapping names to categories, loaded once per process
+    and invalidated like the global user.
+    """
+    global _global_categories
+    global_user = get_global_user()
+    with _lock:
+        if _global_categories is None:
+            categories = Category.objects.filter(owner_id=global_user.id)
+            _global_categories = {}
+            for category in categories:
+                category.owner = global_user
+                _global_categories[category.name] = category
+            logger.debug(f"Loaded {len(_global_categories)} global categories.")
+        return _global_categories
+
+
+def invalidate_global_categories():
+    global _global_categories
+    with _lock:
+        _global_categories = None
+
+
+def invalidate_global_user():
+    global _global_user, _global_categories
+    with _lock:
+        _global_user = None
+        _global_categories = None
+
+
+def is_global_user_id(user_id):
+    """
+    Returns whether the given id belongs to the cached global user, without loading it.
+    """
+    return _global_user is not None and _global_user.id == user_id
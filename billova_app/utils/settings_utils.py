@@ -1,11 +1,16 @@
 import logging
+from functools import lru_cache
 
-from babel import Locale
+from babel import Locale, UnknownLocaleError
 from babel.numbers import get_currency_name
+from pytz import all_timezones
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Currencies users can choose from
+CURRENCY_CODES = ("USD", "EUR", "GBP", "JPY", "TRY", "RON")  # Add more codes as needed
+
 
 def get_current_currencies(language='en'):
     """
@@ -44,22 +49,64 @@ def get_current_currencies(language='en'):
     return current_currencies
 
 
+def _get_currency_name(code, language=None):
+    try:
+        # Without a language babel uses the default locale of the process
+        return get_currency_name(code, locale=language) if language else get_currency_name(code)
+    except Exception as e:
+        logger.warning("Error retrieving currency name for %s in language %s: %s", code, language, e)
+        return code
+
+
+def get_language_code(language, language_choices, default='en'):
+    """
+    Returns the code of a language of the given (code, name) choices, for a stored code or name, e.g. 'de' for
+    'German'. Older settings store the name of the language. Unknown values give the default code.
+    """
+    for code, name in language_choices:
+        if language in (code, name):
+            return code
+    return default
+
+
+@lru_cache(maxsize=None)
+def get_localized_currency_choices(language):
+    """
+    Returns the currency choices as a tuple of (currency_code, currency_name) tuples with the names in the given
+    language. Computed once per process and language.
+    """
+    try:
+        Locale.parse(language)
+    except (ValueError, UnknownLocaleError):
+        logger.warning("Unknown language %s for the currency choices, using English.", language)
+        language = 'en'
+    return tuple((code, _get_currency_name(code, language)) for code in CURRENCY_CODES)
+
+
+@lru_cache(maxsize=None)
+def _get_default_currency_choices():
+    return [(code, _get_currency_name(code)) for code in CURRENCY_CODES]
+
+
 def get_currency_choices(languages):
     """
     Generates a list of currency choices from the provided languages.
-    Each choice is a tuple (currency_code, currency_name).
+    Each choice is a tuple (currency_code, currency_name), the names are in the default locale.
+
+    The localized names of all the given languages are computed up front, so `get_localized_currency_choices`
+    does not call babel while serving requests.
+    """
+    for language, _ in languages:
+        get_localized_currency_choices(language)
+
+    choices = _get_default_currency_choices()
+    logger.debug("Generated %d currency choices for %d languages.", len(choices), len(languages))
+    return list(choices)
+
+
+@lru_cache(maxsize=None)
+def get_timezone_choices():
+    """
+    Returns the time zone choices as a tuple of (time_zone, time_zone) tuples, computed once per process.
     """
-    logger.info("Generating currency choices for languages: %s", languages)
-    currency_codes = ["USD", "EUR", "GBP", "JPY", "TRY", "RON"]  # Add more codes as needed
-    choices = []
-    for code in currency_codes:
-        try:
-            currency_name = get_currency_name(code)  # Get the human-readable name
-            choices.append((code, currency_name))  # Create the (value, name) tuple
-            logger.debug("Added choice: %s for : %s", code, currency_name)
-        except Exception as e:
-            print(f"Error retrieving currency name for {code}: {e}")
-            logger.warning("Error retrieving currency name for %s in language %s", code, e)
-
-    logger.info("Generated %d currency choices.", len(choices))
-    return choices
+    return tuple((tz, tz) for tz in all_timezones)
@@ -0,0 +1,86 @@
+from functools import wraps
+
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from billova_app.models import DataVersion
+from billova_app.utils.global_resolver import get_global_user_id
+
+
+def bump_data_versions(owner_ids):
+    """
+    Increases the data version of the given users, invalidating the ETags of their expense, category and monthly
+    expense responses. Called by the signal handlers and by code paths bypassing them, e.g. `bulk_create`.
+    """
+    owner_ids = {owner_id for owner_id in owner_ids if owner_id is not None}
+    if not owner_ids:
+        return
+
+    now = timezone.now()
+    # A single UPDATE for users whose data changed before, which are almost all of them
+    updated = DataVersion.objects.filter(owner_id__in=owner_ids).update(version=F('version') + 1, modified_at=now)
+    if updated < len(owner_ids):
+        existing = set(DataVersion.objects.filter(owner_id__in=owner_ids).values_list('owner_id', flat=True))
+        DataVersion.objects.bulk_create(
+            [DataVersion(owner_id=owner_id, version=1, modified_at=now) for owner_id in owner_ids - existing],
+            ignore_conflicts=True,
+        )
+
+
+def get_data_versions(owner_ids):
+    """
+    Returns the data versions of the given users as a dict mapping the user id to (version, modified_at).
+    Users whose data never changed are missing.
+    """
+    return {
+        owner_id: (version, modified_at)
+        for owner_id, version, modified_at in
+        DataVersion.objects.filter(owner_id__in=owner_ids).values_list('owner_id', 'version', 'modified_at')
+    }
+
+
+def _get_request_versions(request):
+    # The ETag and the Last-Modified function of a request share one query. The responses contain the global
+    # categories too, so the version of the global user is part of them.
+    if not hasattr(request, '_data_versions'):
+        try:
+            owner_ids = [request.user.id, get_global_user_id()]
+        except User.DoesNotExist:
+            owner_ids = [request.user.id]
+        versions = get_data_versions(owner_ids)
+        request._data_versions = [versions.get(owner_id) for owner_id in owner_ids]
+    return request._data_versions
+
+
+def data_version_etag(request, *args, **kwargs):
+    versions = [str(version[0]) if version else '0' for version in _get_request_versions(request)]
+    # The browsable API and JSON are different representations of the same URL
+    renderer = getattr(request, 'accepted_renderer', None)
+    media_format = renderer.format if renderer else ''
+    return '-'.join([str(request.user.id), *versions, media_format])
+
+
+def data_version_last_modified(request, *args, **kwargs):
+    modified = [version[1] for version in _get_request_versions(request) if version]
+    return max(modified) if modified else None
+
+
+def conditional_on_data_version(view_func):
+    """
+    Decorates a read-only API handler with conditional GET support based on the data version of the user: the
+    response carries an ETag and Last-Modified, and a matching `If-None-Match` / `If-Modified-Since` is answered
+    with 304 before the handler runs a query. Use it with `method_decorator` on viewset actions.
+    """
+    conditional_view = condition(etag_func=data_version_etag, last_modified_func=data_version_last_modified)(view_func)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        # Browsers may keep the response, but have to revalidate it on every use
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return wrapper
@@ -4,10 +4,13 @@ from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import TemplateView
 
-from billova_app.models import UserSettings
+from billova_app.models import UserSettings, MonthlySpend
 
 logger = logging.getLogger(__name__)
 
+# Number of months shown in the spending summary
+RECENT_MONTHS = 6
+
 
 class AccountOverviewView(LoginRequiredMixin, TemplateView):
     template_name = "Billova/account_overview.html"
@@ -32,4 +35,17 @@ class AccountOverviewView(LoginRequiredMixin, TemplateView):
             messages.error(self.request,
                            "An error occurred while loading your account overview. Please try again later.")
 
+        # Monthly totals are read from the precomputed monthly spend rollup
+        recent_months = list(
+            MonthlySpend.objects.filter(owner=user, category__isnull=True)
+            .values_list('month', flat=True)
+            .distinct()
+            .order_by('-month')[:RECENT_MONTHS]
+        )
+        context['monthly_spending'] = (
+            MonthlySpend.objects.filter(owner=user, category__isnull=True, month__in=recent_months)
+            .values('month', 'currency', 'total', 'expense_count')
+            .order_by('-month', 'currency')
+        )
+
         return context
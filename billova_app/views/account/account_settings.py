@@ -7,11 +7,10 @@ from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from django.views.generic import TemplateView, UpdateView
 from django.views.generic.edit import FormView
-from pytz import all_timezones
 
 from billova_app.forms import UserSettingsForm, UserForm, ProfilePictureForm
 from billova_app.models import UserSettings
-from billova_app.utils.settings_utils import get_currency_choices
+from billova_app.utils.settings_utils import get_language_code, get_localized_currency_choices, get_timezone_choices
 
 logger = logging.getLogger(__name__)
 
@@ -38,28 +37,17 @@ class AccountSettingsView(LoginRequiredMixin, TemplateView):
                 logger.info(f"Default UserSettings created for user {self.request.user}.")
                 messages.info(self.request, "Default user settings have been created.")
 
-            # Define popular languages and numeric formats
-            popular_languages = [
-                ("en", "English"), ("de", "German"), ("fr", "French"),
-                ("es", "Spanish"), ("it", "Italian"), ("ro", "Romanian"), ("tr", "Turkish"),
-            ]
-            numeric_formats = [
-                ("AT", "Austrian"), ("DE", "German"), ("CH", "Swiss"),
-                ("US", "American"), ("UK", "British"),
-            ]
-
-            # Generate currency choices
-            CURRENCY_CHOICES = get_currency_choices(popular_languages)
-
-            # Add settings and choices to the context
+            # The choice tables are computed once per process and language code, see
+            # `billova_app.utils.settings_utils`
+            language = get_language_code(user_settings.language, UserSettings.LANGUAGE_CHOICES)
             context.update({
-                "timezone_choices": [(tz, tz) for tz in all_timezones],
-                "language_choices": popular_languages,
-                "numeric_format_choices": numeric_formats,
-                "currency_choices": CURRENCY_CHOICES,
+                "timezone_choices": get_timezone_choices(),
+                "language_choices": UserSettings.LANGUAGE_CHOICES,
+                "numeric_format_choices": UserSettings.NUMERIC_FORMAT_CHOICES,
+                "currency_choices": get_localized_currency_choices(language),
                 "current_settings": {
                     "timezone": user_settings.timezone,
-                    "language": user_settings.language,
+                    "language": language,
                     "numeric_format": user_settings.numeric_format,
                     "currency": user_settings.currency,
                 },
@@ -74,19 +62,10 @@ class AccountSettingsView(LoginRequiredMixin, TemplateView):
 
             # Fallback to default settings in case of error
             context.update({
-                "timezone_choices": [(tz, tz) for tz in all_timezones],
-                "language_choices": [
-                    ("en", "English"), ("de", "German"), ("fr", "French"),
-                    ("es", "Spanish"), ("it", "Italian"), ("ro", "Romanian"), ("tr", "Turkish"),
-                ],
-                "numeric_format_choices": [
-                    ("AT", "Austrian"), ("DE", "German"), ("CH", "Swiss"),
-                    ("US", "American"), ("UK", "British"),
-                ],
-                "currency_choices": get_currency_choices([
-                    ("en", "English"), ("de", "German"), ("fr", "French"),
-                    ("es", "Spanish"), ("it", "Italian"), ("ro", "Romanian"), ("tr", "Turkish"),
-                ]),
+                "timezone_choices": get_timezone_choices(),
+                "language_choices": UserSettings.LANGUAGE_CHOICES,
+                "numeric_format_choices": UserSettings.NUMERIC_FORMAT_CHOICES,
+                "currency_choices": get_localized_currency_choices("en"),
                 "current_settings": {
                     "timezone": "UTC",
                     "language": "en",